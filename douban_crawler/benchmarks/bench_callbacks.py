@@ -0,0 +1,308 @@
+"""爬虫回调与管道的离线微基准
+
+用法（在 douban_crawler 项目目录下）:
+    python -m benchmarks.bench_callbacks [--iterations 2000] [--only parse,parse_detail]
+                                          [--output results.json] [--compare old.json]
+
+用 fixtures/ 中录制的 top_list JSON、详情页和预告片页面构造 TextResponse/HtmlResponse，
+Redis 换成进程内的 fakeredis（通过 lupa 执行真实的 Lua 脚本），不访问网络。每个用例报告:
+    - ops/s         吞吐（只计被测调用本身）
+    - p50 / p99     单次调用延迟（微秒）
+    - alloc KiB     单次调用的峰值内存分配（tracemalloc，单独一轮测量）
+结果保存为 JSON（默认 benchmarks/results/<git 提交>.json），--compare 指定旧结果文件即可对比。
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import fakeredis
+from scrapy import Request
+from scrapy.http import HtmlResponse, TextResponse
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from scrapy.utils.test import get_crawler
+from tabulate import tabulate
+
+from douban_crawler.dedup import MovieIdDeduper
+from douban_crawler.items import DoubanMovieItem
+from douban_crawler.metastore import MovieMetaStore
+from douban_crawler.pagination import PaginationPlanner
+from douban_crawler.pipelines import CustomFilesPipeline, DoubanCsvPipeline
+from douban_crawler.quota import QuotaAllocator
+from douban_crawler.redis_client import RedisClient
+from douban_crawler.spiders.douban_spider import DoubanSpider
+from douban_crawler.target import TargetCounter
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def load_top_lists():
+    """fixtures/top_list_{类型}_{区间}_{起始}.json -> [(url, body)]"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, 'top_list_*.json'))):
+        movie_type, interval_id, start = os.path.basename(path)[len('top_list_'):-len('.json')].split('_')
+        url = DoubanSpider.build_url(None, movie_type, interval_id.replace('-', ':'), start)
+        with open(path, 'rb') as f:
+            pages.append((url, f.read()))
+    return pages
+
+
+def load_pages(prefix, url_format):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, f'{prefix}_*.html'))):
+        page_id = os.path.basename(path)[len(prefix) + 1:-len('.html')]
+        with open(path, 'rb') as f:
+            pages.append((url_format.format(page_id), f.read()))
+    return pages
+
+
+def sample_meta(movie_id='1292052'):
+    """parse 生成的 meta（详情页、预告片页和管道用例共用）"""
+    return {
+        'id': movie_id,
+        'title': '肖申克的救赎 The Shawshank Redemption',
+        'score': '9.7',
+        'vote_count': 3211486,
+        'actor_count': 25,
+        'url': f'https://movie.douban.com/subject/{movie_id}/',
+        'genres': ['剧情', '犯罪'],
+        'regions': ['美国'],
+        'release_date': '1994-09-10',
+        'has_trailer': True,
+        'has_cover': True,
+        'cover': 'https://img3.doubanio.com/view/photo/s_ratio_poster/public/p480747492.jpg',
+        'trailer': 'https://vt1.doubanio.com/202001021917/01b91ce2e71fd7f671e226ffe8ea0cda/view/movie/M/301080757.mp4',
+        'hot_comments': ['希望让人自由。', '强者自救，圣者渡人。'],
+        'summary': '一场谋杀案使银行家安迪蒙冤入狱。',
+        'cover_path': 'cover/肖申克的救赎 The Shawshank Redemption_1292052.jpg',
+        'trailer_path': 'trailer/肖申克的救赎 The Shawshank Redemption_1292052.mp4',
+    }
+
+
+def sample_item():
+    item = DoubanMovieItem()
+    for key, value in sample_meta().items():
+        item[key] = value
+    return item
+
+
+def drain(agen):
+    """同步驱动不会真正挂起的异步生成器回调，返回产出的全部结果"""
+    results = []
+    while True:
+        step = agen.asend(None)
+        try:
+            step.send(None)
+        except StopIteration as stop:
+            results.append(stop.value)
+        except StopAsyncIteration:
+            return results
+        else:
+            step.close()
+            raise RuntimeError('回调在基准中挂起，Redis操作应同步完成')
+
+
+class Bench:
+    """搭建被测的爬虫和管道，并为每个用例准备（不计时的）调用参数"""
+
+    def __init__(self, settings, workdir):
+        settings = dict(settings, FILES_STORE=os.path.join(workdir, 'files'),
+                        MEDIA_REGISTRY_ENABLED=False, LOG_ENABLED=False)
+        install_reactor(settings['TWISTED_REACTOR'])
+        self.crawler = get_crawler(DoubanSpider, settings)
+        self.spider = DoubanSpider.from_crawler(self.crawler)
+        self.crawler.spider = self.spider
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        # pool_size=0: Redis操作在当前线程同步执行，协程回调无需事件循环即可驱动
+        self.spider.redis = RedisClient(self.redis, pool_size=0)
+        self.spider.redis_conn = self.spider.server = self.redis
+        self.spider.movie_deduper = MovieIdDeduper.from_settings(self.redis, self.crawler.settings)
+        self.spider.target_counter = TargetCounter.from_settings(self.redis, self.crawler.settings)
+        self.spider.movie_meta = MovieMetaStore.from_settings(self.redis, self.crawler.settings)
+        self.spider.quota = QuotaAllocator.from_settings(self.redis, self.spider.target_counter,
+                                                         self.crawler.settings)
+        self.spider.priority = type(self.spider.priority).from_settings(self.redis, self.spider.target_counter,
+                                                                        self.crawler.settings)
+
+        self.files_pipeline = CustomFilesPipeline.from_crawler(self.crawler)
+        self.files_pipeline.open_spider(self.spider)
+        self.csv_pipeline = DoubanCsvPipeline()
+        self.csv_pipeline.open_spider(self.spider)
+
+        self.top_lists = load_top_lists()
+        self.details = load_pages('detail', 'https://movie.douban.com/subject/{}/')
+        self.videos = load_pages('video', 'https://movie.douban.com/trailer/{}/')
+        self._counter = 0
+
+    def close(self):
+        self.csv_pipeline.close_spider(self.spider)
+
+    def cases(self):
+        """用例名 -> (准备参数, 被测调用)"""
+        return {
+            'parse': (self.parse_args, lambda response: drain(self.spider.parse(response))),
+            'parse_detail': (self.detail_args, lambda response: drain(self.spider.parse_detail(response))),
+            'parse_video': (self.video_args, lambda response: drain(self.spider.parse_video(response))),
+            'create_item_from_dict': (lambda: (DoubanMovieItem, sample_meta()), self.spider.create_item_from_dict),
+            'files_pipeline.file_path': (self.file_path_args, self.file_path),
+            'csv_pipeline.process_item': (lambda: (sample_item(), self.spider), self.csv_pipeline.process_item),
+        }
+
+    def _next(self, pages):
+        self._counter += 1
+        return pages[self._counter % len(pages)]
+
+    def parse_args(self):
+        # 每次都当作首次见到这些电影，保证每页都会生成详情页请求
+        self.spider.movie_deduper._seen.clear()
+        self.redis.delete(self.spider.movie_deduper.key)
+        self.spider.pagination = PaginationPlanner.from_settings(self.redis, DoubanSpider.INTERVALS,
+                                                                 self.crawler.settings)
+        url, body = self._next(self.top_lists)
+        return (TextResponse(url, body=body, encoding='utf-8', request=Request(url)),)
+
+    def detail_args(self):
+        return self._movie_response(self.details)
+
+    def video_args(self):
+        return self._movie_response(self.videos)
+
+    def _movie_response(self, pages):
+        # 与 parse 生成的请求一致：电影数据在旁路存储中，请求只携带id
+        url, body = self._next(pages)
+        meta = sample_meta()
+        self.spider.movie_meta.put(meta)
+        request = Request(url, meta={'movie_id': meta['id']})
+        return (HtmlResponse(url, body=body, encoding='utf-8', request=request),)
+
+    def file_path_args(self):
+        media_type = ('cover', 'trailer')[self._counter % 2]
+        self._counter += 1
+        request = Request(sample_meta()[media_type], meta={'type': media_type})
+        return request, sample_item()
+
+    def file_path(self, request, item):
+        return self.files_pipeline.file_path(request, item=item)
+
+
+def measure(prepare, call, iterations, warmup):
+    for _ in range(warmup):
+        call(*prepare())
+
+    latencies = []
+    for _ in range(iterations):
+        args = prepare()
+        start = time.perf_counter_ns()
+        call(*args)
+        latencies.append(time.perf_counter_ns() - start)
+
+    # 内存分配单独测量，tracemalloc 会显著拖慢执行
+    peaks = []
+    tracemalloc.start()
+    for _ in range(max(iterations // 10, 1)):
+        args = prepare()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        call(*args)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    latencies.sort()
+    total_seconds = sum(latencies) / 1e9
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / total_seconds, 1),
+        'mean_us': round(statistics.fmean(latencies) / 1000, 2),
+        'p50_us': round(percentile(latencies, 50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 99) / 1000, 2),
+        'alloc_kib': round(statistics.fmean(peaks) / 1024, 2),
+    }
+
+
+def percentile(sorted_values, pct):
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results, baseline=None):
+    rows = []
+    for name, result in results.items():
+        row = [name, result['ops_per_sec'], result['p50_us'], result['p99_us'], result['alloc_kib']]
+        old = (baseline or {}).get(name)
+        if old:
+            row.append(f"{(result['ops_per_sec'] / old['ops_per_sec'] - 1) * 100:+.1f}%")
+            row.append(f"{(result['p99_us'] / old['p99_us'] - 1) * 100:+.1f}%")
+        rows.append(row)
+    headers = ['用例', 'ops/s', 'p50 (us)', 'p99 (us)', 'alloc KiB']
+    if baseline:
+        headers += ['ops/s 变化', 'p99 变化']
+    print(tabulate(rows, headers=headers, tablefmt='grid'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='每个用例的计时调用次数')
+    parser.add_argument('--warmup', type=int, default=100, help='每个用例的预热调用次数')
+    parser.add_argument('--only', default='', help='只运行指定用例（逗号分隔）')
+    parser.add_argument('--output', help='结果文件路径（默认 benchmarks/results/<git 提交>.json）')
+    parser.add_argument('--compare', help='与之前保存的结果文件对比')
+    args = parser.parse_args()
+
+    revision = git_revision()
+    settings = get_project_settings().copy_to_dict()
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # CSV 管道写入相对路径 data/，在临时目录中运行
+        os.makedirs(os.path.join(workdir, 'data'))
+        os.chdir(workdir)
+        try:
+            bench = Bench(settings, workdir)
+            selected = [name for name in args.only.split(',') if name]
+            results = {}
+            for name, (prepare, call) in bench.cases().items():
+                if selected and name not in selected:
+                    continue
+                results[name] = measure(prepare, call, args.iterations, args.warmup)
+            bench.close()
+        finally:
+            os.chdir(original_dir)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{revision}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'revision': revision,
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {output}")
+
+
+if __name__ == '__main__':
+    main()
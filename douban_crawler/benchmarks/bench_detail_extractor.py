@@ -0,0 +1,95 @@
+"""详情页提取基准: 原 CSS 选择器实现 vs 单次遍历的预编译提取器
+
+用法（在 douban_crawler 项目目录下）:
+    python -m benchmarks.bench_detail_extractor [--rounds 200]
+
+先校验两种实现在所有样例页面上的结果完全一致，再分别统计
+“含 HTML 解析”和“仅提取（文档已解析）”两种情况下的 pages/sec。
+"""
+import argparse
+import glob
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from douban_crawler.extractors import clean_summary, extract_detail
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def legacy_extract(response):
+    """原 parse_detail 中的提取逻辑（逐条 CSS 查询）"""
+    cover = response.css('meta[property="og:image"]::attr(content)').get()
+    hot_comments = response.css('div#hot-comments span.short::text').getall()
+    intro_text = ' '.join(
+        response.css('#link-report-intra .all.hidden *::text').getall() or
+        response.css('#link-report-intra [property="v:summary"] *::text').getall() or
+        response.css('#link-report-intra .short [property="v:summary"] *::text').getall() or
+        response.css('#link-report-intra .indent *::text').getall()
+    )
+    trailer_url = response.css('a.related-pic-video::attr(href)').get()
+    return cover, hot_comments, clean_summary(intro_text), trailer_url
+
+
+def compiled_extract(response):
+    return tuple(extract_detail(response.selector.root))
+
+
+def load_fixtures():
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, 'detail_*.html'))):
+        with open(path, 'rb') as f:
+            body = f.read()
+        movie_id = os.path.basename(path)[len('detail_'):-len('.html')]
+        fixtures.append((f'https://movie.douban.com/subject/{movie_id}/', body))
+    return fixtures
+
+
+def make_responses(fixtures):
+    return [HtmlResponse(url, body=body, encoding='utf-8') for url, body in fixtures]
+
+
+def check_equivalence(fixtures):
+    for response in make_responses(fixtures):
+        expected = legacy_extract(response)
+        actual = compiled_extract(response)
+        if expected != actual:
+            raise AssertionError(f"提取结果不一致: {response.url}\n旧: {expected}\n新: {actual}")
+
+
+def run(extract, fixtures, rounds, parse):
+    """返回 pages/sec；parse=False 时文档预先解析好，只计提取耗时"""
+    if not parse:
+        responses = make_responses(fixtures)
+        for response in responses:
+            response.selector  # 触发解析并缓存
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if parse:
+            responses = make_responses(fixtures)
+        for response in responses:
+            extract(response)
+    elapsed = time.perf_counter() - start
+    return rounds * len(fixtures) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=200, help='每种实现遍历全部样例的轮数')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    check_equivalence(fixtures)
+    print(f"{len(fixtures)} 个样例页面结果一致\n")
+
+    print(f"{'':<12}{'legacy':>12}{'compiled':>12}{'speedup':>10}")
+    for label, parse in (('含解析', True), ('仅提取', False)):
+        legacy = run(legacy_extract, fixtures, args.rounds, parse)
+        compiled = run(compiled_extract, fixtures, args.rounds, parse)
+        print(f"{label:<12}{legacy:>12.1f}{compiled:>12.1f}{compiled / legacy:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# 测试在同一进程内构造 crawler，需要先安装 reactor（使用默认 reactor，协程由 Deferred 驱动）
+from twisted.internet import reactor  # noqa: F401
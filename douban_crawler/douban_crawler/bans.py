@@ -0,0 +1,258 @@
+import logging
+import random
+import time
+import weakref
+from typing import Dict
+from urllib.parse import urlparse
+
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+from douban_crawler.leased_queue import get_queue, request_discarded
+from douban_crawler.redis_client import RedisClient
+from douban_crawler.utils import get_host_class
+
+
+logger = logging.getLogger(__name__)
+
+# 响应分类
+OK = 'ok'
+EMPTY = 'empty'  # 空响应/截断的页面
+RATE_LIMITED = 'rate_limited'  # 429
+CAPTCHA = 'captcha'  # 跳转验证码/登录页
+SOFT_BAN = 'soft_ban'  # 403、异常请求提示页、API 返回 HTML
+BAN_CLASSES = frozenset((RATE_LIMITED, CAPTCHA, SOFT_BAN))
+
+# 跳转到这些主机说明触发了风控
+CAPTCHA_HOSTS = ('sec.douban.com', 'accounts.douban.com')
+# 只在较小的 HTML 响应中查找的标记（正常详情页远大于此）
+MARKER_SCAN_BYTES = 16 * 1024
+CAPTCHA_MARKERS = (b'captcha', '验证码'.encode())
+SOFT_BAN_MARKERS = ('检测到有异常请求'.encode(), '禁止访问'.encode())
+# 详情页/预告片页小于该字节数视为空页面
+MIN_PAGE_BYTES = 512
+
+# 由 BanMiddleware 重新入队的页面请求类型（媒体下载不经过调度队列）
+PAGE_CLASSES = ('api', 'detail', 'video')
+# 重新入队时去掉的 meta（换一个代理，从原始URL重新开始）
+STRIP_META = ('proxy', 'proxy_address', 'proxy_start_time', 'proxy_in_flight', 'download_slot',
+              'download_latency', 'redirect_urls', 'redirect_times', 'redirect_ttl', 'redirect_reasons', 'cache_entry')
+
+# crawler -> BreakerBoard
+_boards = weakref.WeakKeyDictionary()
+
+
+def classify_response(response, host_class) -> str:
+    """只看状态码、长度和少量标记的廉价分类"""
+    if response.status == 429:
+        return RATE_LIMITED
+    if urlparse(response.url).hostname in CAPTCHA_HOSTS:
+        return CAPTCHA
+    if response.status in (403, 418):
+        return SOFT_BAN
+    if response.status != 200 or host_class not in PAGE_CLASSES:
+        return OK
+    body = response.body
+    if not body.strip():
+        return EMPTY
+    if host_class == 'api':
+        return SOFT_BAN if body[:1].lstrip() == b'<' else OK
+    if len(body) <= MARKER_SCAN_BYTES:
+        head = body.lower()
+        if any(marker in head for marker in CAPTCHA_MARKERS):
+            return CAPTCHA
+        if any(marker in head for marker in SOFT_BAN_MARKERS):
+            return SOFT_BAN
+        if len(body) < MIN_PAGE_BYTES:
+            return EMPTY
+    return OK
+
+
+def original_url(request):
+    """被跳转到验证码页之前的URL"""
+    redirect_urls = request.meta.get('redirect_urls')
+    return redirect_urls[0] if redirect_urls else request.url
+
+
+class CircuitBreaker:
+    """单个主机/代理的熔断器
+
+    - 连续 threshold 次被封禁后打开，冷却 cooldown * 2^(打开次数-1) 秒（不超过 max_cooldown）
+    - 冷却结束后为半开状态：再被封禁一次立即以加倍的冷却重新打开，成功一次则完全恢复
+    """
+
+    __slots__ = ('threshold', 'cooldown', 'max_cooldown', 'failures', 'trips', 'open_until')
+
+    def __init__(self, threshold=3, cooldown=30.0, max_cooldown=1800.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    def remaining(self, now=None) -> float:
+        """距离冷却结束的秒数（未打开时为0）"""
+        return max(self.open_until - (now or time.time()), 0.0)
+
+    def record(self, banned, now=None) -> bool:
+        """记录一次结果，返回熔断器是否因此打开"""
+        now = now or time.time()
+        if not banned:
+            self.failures = 0
+            if self.trips and now >= self.open_until:
+                self.trips = 0
+            return False
+        if now < self.open_until:
+            return False  # 打开前已发出的请求
+        self.failures += 1
+        if self.failures < self.threshold and not self.trips:
+            return False
+        self.failures = 0
+        self.trips += 1
+        self.open_until = now + min(self.cooldown * 2 ** (self.trips - 1), self.max_cooldown)
+        return True
+
+    def to_dict(self) -> Dict:
+        return {'trips': self.trips, 'remaining': round(self.remaining(), 1)}
+
+
+class BreakerBoard:
+    """每个 crawler 一组熔断器（host:{主机}、proxy:{代理}），BanMiddleware 与 ProxyMiddleware 共用"""
+
+    def __init__(self, threshold=3, cooldown=30.0, max_cooldown=1800.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        board = _boards.get(crawler)
+        if board is None:
+            settings = crawler.settings
+            board = _boards[crawler] = cls(
+                threshold=settings.getint('BAN_BREAKER_THRESHOLD', 3),
+                cooldown=settings.getfloat('BAN_BREAKER_COOLDOWN', 30),
+                max_cooldown=settings.getfloat('BAN_BREAKER_MAX_COOLDOWN', 1800),
+            )
+        return board
+
+    def get(self, key) -> CircuitBreaker:
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(self.threshold, self.cooldown, self.max_cooldown)
+        return breaker
+
+    def remaining(self, key) -> float:
+        breaker = self.breakers.get(key)
+        return breaker.remaining() if breaker is not None else 0.0
+
+    def record(self, key, banned) -> bool:
+        return self.get(key).record(banned)
+
+    def to_dict(self) -> Dict:
+        return {key: breaker.to_dict() for key, breaker in self.breakers.items() if breaker.trips}
+
+
+class BanMiddleware:
+    """识别限流/验证码/封禁响应，按主机熔断，并把受影响的页面请求延迟放回Redis队列
+
+    - 响应分类见 classify_response；EMPTY 只重试，不计入熔断
+    - 主机熔断器打开期间，该主机的页面请求不再下载，直接延迟到冷却结束后重新入队
+    - 被封禁的请求去掉代理和跳转信息后以指数退避（带抖动）延迟入队，下次换一个出口；
+      超过 BAN_MAX_RETRIES 次后交给爬虫（记为 bans/gave_up）
+    - 统计: bans/{分类}、bans/rate（封禁比例的指数滑动平均）、bans/requeued、bans/deferred、
+      bans/breaker_opened、bans/breakers
+    """
+
+    RATE_ALPHA = 0.05  # bans/rate 的平滑系数
+
+    def __init__(self, crawler, board, redis, backoff=30.0, max_backoff=1800.0, max_retries=5):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.signals = crawler.signals
+        self.board = board
+        self.redis = redis
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.ban_rate = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('BAN_DETECTION_ENABLED', True):
+            raise NotConfigured
+        return cls(
+            crawler,
+            BreakerBoard.from_crawler(crawler),
+            RedisClient.from_crawler(crawler),
+            backoff=settings.getfloat('BAN_RETRY_BACKOFF', 30),
+            max_backoff=settings.getfloat('BAN_BREAKER_MAX_COOLDOWN', 1800),
+            max_retries=settings.getint('BAN_MAX_RETRIES', 5),
+        )
+
+    async def process_request(self, request, spider):
+        if get_host_class(request.url) not in PAGE_CLASSES:
+            return None
+        remaining = self.board.remaining(self._host_key(request))
+        if remaining > 0 and await self._requeue(request, remaining, retry=False):
+            self.stats.inc_value('bans/deferred')
+            self.signals.send_catch_log(request_discarded, request=request, spider=spider)
+            raise IgnoreRequest(f"主机熔断中，{remaining:.0f} 秒后重试: {request.url}")
+        return None
+
+    async def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response
+        url = original_url(request)
+        host_class = get_host_class(url)
+        result = classify_response(response, host_class)
+        banned = result in BAN_CLASSES
+        self._update_rate(result, banned)
+        if host_class not in PAGE_CLASSES:
+            return response  # 媒体下载的失败由 FilesPipeline 处理
+        key = self._host_key(request)
+        if result != EMPTY and self.board.record(key, banned):
+            breaker = self.board.get(key)
+            self.stats.inc_value('bans/breaker_opened')
+            self.stats.set_value('bans/breakers', self.board.to_dict())
+            logger.warning(f"{key} 连续被拦截，熔断 {breaker.remaining():.0f} 秒（第 {breaker.trips} 次）")
+        if result == OK:
+            return response
+
+        retries = request.meta.get('ban_retry_times', 0)
+        if retries >= self.max_retries:
+            self.stats.inc_value('bans/gave_up')
+            logger.warning(f"{url} 重试 {retries} 次后仍被拦截 ({result})，交给爬虫处理")
+            return response
+        delay = max(self.board.remaining(key), self._backoff(retries))
+        if not await self._requeue(request, delay, retry=True):
+            return response
+        self.stats.inc_value('bans/requeued')
+        logger.info(f"{url} 被拦截 ({result}, {response.status})，{delay:.0f} 秒后重新入队")
+        raise IgnoreRequest(f"{result}: {url}")
+
+    def _update_rate(self, result, banned):
+        self.stats.inc_value(f'bans/{result}')
+        self.ban_rate += self.RATE_ALPHA * (banned - self.ban_rate)
+        self.stats.set_value('bans/rate', round(self.ban_rate, 4))
+
+    def _backoff(self, retries):
+        return min(self.backoff * 2 ** retries, self.max_backoff) * random.uniform(0.8, 1.2)
+
+    async def _requeue(self, request, delay, retry) -> bool:
+        """delay 秒后重新进入队列；未使用 LeasedPriorityQueue 时返回 False（不拦截）"""
+        queue = get_queue(self.crawler)
+        if queue is None:
+            return False
+        meta = {key: value for key, value in request.meta.items() if key not in STRIP_META}
+        if retry:
+            meta['ban_retry_times'] = meta.get('ban_retry_times', 0) + 1
+        new_request = request.replace(url=original_url(request), meta=meta, dont_filter=True)
+        await self.redis.run(queue.push_delayed, new_request, delay)
+        return True
+
+    @staticmethod
+    def _host_key(request):
+        return f'host:{urlparse(original_url(request)).hostname}'
@@ -0,0 +1,233 @@
+import math
+from typing import Dict, Iterable, List
+
+from scrapy_redis.dupefilter import RFPDupeFilter
+
+
+# Redis 位图的偏移量上限为 2^32 - 1（512MB），单层位数不能超过它
+MAX_LAYER_BITS = 2 ** 32
+
+# 可扩容布隆过滤器脚本：每层一个Redis位图，当前层写满后新建更大、误判率更低的一层。
+# 哈希在服务端完成（sha1 双重哈希），各节点无需同步层参数。
+# KEYS[1]: 元数据哈希；KEYS[2..]: 第 0, 1, ... 层位图（调用方按已知层数多传一层，供扩容使用）
+# ARGV[1..5]: 初始容量, 误判率, 扩容倍数, 误判率收紧系数, 单层位数上限
+# ARGV[6]: '1' 查询并添加（返回1表示新加入），'0' 只查询（返回1表示已存在）
+# ARGV[7..]: 元素
+# 返回 {层数, 各元素结果...}：传入的层键不够（其他节点已扩容，或本批写满了多出的一层）时
+# 只处理前面的元素，调用方按返回的层数补上层键后重试剩余元素
+BLOOM_SCRIPT = """
+local meta = KEYS[1]
+local available = #KEYS - 1
+local capacity = tonumber(ARGV[1])
+local error_rate = tonumber(ARGV[2])
+local growth = tonumber(ARGV[3])
+local tightening = tonumber(ARGV[4])
+local max_bits = tonumber(ARGV[5])
+local add = ARGV[6] == '1'
+local ln2 = math.log(2)
+
+local function params(i)
+    local p = error_rate * (1 - tightening) * tightening ^ i
+    local bits_per_item = -math.log(p) / (ln2 * ln2)
+    local n = math.min(math.floor(capacity * growth ^ i), math.floor(max_bits / bits_per_item))
+    local m = math.ceil(n * bits_per_item)
+    local k = math.ceil(-math.log(p) / ln2)
+    return {n, m, k}
+end
+
+local layers = tonumber(redis.call('HGET', meta, 'layers')) or 1
+local result = {layers}
+if layers > available then
+    return result
+end
+local layer_params = {}
+for i = 0, layers - 1 do
+    layer_params[i] = params(i)
+end
+
+for idx = 7, #ARGV do
+    if layers > available then
+        break
+    end
+    local digest = redis.sha1hex(ARGV[idx])
+    local h1 = tonumber(string.sub(digest, 1, 8), 16)
+    local h2 = tonumber(string.sub(digest, 9, 16), 16)
+    local found = false
+    for i = 0, layers - 1 do
+        local m, k = layer_params[i][2], layer_params[i][3]
+        local hit = true
+        for j = 0, k - 1 do
+            if redis.call('GETBIT', KEYS[i + 2], (h1 + j * h2) % m) == 0 then
+                hit = false
+                break
+            end
+        end
+        if hit then
+            found = true
+            break
+        end
+    end
+
+    if not add then
+        result[#result + 1] = found and 1 or 0
+    elseif found then
+        result[#result + 1] = 0
+    else
+        local current = layers - 1
+        local n, m, k = layer_params[current][1], layer_params[current][2], layer_params[current][3]
+        for j = 0, k - 1 do
+            redis.call('SETBIT', KEYS[current + 2], (h1 + j * h2) % m, 1)
+        end
+        if redis.call('HINCRBY', meta, 'count:' .. current, 1) >= n then
+            layers = layers + 1
+            redis.call('HSET', meta, 'layers', layers)
+            layer_params[layers - 1] = params(layers - 1)
+        end
+        result[#result + 1] = 1
+    end
+end
+result[1] = layers
+return result
+"""
+
+
+class ScalableBloomFilter:
+    """基于Redis位图的可扩容布隆过滤器
+
+    内存只与元素数量和误判率相关（约 2MB / 百万元素 @ 0.1%），
+    不再保存完整的 SHA1 字符串。
+
+    - 第 i 层的误判率为 error_rate * (1 - r) * r^i（r 为收紧系数），
+      各层之和即整体误判率的上界，不超过 error_rate
+    - 第 i 层容量为 capacity * growth^i，但位数不超过 MAX_LAYER_BITS（Redis 位图上限），
+      到达上限后每层容量随误判率收紧而略有减小，不再扩大
+    """
+
+    def __init__(self, server, key, capacity=1000000, error_rate=0.001,
+                 growth=2, tightening=0.5, max_layer_bits=MAX_LAYER_BITS):
+        self.server = server
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.max_layer_bits = max_layer_bits
+        self.meta_key = f'{key}:meta'
+        self._layers = 1  # 已知层数（本地缓存，仅用于决定传入哪些层键）
+        self._script = server.register_script(BLOOM_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, key, settings):
+        return cls(
+            server,
+            key,
+            capacity=settings.getint('BLOOM_INITIAL_CAPACITY', 1000000),
+            error_rate=settings.getfloat('BLOOM_ERROR_RATE', 0.001),
+            growth=settings.getint('BLOOM_GROWTH', 2),
+            tightening=settings.getfloat('BLOOM_TIGHTENING_RATIO', 0.5),
+        )
+
+    def add_many(self, items: Iterable) -> List[bool]:
+        """批量添加，返回每个元素是否为新元素（一次Redis往返）"""
+        items = [str(item) for item in items]
+        if not items:
+            return []
+        return [bool(flag) for flag in self._run('1', items)]
+
+    def add(self, item) -> bool:
+        return self.add_many([item])[0]
+
+    def contains_many(self, items: Iterable) -> List[bool]:
+        items = [str(item) for item in items]
+        if not items:
+            return []
+        return [bool(flag) for flag in self._run('0', items)]
+
+    def __contains__(self, item):
+        return self.contains_many([item])[0]
+
+    def layer_params(self, index):
+        """第 index 层的 (容量, 位数, 哈希函数个数)，与 Lua 脚本保持一致"""
+        ln2 = math.log(2)
+        p = self.error_rate * (1 - self.tightening) * self.tightening ** index
+        bits_per_item = -math.log(p) / (ln2 * ln2)
+        n = min(math.floor(self.capacity * self.growth ** index), math.floor(self.max_layer_bits / bits_per_item))
+        m = math.ceil(n * bits_per_item)
+        k = math.ceil(-math.log(p) / ln2)
+        return n, m, k
+
+    def stats(self) -> Dict:
+        """各层填充率统计"""
+        layers = int(self.server.hget(self.meta_key, 'layers') or 1)
+        pipe = self.server.pipeline(transaction=False)
+        pipe.hmget(self.meta_key, [f'count:{i}' for i in range(layers)])
+        for i in range(layers):
+            pipe.bitcount(self._layer_key(i))
+        counts, *bitcounts = pipe.execute()
+
+        layer_stats = []
+        for i, bits_set in enumerate(bitcounts):
+            n, m, k = self.layer_params(i)
+            layer_stats.append({
+                'layer': i,
+                'capacity': n,
+                'count': int(counts[i] or 0),
+                'bits': m,
+                'hashes': k,
+                'memory_bytes': (m + 7) // 8,
+                'fill_ratio': bits_set / m,
+            })
+        return {
+            'key': self.key,
+            'layers': layers,
+            'count': sum(layer['count'] for layer in layer_stats),
+            'memory_bytes': sum(layer['memory_bytes'] for layer in layer_stats),
+            'layer_stats': layer_stats,
+        }
+
+    def clear(self):
+        layers = int(self.server.hget(self.meta_key, 'layers') or 1)
+        self.server.delete(self.meta_key, *[self._layer_key(i) for i in range(layers)])
+        self._layers = 1
+
+    def _layer_key(self, index):
+        return f'{self.key}:{index}'
+
+    def _run(self, mode, items):
+        results = []
+        while items:
+            keys = [self.meta_key, *[self._layer_key(i) for i in range(self._layers + 1)]]
+            args = [self.capacity, self.error_rate, self.growth, self.tightening, self.max_layer_bits, mode, *items]
+            layers, *flags = self._script(keys=keys, args=args)
+            self._layers = int(layers)
+            results += flags
+            items = items[len(flags):]
+        return results
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """使用布隆过滤器保存请求指纹的 scrapy_redis 去重器"""
+
+    def __init__(self, server, key, debug=False, bloom=None):
+        super().__init__(server, key, debug)
+        self.bloom = bloom or ScalableBloomFilter(server, f'{key}:bloom')
+
+    @classmethod
+    def from_settings(cls, settings):
+        df = super().from_settings(settings)
+        df.bloom = ScalableBloomFilter.from_settings(df.server, f'{df.key}:bloom', settings)
+        return df
+
+    @classmethod
+    def from_spider(cls, spider):
+        df = super().from_spider(spider)
+        df.bloom = ScalableBloomFilter.from_settings(df.server, f'{df.key}:bloom', spider.settings)
+        return df
+
+    def request_seen(self, request):
+        fp = self.request_fingerprint(request)
+        return not self.bloom.add(fp)
+
+    def clear(self):
+        super().clear()
+        self.bloom.clear()
@@ -0,0 +1,83 @@
+import redis
+from scrapy.commands import ScrapyCommand
+from tabulate import tabulate
+
+from douban_crawler.bloom import ScalableBloomFilter
+
+
+class Command(ScrapyCommand):
+    """把已有的 Redis 去重集合迁移到布隆过滤器，并输出填充率统计
+
+    用法:
+        scrapy bloom_migrate                # 迁移请求指纹和电影id
+        scrapy bloom_migrate --delete       # 迁移后删除原集合
+        scrapy bloom_migrate --stats-only   # 只查看填充率
+    """
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options]'
+
+    def short_desc(self):
+        return '将去重集合迁移为布隆过滤器并显示填充率'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='每批迁移的元素数量（默认5000）')
+        parser.add_argument('--delete', action='store_true',
+                            help='迁移完成后删除原集合')
+        parser.add_argument('--stats-only', action='store_true',
+                            help='不迁移，只输出过滤器统计')
+
+    def run(self, args, opts):
+        settings = self.settings
+        server = redis.Redis(
+            host=settings.get('REDIS_HOST'),
+            port=settings.get('REDIS_PORT'),
+            decode_responses=True
+        )
+        dupefilter_key = settings.get('SCHEDULER_DUPEFILTER_KEY', '%(spider)s:dupefilter') % {'spider': 'douban'}
+        movie_key = settings.get('MOVIE_ID_KEY', 'douban:movie_ids')
+
+        rows = []
+        for source_key in (dupefilter_key, movie_key):
+            bloom = ScalableBloomFilter.from_settings(server, f'{source_key}:bloom', settings)
+            if not opts.stats_only:
+                migrated = self.migrate(server, source_key, bloom, opts.batch_size)
+                print(f"{source_key} -> {bloom.key}: 迁移 {migrated} 个元素")
+                if opts.delete:
+                    server.delete(source_key)
+
+            stats = bloom.stats()
+            for layer in stats['layer_stats']:
+                rows.append([
+                    bloom.key,
+                    layer['layer'],
+                    layer['count'],
+                    layer['capacity'],
+                    f"{layer['memory_bytes'] / 1024 / 1024:.1f}MB",
+                    f"{layer['fill_ratio']:.2%}",
+                ])
+
+        print(tabulate(rows,
+                       headers=['Filter', 'Layer', 'Count', 'Capacity', 'Memory', 'Fill Ratio'],
+                       tablefmt='grid'))
+
+    @staticmethod
+    def migrate(server, source_key, bloom, batch_size):
+        """用 SSCAN 分批读取原集合，每批一次脚本调用写入过滤器"""
+        migrated = 0
+        batch = []
+        for member in server.sscan_iter(source_key, count=batch_size):
+            batch.append(member)
+            if len(batch) >= batch_size:
+                bloom.add_many(batch)
+                migrated += len(batch)
+                batch = []
+        if batch:
+            bloom.add_many(batch)
+            migrated += len(batch)
+        return migrated
@@ -0,0 +1,63 @@
+import glob
+import os
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from tabulate import tabulate
+
+from douban_crawler.moviedb import MovieDatabase
+
+
+class Command(ScrapyCommand):
+    """合并各节点的 SQLite 电影库（同一部电影保留更新时间最晚的一行）
+
+    用法:
+        scrapy sqlite_merge -o data/douban_movies.sqlite3                # 合并 SQLITE_PATH 匹配的全部节点库
+        scrapy sqlite_merge -o merged.sqlite3 a.sqlite3 b.sqlite3        # 合并指定的库
+        scrapy sqlite_merge -o data/douban_movies.sqlite3 --search 科幻片  # 合并后做一次全文检索
+    """
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options] [节点库 ...]'
+
+    def short_desc(self):
+        return '合并各节点的 SQLite 电影库'
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument('-o', '--output', default='data/douban_movies.sqlite3',
+                            help='合并后的库（已存在时合并进去，默认 data/douban_movies.sqlite3）')
+        parser.add_argument('--search', default=None,
+                            help='合并后用该关键词检索简介/短评（至少3个字）并输出前10条')
+
+    def run(self, args, opts):
+        output = os.path.abspath(opts.output)
+        sources = args or sorted(glob.glob(self.settings.get('SQLITE_PATH').format(node_id='*')))
+        sources = [path for path in sources if os.path.abspath(path) != output]
+        if not sources:
+            raise UsageError('没有找到需要合并的库')
+
+        database = MovieDatabase(output)
+        # 逐行同步全文索引很慢：合并期间去掉触发器，最后整体重建
+        database.drop_fts_triggers()
+        rows = []
+        try:
+            for path in sources:
+                start = time.perf_counter()
+                merged = database.merge(path)
+                rows.append([path, merged, f'{time.perf_counter() - start:.2f}s'])
+        finally:
+            database.rebuild_fts()
+        database.optimize()
+
+        print(tabulate(rows, headers=['Source', 'Upserted', 'Time'], tablefmt='grid'))
+        print(f"{output}: 共 {database.count()} 部电影")
+        if opts.search:
+            results = database.search(opts.search, limit=10)
+            print(tabulate([[movie['id'], movie['title'], movie['score'], movie['vote_count']] for movie in results],
+                           headers=['ID', 'Title', 'Score', 'Votes'], tablefmt='grid'))
+        database.close()
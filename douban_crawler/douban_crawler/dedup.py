@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Dict, Iterable, List
+
+from douban_crawler.bloom import ScalableBloomFilter
+
+
+# 批量认领脚本：逐个 SADD，返回本次新加入集合的 id（一次往返完成整页去重）
+# ARGV[1]: 集合的过期时间（秒，0 为不过期，只在集合尚无过期时间时设置）；ARGV[2..]: 电影id
+CLAIM_SCRIPT = """
+local claimed = {}
+for i = 2, #ARGV do
+    if redis.call('SADD', KEYS[1], ARGV[i]) == 1 then
+        claimed[#claimed + 1] = ARGV[i]
+    end
+end
+local ttl = tonumber(ARGV[1])
+if ttl > 0 and redis.call('TTL', KEYS[1]) == -1 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return claimed
+"""
+
+
+class MovieIdDeduper:
+    """电影id批量去重
+
+    - 每个API页只访问一次Redis（Lua脚本批量 SADD）
+    - 本地缓存已见过的id，本节点见过的id不再访问网络
+    - 可选布隆过滤器后端（MOVIE_ID_DEDUP_BACKEND = 'bloom'），内存不随id数量线性增长
+    - 可在Redis线程池中并发调用（本地缓存加锁）
+    - 增量模式下只在本次运行内去重：使用按运行区分的集合 {MOVIE_ID_KEY}:run:{运行id}（ttl 秒后过期），
+      上次运行见过的电影仍会交给增量判断，输出未变化的记录或重新抓取
+    """
+
+    def __init__(self, server, key='douban:movie_ids', cache_size=200000, bloom=None, ttl=0):
+        self.server = server
+        self.key = key
+        self.cache_size = cache_size
+        self.bloom = bloom
+        self.ttl = ttl
+        self._seen: Dict[str, None] = {}  # 按插入顺序淘汰的本地缓存
+        self._lock = threading.Lock()
+        self._claim_script = server.register_script(CLAIM_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        key = settings.get('MOVIE_ID_KEY', 'douban:movie_ids')
+        if settings.getbool('INCREMENTAL_MODE', False):
+            run_id = settings.get('INCREMENTAL_RUN_ID') or time.strftime('%Y%m%d', time.gmtime())
+            return cls(
+                server,
+                key=f'{key}:run:{run_id}',
+                cache_size=settings.getint('MOVIE_ID_CACHE_SIZE', 200000),
+                ttl=settings.getint('INCREMENTAL_RUN_TTL', 2 * 24 * 3600),
+            )
+        bloom = None
+        if settings.get('MOVIE_ID_DEDUP_BACKEND', 'set') == 'bloom':
+            bloom = ScalableBloomFilter.from_settings(server, f'{key}:bloom', settings)
+        return cls(
+            server,
+            key=key,
+            cache_size=settings.getint('MOVIE_ID_CACHE_SIZE', 200000),
+            bloom=bloom,
+        )
+
+    def claim(self, movie_ids: Iterable) -> List[str]:
+        """认领一批电影id，返回集群内首次出现的id（保持输入顺序）"""
+        with self._lock:
+            pending = [movie_id for movie_id in dict.fromkeys(map(str, movie_ids))
+                       if movie_id not in self._seen]
+        if not pending:
+            return []
+
+        claimed = set(self._remote_claim(pending))
+        # 无论是否由本节点认领，这些id都已在集群中存在
+        self._remember(pending)
+        return [movie_id for movie_id in pending if movie_id in claimed]
+
+    def seen(self, movie_id) -> bool:
+        """仅查询本地缓存"""
+        return str(movie_id) in self._seen
+
+    def _remote_claim(self, movie_ids: List[str]) -> List[str]:
+        if self.bloom is not None:
+            added = self.bloom.add_many(movie_ids)
+            return [movie_id for movie_id, is_new in zip(movie_ids, added) if is_new]
+        return self._claim_script(keys=[self.key], args=[self.ttl, *movie_ids])
+
+    def _remember(self, movie_ids: List[str]):
+        with self._lock:
+            for movie_id in movie_ids:
+                self._seen[movie_id] = None
+            overflow = len(self._seen) - self.cache_size
+            for _ in range(max(overflow, 0)):
+                del self._seen[next(iter(self._seen))]
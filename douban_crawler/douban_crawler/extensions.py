@@ -1,35 +1,45 @@
 import time
 import json
-import redis
 from scrapy import signals
+from twisted.internet import task
+from douban_crawler.redis_client import RedisClient
 from douban_crawler.utils import get_node_id
 
 
 class StatusExtension:
-    """节点状态监控扩展"""
+    """节点状态监控扩展
 
-    def __init__(self, stats, redis_host, redis_port, item_count):
+    - crawler:nodes  hash，每个节点的最新状态（监控启动时的初始快照）
+    - crawler:events stream，每次上报追加一条事件（XADD，近似裁剪到 STATUS_STREAM_MAXLEN），
+      监控端用 XREAD 阻塞读取，不再轮询
+    - 每 STATUS_REPORT_INTERVAL 秒定时上报一次（心跳），计数长时间不变即为停滞节点
+    """
+
+    def __init__(self, stats, redis, item_count, stream_key='crawler:events', stream_maxlen=10000,
+                 report_interval=10.0):
         self.stats = stats
-        self.redis_conn = redis.StrictRedis(
-            host=redis_host,
-            port=redis_port,
-            decode_responses=True
-        )
+        self.redis = redis  # 共享的Redis访问层，上报在线程池中进行，不阻塞reactor
+        self.redis_conn = redis.server
         self.node_id = get_node_id()
         self.last_report_time = 0
         self.item_count = item_count
         self.items_scraped = 0
         self.cover_count = 0
         self.trailer_count = 0
+        self.stream_key = stream_key
+        self.stream_maxlen = stream_maxlen
+        self.report_interval = report_interval
+        self.report_loop = task.LoopingCall(self.report_status, 'running')
 
     @classmethod
     def from_crawler(cls, crawler):
-        # 从设置获取Redis配置
         ext = cls(
             stats=crawler.stats,
-            redis_host=crawler.settings.get('REDIS_HOST'),
-            redis_port=crawler.settings.get('REDIS_PORT'),
-            item_count=5
+            redis=RedisClient.from_crawler(crawler),
+            item_count=5,
+            stream_key=crawler.settings.get('STATUS_STREAM_KEY', 'crawler:events'),
+            stream_maxlen=crawler.settings.getint('STATUS_STREAM_MAXLEN', 10000),
+            report_interval=crawler.settings.getfloat('STATUS_REPORT_INTERVAL', 10),
         )
         # 注册信号
         crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
@@ -41,30 +51,45 @@ class StatusExtension:
     def spider_opened(self, spider):
         """爬虫启动时注册节点"""
         self.report_status('starting')
+        self.report_loop.start(self.report_interval, now=False)
 
     def spider_idle(self, spider):
         """爬虫空闲时定期上报状态"""
         current_time = time.time()
-        if current_time - self.last_report_time >= 10:  # 每10秒上报一次
+        if current_time - self.last_report_time >= self.report_interval:
             self.report_status('running')
 
     def spider_closed(self, spider, reason):
-        """爬虫关闭时注销节点"""
-        self.redis_conn.hdel('crawler:nodes', self.node_id)
+        """爬虫关闭时注销节点（返回Deferred，关闭流程等待其完成）"""
+        if self.report_loop.running:
+            self.report_loop.stop()
+        event = self._event('closed')
+        event['reason'] = reason
+        return self.redis.fire_and_forget(self._unregister, event)
 
     def item_scraped(self, item, spider):
         self.items_scraped += 1
         self.cover_count += item['has_cover']
         self.trailer_count += item['has_trailer']
         current_time = time.time()
-        if current_time - self.last_report_time >= 10:  # 每10秒上报一次
+        if current_time - self.last_report_time >= self.report_interval:
             self.report_status('running')
         # if self.items_scraped % self.item_count == 0:
         #     self.report_status('running')
 
     def report_status(self, status):
         """上报状态到Redis"""
-        stats_data = {
+        if status == 'running' and time.time() - self.last_report_time < self.report_interval / 2:
+            return  # 刚由 item_scraped / spider_idle 上报过
+        stats_data = self._event(status)
+        stats_data['throttle'] = self.stats.get_value('throttle/windows', {})
+        stats_data['ban_rate'] = self.stats.get_value('bans/rate', 0)
+        # 保存状态并追加事件（一次管道往返，不等待结果）
+        self.redis.fire_and_forget(self._publish, stats_data)
+        self.last_report_time = time.time()
+
+    def _event(self, status):
+        return {
             'status': status,
             'requests': self.stats.get_value('downloader/request_count', 0),
             'items': self.stats.get_value('item_scraped_count', 0),
@@ -72,6 +97,19 @@ class StatusExtension:
             'cover': self.cover_count,
             'trailer': self.trailer_count,
         }
-        # 保存状态到Redis的Hash表
-        self.redis_conn.hset('crawler:nodes', self.node_id, json.dumps(stats_data))
-        self.last_report_time = time.time()
\ No newline at end of file
+
+    def _publish(self, stats_data):
+        """在Redis线程池中执行"""
+        event = {key: value for key, value in stats_data.items() if key != 'throttle'}
+        event['node'] = self.node_id
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hset('crawler:nodes', self.node_id, json.dumps(stats_data))
+        pipe.xadd(self.stream_key, event, maxlen=self.stream_maxlen, approximate=True)
+        pipe.execute()
+
+    def _unregister(self, event):
+        event['node'] = self.node_id
+        pipe = self.redis_conn.pipeline(transaction=False)
+        pipe.hdel('crawler:nodes', self.node_id)
+        pipe.xadd(self.stream_key, event, maxlen=self.stream_maxlen, approximate=True)
+        pipe.execute()
@@ -0,0 +1,78 @@
+from typing import List, NamedTuple, Optional
+
+from lxml import etree
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# 利用 libxml2 解析时建立的 id 索引直接定位，不必遍历整棵文档树
+_BY_ID = etree.XPath("id($id)")
+_COMMENTS = etree.XPath(f".//span[{_has_class('short')}]/text()")
+# 与原 CSS 选择器逐一对应的简介回退链（均相对 #link-report-intra，
+# `X *::text` 即 X 下的全部文本节点，节点集合自动去重并按文档顺序排列）
+_SUMMARY_FALLBACKS = (
+    etree.XPath(f".//*[{_has_class('all')} and {_has_class('hidden')}]/descendant-or-self::text()"),
+    etree.XPath(".//*[@property='v:summary']/descendant-or-self::text()"),
+    etree.XPath(f".//*[{_has_class('short')}]//*[@property='v:summary']/descendant-or-self::text()"),
+    etree.XPath(f".//*[{_has_class('indent')}]/descendant-or-self::text()"),
+)
+
+
+class DetailPage(NamedTuple):
+    """详情页提取结果"""
+    cover: Optional[str]
+    hot_comments: List[str]
+    summary: str
+    trailer_url: Optional[str]
+
+
+def extract_detail(root) -> DetailPage:
+    """从已解析的 lxml 文档中提取封面、热门短评、简介和预告片链接"""
+    hot_comments = []
+    for node in _BY_ID(root, id='hot-comments'):
+        if node.tag == 'div':
+            hot_comments.extend(str(text) for text in _COMMENTS(node))
+    return DetailPage(
+        _first_attr(root, 'meta', 'content', lambda node: node.get('property') == 'og:image'),
+        hot_comments,
+        _extract_summary(_BY_ID(root, id='link-report-intra')),
+        _first_attr(root, 'a', 'href', lambda node: 'related-pic-video' in (node.get('class') or '').split()),
+    )
+
+
+def extract_detail_from_bytes(body: bytes, encoding='utf-8') -> DetailPage:
+    """直接从响应字节解析（供进程池等不持有 Response 的场景使用）"""
+    parser = etree.HTMLParser(recover=True, encoding=encoding)
+    root = etree.fromstring(body, parser=parser)
+    if root is None:
+        return DetailPage(None, [], '', None)
+    return extract_detail(root)
+
+
+def clean_summary(text: str) -> str:
+    """合并多余空白（但保留换行）"""
+    if not text:
+        return text
+    return '\n'.join(
+        line.strip()
+        for line in text.split('\n')
+        if line.strip()
+    )
+
+
+def _first_attr(root, tag, attr, predicate):
+    """按文档顺序找到第一个匹配的元素即停止遍历"""
+    for node in root.iter(tag):
+        if predicate(node):
+            return node.get(attr)
+    return None
+
+
+def _extract_summary(intra_nodes) -> str:
+    for fallback in _SUMMARY_FALLBACKS:
+        texts = [str(text) for node in intra_nodes for text in fallback(node)]
+        if texts:
+            return clean_summary(' '.join(texts))
+    return ''
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import Dict, Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from douban_crawler.bans import OK, classify_response
+from douban_crawler.utils import get_host_class, get_node_id
+
+
+# 各类页面的默认缓存有效期（秒）；预告片页中的视频地址带时效签名，有效期要短
+DEFAULT_TTLS = {
+    'api': 24 * 3600,
+    'detail': 7 * 24 * 3600,
+    'video': 3600,
+}
+
+# 不随响应体一起缓存的头（响应体已解压，长度会变化）
+SKIP_HEADERS = {b'Content-Encoding', b'Content-Length', b'Transfer-Encoding', b'Set-Cookie'}
+
+
+class CachedEntry:
+    __slots__ = ('status', 'headers', 'body', 'stored_at')
+
+    def __init__(self, status, headers, body, stored_at):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+
+class ResponseStore:
+    """SQLite 单文件存储，响应体 zlib 压缩，按最近访问时间做 LRU 淘汰
+
+    多个进程（run.py --workers）可以共用同一个库：写锁冲突时最多等待 busy_timeout 秒；
+    总大小以库中的 SUM(size) 为准（本进程的增量只是估计，每 size_refresh 秒或超出上限时重新统计），
+    上限对所有进程整体生效。
+    """
+
+    def __init__(self, path, max_bytes, compress_level=6, busy_timeout=2.0, size_refresh=30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.size_refresh = size_refresh
+        self.evicted = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=busy_timeout)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self.db.commit()
+        self._refresh_size()
+
+    def get(self, fingerprint) -> Optional[CachedEntry]:
+        row = self.db.execute(
+            'SELECT status, headers, body, stored_at FROM responses WHERE fingerprint = ?',
+            (fingerprint,),
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, stored_at = row
+        self.db.execute('UPDATE responses SET accessed_at = ? WHERE fingerprint = ?', (time.time(), fingerprint))
+        self.db.commit()
+        return CachedEntry(status, json.loads(headers), zlib.decompress(body), stored_at)
+
+    def put(self, fingerprint, url, status, headers: Dict, body: bytes):
+        compressed = zlib.compress(body, self.compress_level)
+        now = time.time()
+        old = self.db.execute('SELECT size FROM responses WHERE fingerprint = ?', (fingerprint,)).fetchone()
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (fingerprint, url, status, json.dumps(headers), compressed, len(compressed), now, now),
+        )
+        self.total_bytes += len(compressed) - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes or now - self.size_refreshed_at >= self.size_refresh:
+            # 其他进程也在写同一个库：以库中的实际总大小为准
+            self._refresh_size()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        self.db.commit()
+
+    def touch(self, fingerprint):
+        """重新验证通过：刷新存储时间，重新开始计算有效期"""
+        now = time.time()
+        self.db.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE fingerprint = ?',
+                        (now, now, fingerprint))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _refresh_size(self):
+        self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.size_refreshed_at = time.time()
+
+    def _evict(self):
+        """淘汰最久未访问的条目，直到总大小降到上限的 90%"""
+        target = self.max_bytes * 0.9
+        rows = self.db.execute('SELECT fingerprint, size FROM responses ORDER BY accessed_at')
+        victims = []
+        for fingerprint, size in rows:
+            if self.total_bytes <= target:
+                break
+            victims.append((fingerprint,))
+            self.total_bytes -= size
+        self.db.executemany('DELETE FROM responses WHERE fingerprint = ?', victims)
+        self.evicted += len(victims)
+
+
+class ResponseCacheMiddleware:
+    """top_list API、详情页和预告片页的本地响应缓存
+
+    - 按请求指纹缓存 200 响应，三类页面各自的有效期（RESPONSE_CACHE_TTLS）
+    - 过期条目带 If-None-Match / If-Modified-Since 重新验证，304 时直接使用缓存
+    - 被限流/验证码页面不缓存；请求 meta 中 dont_cache=True 时跳过
+    - 命中、未命中、重新验证、淘汰数写入 stats（httpcache/*）
+    - 缓存读写失败（例如多进程写锁等待超时）只记为 httpcache/errors，请求和响应照常处理
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('RESPONSE_CACHE_ENABLED', False):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.logger = logging.getLogger(__name__)
+        self.ttls = dict(DEFAULT_TTLS, **settings.getdict('RESPONSE_CACHE_TTLS'))
+        self.store = ResponseStore(
+            settings.get('RESPONSE_CACHE_PATH', 'data/httpcache.sqlite3').format(node_id=get_node_id()),
+            max_bytes=settings.getint('RESPONSE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024),
+            compress_level=settings.getint('RESPONSE_CACHE_COMPRESS_LEVEL', 6),
+            busy_timeout=settings.getfloat('RESPONSE_CACHE_BUSY_TIMEOUT', 2),
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+    def process_request(self, request, spider):
+        host_class = self._cacheable(request)
+        if host_class is None:
+            return None
+
+        fingerprint = self._fingerprint(request)
+        entry = self._store_call(self.store.get, fingerprint)
+        if not entry:
+            self.stats.inc_value('httpcache/miss')
+            return None
+
+        if time.time() - entry.stored_at < self.ttls[host_class]:
+            self.stats.inc_value('httpcache/hit')
+            self.stats.inc_value(f'httpcache/hit/{host_class}')
+            return self._build_response(request, entry)
+
+        # 已过期：有校验信息时发条件请求，否则按未命中处理
+        headers = Headers(entry.headers)
+        etag = headers.get(b'ETag')
+        last_modified = headers.get(b'Last-Modified')
+        if etag is None and last_modified is None:
+            self.stats.inc_value('httpcache/expired')
+            return None
+        if etag is not None:
+            request.headers[b'If-None-Match'] = etag
+        if last_modified is not None:
+            request.headers[b'If-Modified-Since'] = last_modified
+        request.meta['cache_entry'] = entry
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response
+        host_class = self._cacheable(request)
+        if host_class is None:
+            return response
+
+        entry = request.meta.pop('cache_entry', None)
+        if entry is not None and response.status == 304:
+            self.stats.inc_value('httpcache/revalidated')
+            self._store_call(self.store.touch, self._fingerprint(request))
+            return self._build_response(request, entry)
+
+        if response.status == 200 and classify_response(response, host_class) == OK:
+            headers = {key.decode(): [v.decode('latin-1') for v in values]
+                       for key, values in response.headers.items() if key not in SKIP_HEADERS}
+            if self._store_call(self.store.put, self._fingerprint(request), response.url, response.status,
+                                headers, response.body) is False:
+                return response
+            self.stats.inc_value('httpcache/store')
+            self.stats.set_value('httpcache/evicted', self.store.evicted)
+            self.stats.set_value('httpcache/bytes', self.store.total_bytes)
+        return response
+
+    def _store_call(self, method, *args):
+        """执行一次缓存读写；失败时回滚并返回 False（按未命中/不缓存处理）"""
+        try:
+            return method(*args)
+        except sqlite3.OperationalError as e:
+            self.store.db.rollback()
+            self.stats.inc_value('httpcache/errors')
+            self.logger.warning(f"响应缓存读写失败: {e}")
+            return False
+
+    def _cacheable(self, request) -> Optional[str]:
+        """可缓存时返回页面类型（api / detail / video）"""
+        if request.method != 'GET' or request.meta.get('dont_cache'):
+            return None
+        host_class = get_host_class(request.url)
+        return host_class if self.ttls.get(host_class) else None
+
+    def _fingerprint(self, request):
+        return self.crawler.request_fingerprinter.fingerprint(request).hex()
+
+    @staticmethod
+    def _build_response(request, entry):
+        headers = Headers(entry.headers)
+        response_cls = responsetypes.from_args(headers=headers, url=request.url, body=entry.body)
+        return response_cls(request.url, status=entry.status, headers=headers, body=entry.body,
+                            request=request, flags=['cached'])
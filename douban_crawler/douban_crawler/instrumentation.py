@@ -0,0 +1,337 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import math
+import os
+import pstats
+import random
+import threading
+import time
+import weakref
+from typing import Dict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from douban_crawler.redis_client import RedisClient, set_observer
+from douban_crawler.utils import get_host_class, get_node_id
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+logger = logging.getLogger(__name__)
+
+# crawler -> Instrumentation
+_instances = weakref.WeakKeyDictionary()
+
+
+class Histogram:
+    """对数分桶的耗时直方图：第 i 个桶上界为 10µs * 2^i，内存固定"""
+
+    BUCKETS = 28  # 最后一个桶约 22 分钟
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        micros = seconds * 1e6
+        index = 0 if micros <= 10 else min(math.ceil(math.log2(micros / 10)), self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """分位数（取所在桶的上界，不超过最大值）"""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(10e-6 * 2 ** index, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict:
+        """毫秒为单位的汇总"""
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0,
+            'p50_ms': round(self.percentile(0.5) * 1000, 3),
+            'p90_ms': round(self.percentile(0.9) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class Instrumentation:
+    """热路径耗时统计（每个 crawler 一个实例，各组件通过 from_crawler 共用）
+
+    - 按 INSTRUMENTATION_SAMPLE_RATE 抽样，未抽中的调用只多一次随机数判断
+    - 直方图名称: callback/{回调}、pipeline/{管道}、download/{主机类别}、redis/{命令}
+    - 可在 Redis 线程池中调用（记录时加锁）
+    """
+
+    def __init__(self, sample_rate=0.0):
+        self.sample_rate = sample_rate
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        instance = _instances.get(crawler)
+        if instance is None:
+            sample_rate = 0.0
+            if crawler.settings.getbool('INSTRUMENTATION_ENABLED', False):
+                sample_rate = crawler.settings.getfloat('INSTRUMENTATION_SAMPLE_RATE', 0.1)
+            instance = _instances[crawler] = cls(sample_rate)
+        return instance
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def collect(self) -> Dict[str, Dict]:
+        """取出当前窗口的汇总并清空"""
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        return {name: histogram.snapshot() for name, histogram in sorted(histograms.items())}
+
+
+def timed_stage(name):
+    """管道 process_item 装饰器：抽样记录 pipeline/{name} 耗时（支持同步和 async def）"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, item, spider):
+                instrumentation = Instrumentation.from_crawler(spider.crawler)
+                if not instrumentation.sampled():
+                    return await func(self, item, spider)
+                start = time.perf_counter()
+                try:
+                    return await func(self, item, spider)
+                finally:
+                    instrumentation.record(f'pipeline/{name}', time.perf_counter() - start)
+        else:
+            @functools.wraps(func)
+            def wrapper(self, item, spider):
+                instrumentation = Instrumentation.from_crawler(spider.crawler)
+                if not instrumentation.sampled():
+                    return func(self, item, spider)
+                start = time.perf_counter()
+                try:
+                    return func(self, item, spider)
+                finally:
+                    instrumentation.record(f'pipeline/{name}', time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class CallbackTimingMiddleware:
+    """爬虫中间件：抽样记录回调本身的执行耗时 callback/{回调名}
+
+    放在最靠近爬虫的位置（数值最大），只累加在回调内部的时间（每次取下一个输出，含其中等待的Redis/进程池调用），
+    产出的结果交给下游中间件和引擎处理的时间不计入。
+    """
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        instrumentation = Instrumentation.from_crawler(crawler)
+        if not instrumentation.enabled:
+            raise NotConfigured
+        return cls(instrumentation)
+
+    def process_spider_output(self, response, result, spider):
+        if not self.instrumentation.sampled():
+            yield from result
+            return
+        elapsed = 0.0
+        iterator = iter(result)
+        while True:
+            start = time.perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield output
+        self.instrumentation.record(self._name(response, spider), elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        if not self.instrumentation.sampled():
+            async for output in result:
+                yield output
+            return
+        elapsed = 0.0
+        iterator = result.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                output = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield output
+        self.instrumentation.record(self._name(response, spider), elapsed)
+
+    @staticmethod
+    def _name(response, spider):
+        callback = response.request.callback if response.request is not None else None
+        return f"callback/{getattr(callback, '__name__', None) or 'parse'}"
+
+
+class InstrumentationExtension:
+    """统计的采集与导出（INSTRUMENTATION_ENABLED）
+
+    - 下载耗时: response_received 信号中按主机类别记录 download/{类别}
+    - Redis命令: 给共享 RedisClient 的客户端挂上观察者，记录 redis/{命令}
+    - 每 INSTRUMENTATION_EXPORT_INTERVAL 秒把本窗口的汇总写入 crawler:metrics（与 crawler:nodes 并列）
+    - 运行中开启性能分析: SET crawler:profile:{节点id} 秒数（或 "秒数:pyinstrument"），
+      到时写出 profiles/ 下的文件，前 30 行摘要写入 crawler:profile:{节点id}:result
+    """
+
+    def __init__(self, crawler, instrumentation, redis, export_interval=30.0, profile_dir='profiles'):
+        self.crawler = crawler
+        self.instrumentation = instrumentation
+        self.redis = redis
+        self.export_interval = export_interval
+        self.profile_dir = profile_dir
+        self.node_id = get_node_id()
+        self.profile_key = f'crawler:profile:{self.node_id}'
+        self.profiler = None
+        self.profile_mode = None
+        self.profile_until = 0.0
+        self.window_start = time.time()
+        self.export_loop = task.LoopingCall(self.export)
+        self.profile_loop = task.LoopingCall(self.poll_profile)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        instrumentation = Instrumentation.from_crawler(crawler)
+        if not instrumentation.enabled:
+            raise NotConfigured
+        redis = RedisClient.from_crawler(crawler)
+        ext = cls(
+            crawler,
+            instrumentation,
+            redis,
+            export_interval=crawler.settings.getfloat('INSTRUMENTATION_EXPORT_INTERVAL', 30),
+            profile_dir=crawler.settings.get('INSTRUMENTATION_PROFILE_DIR', 'profiles'),
+        )
+        set_observer(ext)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    def spider_opened(self, spider):
+        self.export_loop.start(self.export_interval, now=False)
+        self.profile_loop.start(5, now=False)
+
+    def spider_closed(self, spider, reason):
+        for loop in (self.export_loop, self.profile_loop):
+            if loop.running:
+                loop.stop()
+        if self.profiler is not None:
+            self.stop_profile()
+        self.export()
+        set_observer(None)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None and 'cached' not in response.flags and self.instrumentation.sampled():
+            self.instrumentation.record(f'download/{get_host_class(request.url)}', latency)
+
+    def sampled(self):
+        return self.instrumentation.sampled()
+
+    def observe_redis(self, command, seconds):
+        """PooledRedis 的观察者（在执行命令的线程中调用，已按抽样率过滤）"""
+        self.instrumentation.record(f'redis/{command}', seconds)
+
+    def export(self):
+        now = time.time()
+        metrics = {
+            'time': int(now),
+            'window': round(now - self.window_start, 1),
+            'sample_rate': self.instrumentation.sample_rate,
+            'histograms': self.instrumentation.collect(),
+        }
+        self.window_start = now
+        self.redis.fire_and_forget(self.redis.server.hset, 'crawler:metrics', self.node_id, json.dumps(metrics))
+
+    def poll_profile(self):
+        if self.profiler is not None:
+            if time.time() >= self.profile_until:
+                self.stop_profile()
+            return
+        d = self.redis.call(self.redis.server.getdel, self.profile_key)
+        d.addCallback(self._maybe_start_profile)
+        d.addErrback(lambda failure: logger.warning(f"读取性能分析开关失败: {failure.getErrorMessage()}"))
+
+    def _maybe_start_profile(self, value):
+        if not value or self.profiler is not None:
+            return
+        seconds, _, mode = value.partition(':')
+        mode = mode or 'cprofile'
+        if mode == 'pyinstrument' and pyinstrument is None:
+            logger.warning("未安装 pyinstrument，改用 cProfile")
+            mode = 'cprofile'
+        self.profile_mode = mode
+        self.profile_until = time.time() + float(seconds)
+        if mode == 'pyinstrument':
+            self.profiler = pyinstrument.Profiler()
+            self.profiler.start()
+        else:
+            # cProfile 只统计开启它的线程（reactor 线程）
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        logger.info(f"开始性能分析 ({mode}, {seconds} 秒)")
+
+    def stop_profile(self):
+        profiler, self.profiler = self.profiler, None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{self.node_id}_{time.strftime('%Y%m%d_%H%M%S')}")
+        if self.profile_mode == 'pyinstrument':
+            profiler.stop()
+            path += '.html'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            summary = profiler.output_text()
+        else:
+            profiler.disable()
+            path += '.prof'
+            profiler.dump_stats(path)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+            summary = stream.getvalue()
+        summary = '\n'.join(summary.splitlines()[:60])
+        result = json.dumps({'time': int(time.time()), 'path': os.path.abspath(path), 'summary': summary},
+                            ensure_ascii=False)
+        self.redis.fire_and_forget(self.redis.server.set, f'{self.profile_key}:result', result)
+        logger.info(f"性能分析结果已保存: {path}")
@@ -19,3 +19,5 @@ class DoubanMovieItem(scrapy.Item):
     trailer = scrapy.Field()  # 预告片url
     cover_path = scrapy.Field()  # 封面图本地保存路径
     trailer_path = scrapy.Field()  # 预告片本地保存路径
+    source_type = scrapy.Field()  # 来源 top_list 的类型
+    source_interval = scrapy.Field()  # 来源 top_list 的分数区间
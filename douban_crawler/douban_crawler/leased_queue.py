@@ -0,0 +1,296 @@
+import time
+import weakref
+from typing import List, Optional, Set
+
+from scrapy import signals
+from scrapy_redis.queue import Base
+from twisted.internet import task
+
+
+# 中间件在下载前主动丢弃请求时发送（请求不会经过下载器，需要单独确认租约）
+request_discarded = object()
+
+# 取出的请求在 meta 中记录自己的租约id；重定向/重试生成的新请求会带着它重新入队
+LEASE_META_KEY = 'queue_lease'
+
+# crawler -> 该 crawler 调度器使用的队列
+_queues = weakref.WeakKeyDictionary()
+
+# 确认上一批租约，并按优先级取出 N 个请求、为每个请求登记租约
+# KEYS: 队列zset, 租约zset(租约id -> 到期时间), 租约hash(租约id -> "分数|数据"), 租约序号
+# ARGV: N, 当前时间, 租约时长, 要确认的租约id...
+POP_SCRIPT = """
+for i = 4, #ARGV do
+    redis.call('ZREM', KEYS[2], ARGV[i])
+    redis.call('HDEL', KEYS[3], ARGV[i])
+end
+local count = tonumber(ARGV[1])
+if count == 0 then
+    return {}
+end
+local items = redis.call('ZRANGE', KEYS[1], 0, count - 1, 'WITHSCORES')
+if #items == 0 then
+    return {}
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items / 2 - 1)
+local expires = tonumber(ARGV[2]) + tonumber(ARGV[3])
+local result = {}
+for i = 1, #items, 2 do
+    local lease = tostring(redis.call('INCR', KEYS[4]))
+    redis.call('ZADD', KEYS[2], expires, lease)
+    redis.call('HSET', KEYS[3], lease, items[i + 1] .. '|' .. items[i])
+    result[#result + 1] = lease
+    result[#result + 1] = items[i]
+end
+return result
+"""
+
+_REQUEUE = """
+local function requeue(lease)
+    local entry = redis.call('HGET', KEYS[3], lease)
+    if entry then
+        local sep = string.find(entry, '|', 1, true)
+        redis.call('ZADD', KEYS[1], string.sub(entry, 1, sep - 1), string.sub(entry, sep + 1))
+        redis.call('HDEL', KEYS[3], lease)
+    end
+    redis.call('ZREM', KEYS[2], lease)
+end
+"""
+
+# 把到期的租约（节点崩溃或超时未确认、延迟请求到期）放回队列
+# KEYS: 队列zset, 租约zset, 租约hash   ARGV: 当前时间, 单次上限
+REAP_SCRIPT = _REQUEUE + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, lease in ipairs(expired) do
+    requeue(lease)
+end
+return #expired
+"""
+
+# 立即放回指定租约（关闭时归还本地缓冲中未处理的请求）
+# KEYS: 队列zset, 租约zset, 租约hash   ARGV: 租约id...
+RELEASE_SCRIPT = _REQUEUE + """
+for _, lease in ipairs(ARGV) do
+    requeue(lease)
+end
+return #ARGV
+"""
+
+# 延迟请求：登记一个到期时间为 ready_at 的租约，到期后由 reaper 放回队列
+# KEYS: 租约zset, 租约hash, 租约序号   ARGV: 分数, 数据, ready_at
+PUSH_DELAYED_SCRIPT = """
+local lease = tostring(redis.call('INCR', KEYS[3]))
+redis.call('ZADD', KEYS[1], ARGV[3], lease)
+redis.call('HSET', KEYS[2], lease, ARGV[1] .. '|' .. ARGV[2])
+return lease
+"""
+
+
+class LeasedPriorityQueue(Base):
+    """带批量预取和租约的优先级队列（SCHEDULER_QUEUE_CLASS）
+
+    - 一次 Lua 调用取出 SCHEDULER_BATCH_SIZE 个请求放入本地缓冲
+    - 每个取出的请求登记租约（{key}:leases 到期时间 + {key}:leased 原分数和数据）
+    - 回调的输出全部消费完（后续请求都已入队）后由 LeaseAckSpiderMiddleware 确认租约；
+      不会到达回调的请求（被中间件丢弃、下载出错、重定向/重试后以新请求重新入队、被去重丢弃）在对应位置确认。
+      确认随下一次批量取出一起提交
+    - 任一节点在 pop() 中定期把到期租约放回队列：崩溃节点未完成的请求不会丢失
+    - 每 lease_timeout/4 秒提交积压的确认，并为本地缓冲和下载/回调中的请求续租，避免仍在处理的请求被放回
+    - push_delayed() 复用租约机制实现延迟重新入队
+    """
+
+    def __init__(self, server, spider, key, serializer=None):
+        super().__init__(server, spider, key, serializer)
+        settings = spider.crawler.settings
+        self.batch_size = max(settings.getint('SCHEDULER_BATCH_SIZE', 16), 1)
+        self.lease_timeout = settings.getint('SCHEDULER_LEASE_TIMEOUT', 600)
+        self.reap_interval = settings.getfloat('SCHEDULER_REAP_INTERVAL', 5)
+        self.leases_key = f'{self.key}:leases'
+        self.leased_key = f'{self.key}:leased'
+        self.seq_key = f'{self.key}:lease_seq'
+        self._pop_script = server.register_script(POP_SCRIPT)
+        self._reap_script = server.register_script(REAP_SCRIPT)
+        self._release_script = server.register_script(RELEASE_SCRIPT)
+        self._push_delayed_script = server.register_script(PUSH_DELAYED_SCRIPT)
+        self.buffer: List = []  # [(租约id, 请求)]，按优先级排列
+        self.leases: Set[str] = set()  # 已交给引擎、尚未确认的租约id
+        self.pending_acks: List[str] = []
+        self.last_reap = 0.0
+        self.last_flush = time.time()
+        self.stats = spider.crawler.stats
+
+        _queues[spider.crawler] = self
+        crawler_signals = spider.crawler.signals
+        crawler_signals.connect(self._ack, signal=request_discarded)
+        crawler_signals.connect(self._ack, signal=signals.request_dropped)
+        crawler_signals.connect(self.spider_closed, signal=signals.spider_closed)
+        self.renew_loop = task.LoopingCall(self.renew)
+        self.renew_loop.start(self.lease_timeout / 4, now=False)
+
+    def __len__(self):
+        return self.server.zcard(self.key) + len(self.buffer)
+
+    def push(self, request):
+        # 带租约的请求是重新入队（重定向、重试等）：新请求写入后原租约即可确认
+        lease = request.meta.pop(LEASE_META_KEY, None)
+        self.server.execute_command('ZADD', self.key, -request.priority, self._encode_request(request))
+        self._ack_lease(lease)
+
+    def push_delayed(self, request, delay):
+        """delay 秒后才重新进入队列（期间不占用任何节点）"""
+        lease = request.meta.pop(LEASE_META_KEY, None)
+        self._push_delayed_script(
+            keys=[self.leases_key, self.leased_key, self.seq_key],
+            args=[-request.priority, self._encode_request(request), time.time() + delay],
+        )
+        self._ack_lease(lease)
+
+    def pop(self, timeout=0):
+        now = time.time()
+        if now - self.last_reap >= self.reap_interval:
+            self.last_reap = now
+            requeued = self._reap_script(keys=[self.key, self.leases_key, self.leased_key],
+                                         args=[now, 1000])
+            if requeued:
+                self.stats.inc_value('scheduler/leases/requeued', requeued)
+
+        if not self.buffer:
+            self._fill(now)
+        if not self.buffer:
+            return None
+        lease, request = self.buffer.pop(0)
+        request.meta[LEASE_META_KEY] = lease
+        self.leases.add(lease)
+        return request
+
+    def clear(self):
+        self.server.delete(self.key, self.leases_key, self.leased_key, self.seq_key)
+        self.buffer = []
+        self.leases.clear()
+        self.pending_acks = []
+
+    def ack(self, request):
+        """请求已处理完（回调输出已消费）或不会再到达回调时确认租约；重复确认无影响"""
+        self._ack(request)
+
+    def renew(self):
+        """提交积压的确认，并把仍在本地的租约（缓冲中 + 已交给引擎未确认）的到期时间顺延"""
+        self._flush_acks()
+        held = [lease for lease, _ in self.buffer] + list(self.leases)
+        if not held:
+            return
+        expires = time.time() + self.lease_timeout
+        args = []
+        for lease in held:
+            args += [expires, lease]
+        # XX: 已被放回队列（租约不存在）的不再重新登记
+        self.server.execute_command('ZADD', self.leases_key, 'XX', *args)
+        self.stats.inc_value('scheduler/leases/renewed', len(held))
+
+    def spider_closed(self, spider):
+        """提交剩余确认，本地缓冲中未处理的请求立即归还队列"""
+        if self.renew_loop.running:
+            self.renew_loop.stop()
+        leases = [lease for lease, _ in self.buffer]
+        self.buffer = []
+        self._flush_acks()
+        if leases:
+            self._release_script(keys=[self.key, self.leases_key, self.leased_key], args=leases)
+
+    def _fill(self, now):
+        acks, self.pending_acks = self.pending_acks, []
+        self.last_flush = now
+        result = self._pop_script(keys=self._pop_keys(), args=[self.batch_size, now, self.lease_timeout] + acks)
+        for lease, data in zip(result[::2], result[1::2]):
+            self.buffer.append((lease, self._decode_request(data)))
+        self.stats.inc_value('scheduler/batches')
+        if acks:
+            self.stats.inc_value('scheduler/leases/acked', len(acks))
+
+    def _ack(self, request, **kwargs):
+        self._ack_lease(request.meta.get(LEASE_META_KEY))
+
+    def _ack_lease(self, lease):
+        if lease is None or lease not in self.leases:
+            return
+        self.leases.discard(lease)
+        self.pending_acks.append(lease)
+        if (len(self.pending_acks) >= self.batch_size * 4
+                or time.time() - self.last_flush > self.lease_timeout / 4):
+            # 缓冲长时间不空时也要及时提交确认，避免租约到期被重复放回
+            self._flush_acks()
+
+    def _flush_acks(self):
+        self.last_flush = time.time()
+        if not self.pending_acks:
+            return
+        self._pop_script(keys=self._pop_keys(), args=[0, time.time(), self.lease_timeout] + self.pending_acks)
+        self.stats.inc_value('scheduler/leases/acked', len(self.pending_acks))
+        self.pending_acks = []
+
+    def _pop_keys(self):
+        return [self.key, self.leases_key, self.leased_key, self.seq_key]
+
+
+def get_queue(crawler) -> Optional[LeasedPriorityQueue]:
+    """crawler 正在使用的 LeasedPriorityQueue（未使用该队列时为 None）"""
+    return _queues.get(crawler)
+
+
+class LeaseAckMiddleware:
+    """下载器中间件：任何中间件的 process_request 或下载出错时确认租约
+
+    放在最靠近下载器的位置（编号最大），process_exception 最先被调用，
+    不会被其他中间件返回的请求/响应截断（例如 OffsiteMiddleware 抛出的 IgnoreRequest）。
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_exception(self, request, exception, spider):
+        queue = get_queue(self.crawler)
+        if queue is not None:
+            queue.ack(request)
+        return None
+
+
+class LeaseAckSpiderMiddleware:
+    """爬虫中间件：回调的输出被引擎全部消费后确认租约
+
+    引擎每取出一个输出就立即调度其中的请求（写入 Redis 队列），所以迭代结束时后续请求都已入队，
+    此前崩溃的节点会在租约到期后由其他节点重新抓取这个页面。放在编号最小的位置，包住其他中间件的输出。
+    回调出错时同样确认（重新抓取也会得到同样的错误）。
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        try:
+            yield from result
+        finally:
+            self._ack(response)
+
+    async def process_spider_output_async(self, response, result, spider):
+        try:
+            async for r in result:
+                yield r
+        finally:
+            self._ack(response)
+
+    def process_spider_exception(self, response, exception, spider):
+        self._ack(response)
+        return None
+
+    def _ack(self, response):
+        queue = get_queue(self.crawler)
+        if queue is not None:
+            queue.ack(response.request)
@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import aiohttp
+from scrapy import signals
+from scrapy.http import Response
+from twisted.internet import task
+
+from douban_crawler.instrumentation import Instrumentation
+from douban_crawler.utils import get_host_class
+
+
+logger = logging.getLogger(__name__)
+
+
+class MediaDownloadError(Exception):
+    """不可重试的媒体下载错误（状态码异常、超过大小限制等）"""
+
+
+class _IncompleteDownload(Exception):
+    """连接中断或内容不完整，可以用 Range 续传"""
+
+
+class ByteBudget:
+    """进行中下载的总字节预算，超出时后来的下载排队等待"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = None
+
+    async def acquire(self, size):
+        size = min(size, self.limit)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            # 单个文件超过剩余预算时，只要没有其他下载也允许开始，避免饿死
+            await self._condition.wait_for(lambda: self.in_use == 0 or self.in_use + size <= self.limit)
+            self.in_use += size
+        return size
+
+    async def release(self, size):
+        async with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+class TokenBucket:
+    """令牌桶：限制每秒写入的字节数（rate 为 0 时不限速）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waited = 0.0  # 累计限速等待秒数
+
+    async def consume(self, size):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        if self.tokens < 0:
+            # 欠下的令牌按速率补足后再继续（令牌可以为负，大块数据不会被卡住）
+            delay = -self.tokens / self.rate
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+
+class MediaStreamer:
+    """把媒体文件流式写入磁盘
+
+    - 分块写入 .part 临时文件，内存占用与文件大小无关
+    - 失败或重启后用 HTTP Range 从已下载的位置续传
+    - 限制单文件大小和进行中下载的总字节数，可选令牌桶限速
+    - 完成后原子重命名到最终路径
+    """
+
+    def __init__(self, settings, bucket=None):
+        self.chunk_size = settings.getint('MEDIA_STREAM_CHUNK_SIZE', 256 * 1024)
+        self.max_file_bytes = settings.getint('MEDIA_MAX_FILE_BYTES', 1024 * 1024 * 1024)
+        self.unknown_size_reserve = settings.getint('MEDIA_UNKNOWN_SIZE_RESERVE', 64 * 1024 * 1024)
+        self.retries = settings.getint('MEDIA_STREAM_RETRIES', 3)
+        self.timeout = aiohttp.ClientTimeout(total=None,
+                                             sock_read=settings.getfloat('MEDIA_STREAM_READ_TIMEOUT', 60))
+        self.budget = ByteBudget(settings.getint('MEDIA_MAX_INFLIGHT_BYTES', 2 * 1024 * 1024 * 1024))
+        self.bucket = bucket
+        self.session = None
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def fetch(self, request, path):
+        """下载到 path，返回空 body 的响应（flags 含 'streamed'）"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        start_time = time.time()
+        checksum, size = await self._download(request, path)
+        request.meta['download_latency'] = time.time() - start_time
+        request.meta['stream_checksum'] = checksum
+        request.meta['stream_size'] = size
+        logger.debug(f"流式下载完成: {request.url} -> {path} ({size} bytes)")
+        return Response(request.url, status=200, request=request, flags=['streamed'])
+
+    async def _download(self, request, path):
+        headers = {key.decode(): values[-1].decode() for key, values in request.headers.items()}
+        # 按原始字节写盘和续传（HttpCompressionMiddleware 加上的压缩编码不适用）
+        headers['Accept-Encoding'] = 'identity'
+        proxy = request.meta.get('proxy')
+        part_path = f'{path}.part'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._stream(request.url, headers, proxy, path, part_path)
+            except (aiohttp.ClientError, asyncio.TimeoutError, _IncompleteDownload) as e:
+                if attempt >= self.retries:
+                    raise MediaDownloadError(f"下载失败（已重试{self.retries}次）: {e}") from e
+                logger.warning(f"下载中断，准备续传 {request.url}: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def _stream(self, url, headers, proxy, path, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+
+        async with self.session.get(url, headers=request_headers, proxy=proxy) as response:
+            if response.status == 416:
+                # 临时文件与服务器内容不一致，从头下载
+                os.remove(part_path)
+                raise _IncompleteDownload('Range not satisfiable')
+            if response.status == 200:
+                offset = 0  # 服务器不支持续传，从头写入
+            elif response.status != 206:
+                raise MediaDownloadError(f"HTTP {response.status}")
+
+            content_length = response.content_length
+            if content_length is not None and offset + content_length > self.max_file_bytes:
+                raise MediaDownloadError(f"文件超过大小限制 {self.max_file_bytes} bytes")
+
+            md5 = self._seed_checksum(part_path, offset)
+            reserved = await self.budget.acquire(content_length or self.unknown_size_reserve)
+            written = 0
+            try:
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        written += len(chunk)
+                        if offset + written > self.max_file_bytes:
+                            raise MediaDownloadError(f"文件超过大小限制 {self.max_file_bytes} bytes")
+                        f.write(chunk)
+                        md5.update(chunk)
+                        if self.bucket is not None:
+                            await self.bucket.consume(len(chunk))
+            except MediaDownloadError:
+                os.remove(part_path)
+                raise
+            finally:
+                await self.budget.release(reserved)
+
+        if content_length is not None and written < content_length:
+            raise _IncompleteDownload(f"只收到 {written}/{content_length} bytes")
+        os.replace(part_path, path)
+        return md5.hexdigest(), offset + written
+
+    def _seed_checksum(self, part_path, offset):
+        """续传时先把已下载部分计入校验和"""
+        md5 = hashlib.md5()
+        if offset:
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(self.chunk_size), b''):
+                    md5.update(block)
+        return md5
+
+
+class MediaStreamMiddleware:
+    """把带有 meta['stream_path'] 的媒体请求直接流式写入磁盘（未启用媒体通道时使用；
+    媒体通道的请求带有 meta['media_lane']，由通道自己下载）"""
+
+    def __init__(self, settings):
+        self.streamer = MediaStreamer(settings)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.settings)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    async def spider_closed(self, spider, reason):
+        await self.streamer.close()
+
+    async def process_request(self, request, spider):
+        path = request.meta.get('stream_path')
+        if not path or request.meta.get('media_lane'):
+            return None
+        return await self.streamer.fetch(request, path)
+
+
+class MediaLane:
+    """独立的媒体下载通道（MEDIA_LANE_ENABLED）
+
+    封面/预告片不再经过 Scrapy 下载器，不占用 CONCURRENT_REQUESTS 和下载槽位
+    （仍会经过下载器中间件，User-Agent、默认请求头、代理和封禁识别与页面请求一致）:
+    - 自己的并发上限 MEDIA_LANE_CONCURRENCY
+    - 节点级令牌桶限速 MEDIA_LANE_BYTES_PER_SEC
+    - 排队 + 下载中的文件数上限 MEDIA_LANE_QUEUE_SIZE；满时 wait_for_room() 挂起管道中的item，
+      不再向通道提交新的媒体工作
+    - 定期采样媒体通道和页面下载器的利用率，写入统计 media_lane/*、page_lane/*
+    """
+
+    def __init__(self, crawler, concurrency=4, queue_size=32, bytes_per_sec=0, sample_interval=5.0):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.instrumentation = Instrumentation.from_crawler(crawler)
+        self.concurrency = max(concurrency, 1)
+        self.queue_size = max(queue_size, self.concurrency)
+        self.bucket = TokenBucket(bytes_per_sec) if bytes_per_sec else None
+        self.streamer = MediaStreamer(settings, bucket=self.bucket)
+        self.page_concurrency = settings.getint('CONCURRENT_REQUESTS', 16)
+        self.active = 0
+        self.queued = 0
+        self.samples = 0
+        self.media_busy = 0.0
+        self.page_busy = 0.0
+        self._condition = None
+        self.sample_loop = task.LoopingCall(self.sample)
+        self.sample_interval = sample_interval
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """未启用时返回 None"""
+        settings = crawler.settings
+        if not settings.getbool('MEDIA_LANE_ENABLED', True):
+            return None
+        lane = cls(
+            crawler,
+            concurrency=settings.getint('MEDIA_LANE_CONCURRENCY', 4),
+            queue_size=settings.getint('MEDIA_LANE_QUEUE_SIZE', 32),
+            bytes_per_sec=settings.getint('MEDIA_LANE_BYTES_PER_SEC', 0),
+            sample_interval=settings.getfloat('MEDIA_LANE_SAMPLE_INTERVAL', 5),
+        )
+        crawler.signals.connect(lane.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(lane.spider_closed, signal=signals.spider_closed)
+        return lane
+
+    def spider_opened(self, spider):
+        self.sample_loop.start(self.sample_interval, now=False)
+
+    async def spider_closed(self, spider, reason):
+        if self.sample_loop.running:
+            self.sample_loop.stop()
+        await self.streamer.close()
+
+    @property
+    def depth(self):
+        return self.active + self.queued
+
+    async def wait_for_room(self, count=1):
+        """通道已满时等待，直到能再放入 count 个文件（单个item超过上限时只等通道空）"""
+        condition = self._get_condition()
+        if self.depth + count <= self.queue_size:
+            return
+        self.stats.inc_value('media_lane/backpressure')
+        async with condition:
+            await condition.wait_for(lambda: self.depth == 0 or self.depth + count <= self.queue_size)
+
+    async def fetch(self, request):
+        condition = self._get_condition()
+        self.queued += 1
+        self.stats.max_value('media_lane/depth_max', self.depth)
+        try:
+            async with condition:
+                await condition.wait_for(lambda: self.active < self.concurrency)
+                self.queued -= 1
+                self.active += 1
+            try:
+                response = await self.streamer.fetch(request, request.meta['stream_path'])
+            finally:
+                async with condition:
+                    self.active -= 1
+                    condition.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            self.stats.inc_value('media_lane/failed')
+            raise
+        self.stats.inc_value('media_lane/files')
+        self.stats.inc_value('media_lane/bytes', request.meta['stream_size'])
+        if self.instrumentation.sampled():
+            # 不经过下载器，没有 response_received 信号，在这里记录下载耗时
+            self.instrumentation.record(f'download/{get_host_class(request.url)}', request.meta['download_latency'])
+        return response
+
+    def sample(self):
+        """采样两个通道的占用，统计为运行期间的平均利用率（百分比）"""
+        downloader = self.crawler.engine.downloader
+        self.samples += 1
+        self.media_busy += self.active / self.concurrency
+        self.page_busy += len(downloader.active) / self.page_concurrency
+        self.stats.set_value('media_lane/utilization', round(100 * self.media_busy / self.samples, 1))
+        self.stats.set_value('page_lane/utilization', round(100 * self.page_busy / self.samples, 1))
+        self.stats.set_value('media_lane/queue_depth', self.depth)
+        if self.bucket is not None:
+            self.stats.set_value('media_lane/throttled_seconds', round(self.bucket.waited, 1))
+
+    def _get_condition(self):
+        # 在 asyncio 事件循环中才能创建
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
@@ -0,0 +1,50 @@
+import json
+from typing import Dict, Iterable, Optional
+
+
+class MovieMetaStore:
+    """详情页/预告片页请求的电影数据（原先整个放在 request.meta 中随队列序列化）
+
+    douban:movie_meta:{id}  JSON，带过期时间，请求只携带电影id。
+    用独立的 key 而不是一个大 hash，这样每条数据都能单独过期清理。
+    """
+
+    def __init__(self, server, key_prefix='douban:movie_meta', ttl=7 * 24 * 3600):
+        self.server = server
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(
+            server,
+            key_prefix=settings.get('MOVIE_META_KEY', 'douban:movie_meta'),
+            ttl=settings.getint('MOVIE_META_TTL', 7 * 24 * 3600),
+        )
+
+    def put_many(self, metas: Iterable[Dict]):
+        """一页的电影数据一次往返写入"""
+        pipe = self.server.pipeline(transaction=False)
+        count = 0
+        for meta in metas:
+            pipe.set(self._key(meta['id']), self._dumps(meta), ex=self.ttl)
+            count += 1
+        if count:
+            pipe.execute()
+
+    def put(self, meta: Dict):
+        self.server.set(self._key(meta['id']), self._dumps(meta), ex=self.ttl)
+
+    def get(self, movie_id) -> Optional[Dict]:
+        data = self.server.get(self._key(movie_id))
+        return None if data is None else json.loads(data)
+
+    def delete(self, movie_id):
+        self.server.delete(self._key(movie_id))
+
+    def _key(self, movie_id):
+        return f'{self.key_prefix}:{movie_id}'
+
+    @staticmethod
+    def _dumps(meta):
+        return json.dumps(meta, ensure_ascii=False, separators=(',', ':'))
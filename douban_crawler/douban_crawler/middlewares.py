@@ -1,46 +1,63 @@
-import aiohttp
 import logging
+import time
 
-import aiohttp
-import logging
-from scrapy import Request
-from typing import Dict, Optional
+from scrapy import Request, signals
+from typing import Dict
+
+from douban_crawler.bans import BreakerBoard, original_url
+from douban_crawler.proxy_pool import ProxyPool
+from douban_crawler.throttle import is_ban_response
+from douban_crawler.utils import get_host_class
 
 
 class ProxyMiddleware:
-    """异步代理中间件，直接从代理池获取代理"""
+    """异步代理中间件，从本地代理池获取代理（代理池在后台批量预取）
+
+    被封禁的代理除了从本地池淘汰，还会计入 proxy:{地址} 熔断器（与 BanMiddleware 共用），
+    冷却期内代理服务再次返回该代理时直接丢弃。
+    代理占用的并发在请求离开下载器时（request_left_downloader）归还；请求在到达下载器之前
+    被后面的中间件丢弃时，由 process_response / process_exception 归还（每个请求只归还一次）。
+    """
+
+    # 最多跳过几个熔断中的代理
+    MAX_SKIPPED_PROXIES = 3
 
-    def __init__(self, settings):
+    def __init__(self, settings, board=None):
         self.logger = logging.getLogger(__name__)
-        self.proxypool_url = settings.get('PROXYPOOL_URL')
-        self.timeout = aiohttp.ClientTimeout(total=10)
-        self.session = None  # 将在爬虫打开时创建
+        self.pool = ProxyPool.from_settings(settings)
+        self.board = board or BreakerBoard()
+        self.ban_retry_times = settings.getint('PROXYPOOL_BAN_RETRY_TIMES', 2)
         self.stats = {
             'total_requests': 0,
             'proxy_used': 0,
-            'proxy_failures': 0
+            'proxy_failures': 0,
+            'per_proxy': {},  # 代理地址 -> 请求数/成功数/失败数/平均延迟（只保留仍在池中的代理）
         }
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings)
+        middleware = cls(crawler.settings, BreakerBoard.from_crawler(crawler))
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.request_left_downloader, signal=signals.request_left_downloader)
+        return middleware
 
     async def spider_opened(self, spider):
-        """爬虫打开时创建共享的ClientSession"""
-        self.session = aiohttp.ClientSession(timeout=self.timeout)
-        spider.logger.info("Proxy middleware initialized with shared session")
+        """爬虫打开时启动代理池的后台预取"""
+        await self.pool.start()
+        spider.logger.info("Proxy middleware initialized with local proxy pool")
 
     async def spider_closed(self, spider, reason):
-        """爬虫关闭时关闭会话"""
-        if self.session:
-            await self.session.close()
-            spider.logger.info("Proxy session closed")
+        """爬虫关闭时停止代理池"""
+        await self.pool.close()
+        spider.logger.info("Proxy pool closed")
 
         # 输出统计信息
         spider.logger.info(f"Proxy usage stats: "
                            f"Total requests: {self.stats['total_requests']}, "
                            f"Proxy used: {self.stats['proxy_used']}, "
-                           f"Proxy failures: {self.stats['proxy_failures']}")
+                           f"Proxy failures: {self.stats['proxy_failures']}, "
+                           f"Proxies evicted: {self.pool.evicted}")
 
     async def process_request(self, request: Request, spider):
         """处理请求，设置代理"""
@@ -50,26 +67,84 @@ class ProxyMiddleware:
         if 'proxy' in request.meta:
             return
 
-        # 获取代理
-        try:
-            async with self.session.get(self.proxypool_url) as response:
-                if response.status != 200:
-                    spider.logger.warning(f"Proxy pool returned {response.status}")
-                    return
-
-                # 解析代理信息
-                proxy_info = await response.json()
-                if not proxy_info or 'proxy' not in proxy_info:
-                    spider.logger.warning("Invalid proxy info received")
-                    return
-
-                # 设置代理
-                proxy_address = proxy_info['proxy']
-                request.meta['proxy'] = f'http://{proxy_address}'
-                request.meta['proxy_info'] = proxy_info
-
-                self.stats['proxy_used'] += 1
-                spider.logger.debug(f"Using proxy: {proxy_address} for {request.url}")
-        except Exception as e:
+        proxy_address = await self.pool.get()
+        for _ in range(self.MAX_SKIPPED_PROXIES):
+            if proxy_address is None or not self.board.remaining(f'proxy:{proxy_address}'):
+                break
+            self.pool.evict(proxy_address)
+            proxy_address = await self.pool.get()
+        if proxy_address is None:
             self.stats['proxy_failures'] += 1
-            spider.logger.error(f"Failed to get proxy: {str(e)}")
+            spider.logger.warning("No proxy available from local pool")
+            return
+
+        request.meta['proxy'] = f'http://{proxy_address}'
+        request.meta['proxy_address'] = proxy_address
+        request.meta['proxy_start_time'] = time.time()
+        request.meta['proxy_in_flight'] = True
+        self.stats['proxy_used'] += 1
+        self._proxy_stats(proxy_address)['requests'] += 1
+        spider.logger.debug(f"Using proxy: {proxy_address} for {request.url}")
+
+    def request_left_downloader(self, request, spider):
+        self._release(request)
+
+    def process_response(self, request: Request, response, spider):
+        """根据响应反馈代理健康状况，被封禁时换代理重试"""
+        proxy_address = request.meta.get('proxy_address')
+        if not proxy_address:
+            return response
+        self._release(request)
+
+        banned = is_ban_response(response, get_host_class(original_url(request)))
+        self.board.record(f'proxy:{proxy_address}', banned)
+        if banned:
+            self._report_failure(proxy_address, ban=True)
+            retry_times = request.meta.get('proxy_ban_retry_times', 0)
+            if retry_times < self.ban_retry_times:
+                spider.logger.debug(f"Proxy {proxy_address} banned, retrying {request.url}")
+                return self._without_proxy(request, proxy_ban_retry_times=retry_times + 1)
+            return response
+
+        latency = request.meta.get('download_latency') or time.time() - request.meta['proxy_start_time']
+        self.pool.report_success(proxy_address, latency)
+        stats = self._proxy_stats(proxy_address)
+        stats['successes'] += 1
+        stats['total_latency'] += latency
+        stats['avg_latency'] = round(stats['total_latency'] / stats['successes'], 3)
+        return response
+
+    def process_exception(self, request: Request, exception, spider):
+        proxy_address = request.meta.get('proxy_address')
+        if proxy_address:
+            self._release(request)
+            self._report_failure(proxy_address)
+
+    def _release(self, request):
+        if request.meta.pop('proxy_in_flight', False):
+            self.pool.release(request.meta['proxy_address'])
+
+    def _report_failure(self, proxy_address, ban=False):
+        self.pool.report_failure(proxy_address, ban=ban)
+        self._proxy_stats(proxy_address)['failures'] += 1
+
+    def _proxy_stats(self, proxy_address) -> Dict:
+        per_proxy = self.stats['per_proxy']
+        stats = per_proxy.get(proxy_address)
+        if stats is None:
+            if len(per_proxy) >= 2 * self.pool.max_size:
+                # 丢弃已被淘汰的代理，统计量不随代理轮换无限增长
+                for address in [address for address in per_proxy if address not in self.pool.proxies]:
+                    del per_proxy[address]
+            stats = per_proxy[proxy_address] = {
+                'requests': 0, 'successes': 0, 'failures': 0,
+                'total_latency': 0.0, 'avg_latency': 0.0,
+            }
+        return stats
+
+    @staticmethod
+    def _without_proxy(request: Request, **meta) -> Request:
+        new_meta = {k: v for k, v in request.meta.items()
+                    if k not in ('proxy', 'proxy_address', 'proxy_start_time', 'proxy_in_flight')}
+        new_meta.update(meta)
+        return request.replace(meta=new_meta, dont_filter=True)
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import time
+from typing import Dict, Iterable, Optional
+
+
+# 计算API记录指纹的字段（任一变化即重新抓取详情页）
+DEFAULT_FINGERPRINT_FIELDS = ('title', 'score', 'vote_count', 'release_date', 'url')
+
+# 从详情页/预告片页得到、需要保存下来的字段（其余字段每次都取自API）
+DETAIL_FIELDS = ('cover', 'trailer', 'hot_comments', 'summary')
+
+
+class MovieStateStore:
+    """增量模式下每部电影的状态: API记录指纹 + 上次完整抓取时间 + 详情字段
+
+    douban:movie_state  hash，电影id -> {"fp": 指纹, "t": 抓取时间, "row": 详情字段}
+    每个API页只用一次 HMGET 判断哪些电影需要重新抓取详情页。
+    """
+
+    def __init__(self, server, key='douban:movie_state', max_age=30 * 24 * 3600,
+                 fields=DEFAULT_FINGERPRINT_FIELDS):
+        self.server = server
+        self.key = key
+        self.max_age = max_age
+        self.fields = tuple(fields)
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(
+            server,
+            key=settings.get('INCREMENTAL_STATE_KEY', 'douban:movie_state'),
+            max_age=settings.getint('INCREMENTAL_MAX_AGE', 30 * 24 * 3600),
+            fields=settings.getlist('INCREMENTAL_FINGERPRINT_FIELDS', DEFAULT_FINGERPRINT_FIELDS),
+        )
+
+    def fingerprint(self, movie_data: Dict) -> str:
+        values = [movie_data.get(field, '') for field in self.fields]
+        payload = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+    def unchanged(self, movies: Iterable[Dict]) -> Dict[str, Dict]:
+        """返回 电影id -> 已保存的详情字段（仅限指纹一致且未过期的电影）"""
+        movies = list(movies)
+        if not movies:
+            return {}
+        states = self.server.hmget(self.key, [str(movie['id']) for movie in movies])
+        now = time.time()
+        result = {}
+        for movie, state in zip(movies, states):
+            if state is None:
+                continue
+            state = json.loads(state)
+            if state['fp'] == self.fingerprint(movie) and now - state['t'] < self.max_age:
+                result[str(movie['id'])] = state['row']
+        return result
+
+    def save(self, movie_id, fingerprint: Optional[str], meta: Dict):
+        """详情（和预告片）抓取完成后保存状态"""
+        if fingerprint is None:
+            return
+        state = {
+            'fp': fingerprint,
+            't': int(time.time()),
+            'row': {field: meta.get(field) for field in DETAIL_FIELDS},
+        }
+        self.server.hset(self.key, str(movie_id), json.dumps(state, ensure_ascii=False))
+
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+# 列名与顺序（列表字段存为 JSON 字符串）
+COLUMNS = (
+    'id', 'title', 'score', 'url', 'vote_count', 'actor_count', 'genres', 'regions', 'release_date',
+    'has_cover', 'has_trailer', 'hot_comments', 'summary', 'cover_path', 'trailer_path',
+    'source_type', 'source_interval', 'node_id', 'updated_at',
+)
+JSON_COLUMNS = ('genres', 'regions', 'hot_comments')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    score REAL,
+    url TEXT,
+    vote_count INTEGER,
+    actor_count INTEGER,
+    genres TEXT,
+    regions TEXT,
+    release_date TEXT,
+    has_cover INTEGER NOT NULL DEFAULT 0,
+    has_trailer INTEGER NOT NULL DEFAULT 0,
+    hot_comments TEXT,
+    summary TEXT,
+    cover_path TEXT,
+    trailer_path TEXT,
+    source_type INTEGER,
+    source_interval TEXT,
+    node_id TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS movies_score ON movies (score);
+CREATE INDEX IF NOT EXISTS movies_vote_count ON movies (vote_count);
+CREATE INDEX IF NOT EXISTS movies_release_date ON movies (release_date);
+"""
+
+# 外部内容 FTS 表，由触发器与 movies 保持同步
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(
+    summary, hot_comments, content='movies', content_rowid='rowid', tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN
+    INSERT INTO movies_fts (rowid, summary, hot_comments) VALUES (new.rowid, new.summary, new.hot_comments);
+END;
+CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, summary, hot_comments)
+    VALUES ('delete', old.rowid, old.summary, old.hot_comments);
+END;
+CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF summary, hot_comments ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, summary, hot_comments)
+    VALUES ('delete', old.rowid, old.summary, old.hot_comments);
+    INSERT INTO movies_fts (rowid, summary, hot_comments) VALUES (new.rowid, new.summary, new.hot_comments);
+END;
+"""
+FTS_TRIGGERS = ('movies_fts_insert', 'movies_fts_delete', 'movies_fts_update')
+
+# 按电影id覆盖更新；新数据缺少封面/预告片（例如由其他节点下载）时保留已有的
+_UPSERT_SET = ', '.join(
+    f'{column} = excluded.{column}' for column in COLUMNS
+    if column not in ('id', 'has_cover', 'has_trailer', 'cover_path', 'trailer_path')
+) + """,
+    has_cover = MAX(movies.has_cover, excluded.has_cover),
+    has_trailer = MAX(movies.has_trailer, excluded.has_trailer),
+    cover_path = COALESCE(excluded.cover_path, movies.cover_path),
+    trailer_path = COALESCE(excluded.trailer_path, movies.trailer_path)"""
+UPSERT_SQL = (f"INSERT INTO movies ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+              f"ON CONFLICT (id) DO UPDATE SET {_UPSERT_SET}")
+# 合并另一个库：只有更新时间更晚的行才覆盖
+MERGE_SQL = (f"INSERT INTO movies ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM source.movies WHERE true "
+             f"ON CONFLICT (id) DO UPDATE SET {_UPSERT_SET} WHERE excluded.updated_at > movies.updated_at")
+
+
+def to_row(item, node_id=None, updated_at=None) -> tuple:
+    """item -> 按 COLUMNS 排列的一行（空串存为 NULL）"""
+    row = []
+    for column in COLUMNS:
+        if column == 'node_id':
+            value = node_id
+        elif column == 'updated_at':
+            value = updated_at or time.time()
+        else:
+            value = item.get(column)
+        if column in JSON_COLUMNS:
+            value = json.dumps(_to_list(value), ensure_ascii=False) if value else None
+        elif column == 'score':
+            value = _to_number(value, float)
+        elif column in ('vote_count', 'actor_count', 'source_type'):
+            value = _to_number(value, int)
+        elif column in ('has_cover', 'has_trailer'):
+            value = int(bool(value))
+        elif value == '':
+            value = None
+        elif value is not None:
+            value = str(value)
+        row.append(value)
+    return tuple(row)
+
+
+def _to_number(value, number_type):
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_list(value):
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value]
+
+
+class MovieDatabase:
+    """SQLite 电影库（WAL 模式）
+
+    - movies 表按电影id主键 upsert，重爬时原地更新；score / vote_count / release_date 有索引
+    - movies_fts 为 summary 与 hot_comments 的 FTS5 全文索引（trigram 分词，支持中文子串检索，
+      查询词至少3个字符；SQLite 不支持 trigram 时退回 unicode61）
+    - 写入由调用方攒批，一批一个事务
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA.format(tokenizer='trigram'))
+        except sqlite3.OperationalError:
+            self.db.executescript(FTS_SCHEMA.format(tokenizer='unicode61'))
+        self.db.commit()
+
+    def upsert_many(self, rows: Iterable[tuple]) -> int:
+        """一个事务写入一批（to_row 的结果）"""
+        with self.db:
+            cursor = self.db.executemany(UPSERT_SQL, rows)
+        return cursor.rowcount
+
+    def merge(self, source_path) -> int:
+        """合并另一个节点的库（整表一条 INSERT ... SELECT），返回写入/更新的行数"""
+        self.db.execute('ATTACH DATABASE ? AS source', (source_path,))
+        try:
+            with self.db:
+                cursor = self.db.execute(MERGE_SQL)
+            return cursor.rowcount
+        finally:
+            self.db.execute('DETACH DATABASE source')
+
+    def drop_fts_triggers(self):
+        """批量合并前去掉逐行同步的触发器，合并后用 rebuild_fts() 一次重建"""
+        for trigger in FTS_TRIGGERS:
+            self.db.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        self.db.commit()
+
+    def rebuild_fts(self):
+        """重建全文索引并恢复触发器"""
+        with self.db:
+            self.db.execute("INSERT INTO movies_fts (movies_fts) VALUES ('rebuild')")
+        self.db.executescript(FTS_SCHEMA.format(tokenizer=self._fts_tokenizer()))
+        self.db.commit()
+
+    def get(self, movie_id) -> Optional[Dict]:
+        cursor = self.db.execute('SELECT * FROM movies WHERE id = ?', (str(movie_id),))
+        row = cursor.fetchone()
+        return self._to_dict(cursor, row) if row is not None else None
+
+    def search(self, query, limit=20) -> List[Dict]:
+        """全文检索 summary / hot_comments，按相关度排序"""
+        cursor = self.db.execute(
+            'SELECT movies.* FROM movies_fts JOIN movies ON movies.rowid = movies_fts.rowid '
+            'WHERE movies_fts MATCH ? ORDER BY movies_fts.rank LIMIT ?',
+            (query, limit),
+        )
+        return [self._to_dict(cursor, row) for row in cursor.fetchall()]
+
+    def count(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM movies').fetchone()[0]
+
+    def optimize(self):
+        """合并 FTS 段、更新查询规划统计，并把 WAL 写回主文件"""
+        with self.db:
+            self.db.execute("INSERT INTO movies_fts (movies_fts) VALUES ('optimize')")
+        self.db.execute('PRAGMA optimize')
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        self.db.close()
+
+    def _fts_tokenizer(self):
+        row = self.db.execute("SELECT sql FROM sqlite_master WHERE name = 'movies_fts'").fetchone()
+        return 'trigram' if row and "'trigram'" in row[0] else 'unicode61'
+
+    @staticmethod
+    def _to_dict(cursor, row) -> Dict:
+        data = dict(zip((column[0] for column in cursor.description), row))
+        for column in JSON_COLUMNS:
+            data[column] = json.loads(data[column]) if data.get(column) else []
+        data['has_cover'] = bool(data['has_cover'])
+        data['has_trailer'] = bool(data['has_trailer'])
+        return data
@@ -0,0 +1,165 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from scrapy.exceptions import IgnoreRequest
+
+from douban_crawler.leased_queue import request_discarded
+from douban_crawler.redis_client import RedisClient
+
+
+# 记录一个 (类型, 区间) 的页数上限，只会调小；页数确定时同时写入历史记录
+# KEYS: 本次运行的页数上限hash, 历史页数hash   ARGV: 字段, 页数上限, 是否确定
+RECORD_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if not current or tonumber(ARGV[2]) < current then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    current = tonumber(ARGV[2])
+end
+if ARGV[3] == '1' then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+end
+return current
+"""
+
+
+class PaginationPlanner:
+    """top_list 分页计划：每个 (类型, 区间) 预先调度多页，不再逐页串行
+
+    - 每收到一个满页，保证其后 lookahead 页都已调度（lookahead=1 即原来的逐页串行）
+    - 区间首页返回后立即开始下一区间（各区间的页数互不相关）
+    - 短页/空页确定区间页数后，超出的预调度请求由 PaginationMiddleware 丢弃
+    - 页数记录在 douban:page_counts，之后的运行一开始就按历史页数展开
+    重复调度的 URL 由 scrapy_redis 的去重过滤器过滤。plan() 可在Redis线程池中并发调用。
+    """
+
+    def __init__(self, server, intervals, page_size=100, lookahead=3,
+                 counts_key='douban:page_counts', ends_key='douban:page_ends'):
+        self.server = server
+        self.intervals = list(intervals)
+        self.page_size = page_size
+        self.lookahead = max(lookahead, 1)  # 1 即逐页串行
+        self.counts_key = counts_key
+        self.ends_key = ends_key
+        self._record_script = server.register_script(RECORD_SCRIPT)
+        self.history: Optional[Dict[str, int]] = None  # 首次使用时从Redis读取
+        self.ends: Dict[str, int] = {}  # 本次运行已知的页数上限
+        self.scheduled: Dict[str, int] = {}  # 已调度到的页数
+        self.started = set()  # 已开始的 (类型, 区间)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, server, intervals, settings):
+        return cls(
+            server,
+            intervals,
+            lookahead=settings.getint('PAGINATION_LOOKAHEAD', 3),
+            counts_key=settings.get('PAGINATION_COUNTS_KEY', 'douban:page_counts'),
+            ends_key=settings.get('PAGINATION_ENDS_KEY', 'douban:page_ends'),
+        )
+
+    def start(self, movie_type) -> List[Tuple[str, int]]:
+        """某个类型的首批请求: 第一个区间的前若干页"""
+        return self._start_interval(movie_type, self.intervals[0])
+
+    def plan(self, movie_type, interval_id, start, movie_count) -> List[Tuple[str, int]]:
+        """收到一页后需要新调度的 (区间, 起始位置) 列表"""
+        with self._lock:
+            return self._plan(movie_type, interval_id, start, movie_count)
+
+    def _plan(self, movie_type, interval_id, start, movie_count):
+        field = self._field(movie_type, interval_id)
+        pages = []
+        if movie_count < self.page_size:
+            self._record_end(field, start, movie_count)
+        else:
+            # 满页：向后补足预调度窗口（不超过已知页数）
+            wanted = start // self.page_size + 1 + self.lookahead
+            pages.extend(self._extend(movie_type, interval_id, wanted))
+
+        index = self.intervals.index(interval_id)
+        if index + 1 < len(self.intervals) and (start == 0 or movie_count < self.page_size):
+            pages.extend(self._start_interval(movie_type, self.intervals[index + 1]))
+        return pages
+
+    def is_obsolete(self, movie_type, interval_id, start) -> bool:
+        """该页是否已超出区间页数（短页返回后预调度的请求）"""
+        field = self._field(movie_type, interval_id)
+        end = self.ends.get(field)
+        if end is None:
+            end = self.server.hget(self.ends_key, field)
+            if end is None:
+                return False
+            end = self.ends[field] = int(end)
+        return start // self.page_size >= end
+
+    def known_obsolete(self, movie_type, interval_id, start) -> Optional[bool]:
+        """只查本地缓存的 is_obsolete()；本地没有该区间的页数上限时返回 None"""
+        end = self.ends.get(self._field(movie_type, interval_id))
+        if end is None:
+            return None
+        return start // self.page_size >= end
+
+    def _start_interval(self, movie_type, interval_id):
+        key = (movie_type, interval_id)
+        if key in self.started:
+            return []
+        self.started.add(key)
+        depth = max(self._history().get(self._field(movie_type, interval_id), 0), self.lookahead)
+        return self._extend(movie_type, interval_id, depth)
+
+    def _extend(self, movie_type, interval_id, wanted):
+        field = self._field(movie_type, interval_id)
+        end = self.ends.get(field)
+        if end is not None:
+            wanted = min(wanted, end)
+        scheduled = self.scheduled.get(field, 0)
+        if wanted <= scheduled:
+            return []
+        self.scheduled[field] = wanted
+        return [(interval_id, page * self.page_size) for page in range(scheduled, wanted)]
+
+    def _record_end(self, field, start, movie_count):
+        # 非空短页即最后一页，页数确定；空页只说明页数不超过该页
+        pages = start // self.page_size + (1 if movie_count else 0)
+        exact = movie_count > 0 or start == 0
+        end = self._record_script(keys=[self.ends_key, self.counts_key], args=[field, pages, int(exact)])
+        self.ends[field] = int(end)
+        if exact:
+            self._history()[field] = pages
+
+    def _history(self):
+        if self.history is None:
+            self.history = {field: int(pages) for field, pages in self.server.hgetall(self.counts_key).items()}
+        return self.history
+
+    @staticmethod
+    def _field(movie_type, interval_id):
+        return f'{movie_type}:{interval_id}'
+
+
+class PaginationMiddleware:
+    """下载前丢弃已超出区间页数的预调度 top_list 请求"""
+
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.signals = crawler.signals
+        self.redis = RedisClient.from_crawler(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    async def process_request(self, request, spider):
+        page = request.meta.get('page')
+        planner = getattr(spider, 'pagination', None)
+        if page is None or planner is None:
+            return None
+        obsolete = planner.known_obsolete(*page)
+        if obsolete is None:
+            # 本地未知时查询其他节点记录的页数上限（Redis线程池）
+            obsolete = await self.redis.run(planner.is_obsolete, *page)
+        if obsolete:
+            self.stats.inc_value('pagination/dropped')
+            self.signals.send_catch_log(request_discarded, request=request, spider=spider)
+            raise IgnoreRequest(f"区间已结束，丢弃预调度页: {request.url}")
+        return None
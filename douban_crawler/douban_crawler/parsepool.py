@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from scrapy import signals
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer
+
+from douban_crawler.extractors import extract_detail_from_bytes
+
+
+def _extract_detail(body: bytes, encoding: str):
+    """工作进程中执行：解析详情页，返回普通dict和解析耗时"""
+    start = time.perf_counter()
+    page = extract_detail_from_bytes(body, encoding)
+    return page._asdict(), time.perf_counter() - start
+
+
+class ParsePool:
+    """详情页解析进程池（PARSE_POOL_ENABLED 开启）
+
+    - 原始响应字节发给工作进程解析，结果以 dict 经 Deferred 返回，reactor 线程只负责I/O
+    - 未完成任务达到 PARSE_POOL_MAX_PENDING 时暂停引擎调度新请求，降到一半以下再恢复
+    - 统计: parsepool/tasks、pending_max（队列深度峰值）、parse_seconds / wait_seconds（累计耗时）、
+      parse_seconds_max、paused
+    """
+
+    def __init__(self, crawler, workers, max_pending):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self.pending = 0
+        self.paused = False
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),  # 不复制reactor和Redis线程池
+        )
+        crawler.signals.connect(self.close, signal=signals.engine_stopped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """未启用时返回 None"""
+        settings = crawler.settings
+        if not settings.getbool('PARSE_POOL_ENABLED', False):
+            return None
+        workers = settings.getint('PARSE_POOL_WORKERS', 0) or max((os.cpu_count() or 2) - 1, 1)
+        return cls(crawler, workers, settings.getint('PARSE_POOL_MAX_PENDING', workers * 8))
+
+    def submit(self, body: bytes, encoding='utf-8') -> defer.Deferred:
+        """提交一个详情页，Deferred 的结果为 DetailPage 字段组成的 dict"""
+        from twisted.internet import reactor
+        d = defer.Deferred()
+        submitted = time.perf_counter()
+        self._task_started()
+        future = self.executor.submit(_extract_detail, body, encoding)
+        future.add_done_callback(lambda f: reactor.callFromThread(self._task_done, f, d, submitted))
+        return d
+
+    async def extract_detail(self, body: bytes, encoding='utf-8') -> Dict:
+        return await maybe_deferred_to_future(self.submit(body, encoding))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _task_started(self):
+        self.pending += 1
+        self.stats.inc_value('parsepool/tasks')
+        self.stats.max_value('parsepool/pending_max', self.pending)
+        if self.pending >= self.max_pending and not self.paused:
+            # 进程池饱和：暂停调度，已在下载中的请求不受影响
+            self.paused = True
+            self.stats.inc_value('parsepool/paused')
+            self.crawler.engine.pause()
+
+    def _task_done(self, future, d, submitted):
+        self.pending -= 1
+        if self.paused and self.pending <= self.max_pending // 2:
+            self.paused = False
+            self.crawler.engine.unpause()
+        if future.cancelled():
+            d.errback(defer.CancelledError())
+            return
+        error = future.exception()
+        if error is not None:
+            self.stats.inc_value('parsepool/errors')
+            d.errback(error)
+            return
+        page, parse_seconds = future.result()
+        self.stats.inc_value('parsepool/parse_seconds', parse_seconds)
+        self.stats.inc_value('parsepool/wait_seconds', time.perf_counter() - submitted - parse_seconds)
+        self.stats.max_value('parsepool/parse_seconds_max', parse_seconds)
+        d.callback(page)
@@ -1,13 +1,43 @@
 import csv
+import importlib.util
 import os
 import json
+import time
+from douban_crawler.instrumentation import timed_stage
+from douban_crawler.media import MediaLane
+from douban_crawler.moviedb import MovieDatabase, to_row
+from douban_crawler.redis_client import RedisClient
+from douban_crawler.registry import LEASED, BUSY, MediaRegistry
 from douban_crawler.utils import get_node_id
 from typing import Dict, Union
 from scrapy import Request
-from scrapy.exceptions import DropItem
-from scrapy.pipelines.files import FilesPipeline
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.pipelines.files import FilesPipeline, FSFilesStore
+from scrapy.utils.defer import deferred_from_coro, maybe_deferred_to_future
+from twisted.internet import task
 
 class CustomFilesPipeline(FilesPipeline):
+    MEDIA_TYPES = ('cover', 'trailer')
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        # 这些类型的文件交给 MediaStreamMiddleware 流式写盘（仅本地文件存储）
+        self.stream_types = set(spider.settings.getlist('MEDIA_STREAM_TYPES', ['trailer']))
+        if not isinstance(self.store, FSFilesStore):
+            self.stream_types = set()
+        # 独立媒体通道：流式下载不经过 Scrapy 下载器，不占用页面请求的并发
+        self.lane = MediaLane.from_crawler(spider.crawler) if self.stream_types else None
+        if self.lane is not None:
+            self.download_func = self._download
+        # 集群媒体登记表：已下载的文件不再重复下载，下载中的文件由租约互斥
+        self.redis = RedisClient.from_crawler(spider.crawler)
+        self.registry = None
+        if spider.settings.getbool('MEDIA_REGISTRY_ENABLED', True):
+            self.registry = MediaRegistry.from_settings(self.redis.server, get_node_id(), spider.settings)
+        self._present = {}  # (电影id, 类型) -> 已存在文件的路径
+        self._busy = set()  # (电影id, 类型)，其他节点正在下载
+        self._requests = {}  # 电影id -> 登记表查询后仍需下载的请求
+
     def file_path(self, request, response=None, info=None, *, item=None):
         def _safe_filename(name: str) -> str:
             """将文件名中的非法字符替换为下划线。"""
@@ -22,42 +52,150 @@ class CustomFilesPipeline(FilesPipeline):
         item[f'{type}_path'] = f'{type}/{title}_{Id}.{file_extension}'
         return item[f'{type}_path']
 
+    def media_downloaded(self, response, request, info, *, item=None):
+        if 'streamed' not in response.flags:
+            return super().media_downloaded(response, request, info, item=item)
+        # 文件已由 MediaStreamMiddleware / 媒体通道写入最终路径（中间件换代理重试时为新的请求）
+        self.inc_stats(info.spider, 'downloaded')
+        return {
+            'url': request.url,
+            'path': self.file_path(request, response=response, info=info, item=item),
+            'checksum': response.request.meta['stream_checksum'],
+            'status': 'downloaded',
+        }
+
     def item_completed(self, results, item, info):
-        file_urls = [x['url'] for ok, x in results if ok]
-        item['has_cover'] = bool(item['cover'] and item['cover'] in file_urls)
-        item['has_trailer'] = bool(item['trailer'] and item['trailer'] in file_urls)
-        if not item['has_cover']:
-            item['cover_path'] = ""
-        if not item['has_trailer']:
-            item['trailer_path'] = ""
-        if (item['cover'] or item['trailer']) and not file_urls:
+        downloaded = {x['url']: x for ok, x in results if ok}
+        records = {}
+        failed = []
+        available = False
+        busy = False
+        for media_type in self.MEDIA_TYPES:
+            key = (item['id'], media_type)
+            present_path = self._present.pop(key, None)
+            key_busy = key in self._busy
+            self._busy.discard(key)
+            busy |= key_busy
+            url = item[media_type]
+            if present_path is not None:
+                item[f'has_{media_type}'] = True
+                item[f'{media_type}_path'] = present_path
+            elif url and url in downloaded:
+                item[f'has_{media_type}'] = True
+                records[media_type] = self._file_record(downloaded[url])
+            else:
+                item[f'has_{media_type}'] = False
+                item[f'{media_type}_path'] = ""
+                if url and not key_busy:
+                    failed.append(media_type)
+            available |= item[f'has_{media_type}']
+
+        if self.registry is not None:
+            self.redis.fire_and_forget(self.registry.finish, item['id'], records, failed)
+        quota = getattr(info.spider, 'quota', None)
+        unavailable = [media_type for media_type in self.MEDIA_TYPES
+                       if item[media_type] and not item[f'has_{media_type}']]
+        if quota is not None and unavailable:
+            # 下载失败或由其他节点下载：归还名额
+            self.redis.fire_and_forget(quota.release, item['id'], unavailable)
+        if (item['cover'] or item['trailer']) and not available and not busy:
             raise DropItem("File Downloaded Failed")
         return item
 
+    @timed_stage('files')
+    async def process_item(self, item, spider):
+        """先在Redis线程池中查询登记表，再交给 FilesPipeline 下载"""
+        requests = self._media_requests(item)
+        if self.registry is not None and requests:
+            states = await self.redis.run(self.registry.claim, item['id'], list(requests))
+            for media_type, state in states.items():
+                key = (item['id'], media_type)
+                if state == BUSY:
+                    # 其他节点正在下载同一文件
+                    self._busy.add(key)
+                    del requests[media_type]
+                elif state != LEASED:
+                    # 已由其他节点（或重启前）下载完成
+                    self._present[key] = state['path']
+                    del requests[media_type]
+        self._requests[item['id']] = list(requests.values())
+        if self.lane is not None:
+            # 媒体通道已满时item在此等待，不再提交新的下载
+            await self.lane.wait_for_room(sum('stream_path' in r.meta for r in requests.values()))
+        return await maybe_deferred_to_future(super().process_item(item, spider))
+
+    def _download(self, request, spider):
+        """流式下载交给媒体通道，其余请求照常经过下载器"""
+        self._modify_media_request(request)
+        if 'stream_path' in request.meta:
+            return deferred_from_coro(self._lane_download(request, spider))
+        return self.crawler.engine.download(request)
+
+    async def _lane_download(self, request, spider):
+        """媒体通道的请求同样经过下载器中间件（User-Agent、默认请求头、代理、封禁识别），
+        只把实际的下载换成 MediaLane.fetch；中间件返回新请求（换代理重试等）时重新下载"""
+        middleware = self.crawler.engine.downloader.middleware
+        while True:
+            request.meta['media_lane'] = True
+            result = await maybe_deferred_to_future(middleware.download(self._lane_fetch, request, spider))
+            if not isinstance(result, Request):
+                return result
+            request = result
+
+    def _lane_fetch(self, request, spider):
+        return deferred_from_coro(self.lane.fetch(request))
+
     def get_media_requests(self, item, info):
-        if item['cover']:
-            yield Request(item['cover'], meta={
-                'type': 'cover',
-            }, dont_filter=True)
-        if item['trailer']:
-            yield Request(item['trailer'], meta={
-                'type': 'trailer',
-            }, dont_filter=True)
+        return self._requests.pop(item['id'], [])
+
+    def _media_requests(self, item):
+        requests = {}
+        for media_type in self.MEDIA_TYPES:
+            if not item[media_type]:
+                continue
+            # 详情页作为 Referer（豆瓣图片/视频CDN的防盗链）
+            request = Request(item[media_type], meta={
+                'type': media_type,
+            }, headers={'Referer': item['url']} if item.get('url') else None, dont_filter=True)
+            path = self.file_path(request, item=item)  # file_path 不使用 info
+            if self._stored(path):
+                # 本地快速路径：文件已在存储中，不发请求也不访问Redis
+                self._present[(item['id'], media_type)] = path
+                continue
+            if media_type in self.stream_types:
+                request.meta['stream_path'] = os.path.join(self.store.basedir, path)
+            requests[media_type] = request
+        return requests
+
+    def _stored(self, path):
+        if not isinstance(self.store, FSFilesStore):
+            return False
+        return os.path.isfile(os.path.join(self.store.basedir, path))
+
+    def _file_record(self, result):
+        record = {'path': result['path'], 'checksum': result['checksum']}
+        if isinstance(self.store, FSFilesStore):
+            record['size'] = os.path.getsize(os.path.join(self.store.basedir, result['path']))
+        return record
 
 
 class FileCountPipeline:
-    def process_item(self, item, spider):
-        if item['has_cover']:
-            spider.redis_conn.sadd('douban:cover_ids', item['id'])
-        if item['has_trailer']:
-            spider.redis_conn.sadd('douban:trailer_ids', item['id'])
-        cover_count = spider.redis_conn.scard('douban:cover_ids')
-        trailer_count = spider.redis_conn.scard('douban:trailer_ids')
-        if cover_count >= spider.target_count and trailer_count >= spider.target_count:
+    @timed_stage('file_count')
+    async def process_item(self, item, spider):
+        # 一次脚本调用完成计数，并刷新缓存的集群总数（在Redis线程池中执行）
+        if await spider.redis.run(self._record, spider.target_counter, spider.quota, item):
             spider.logger.info(f"已达到目标电影数量 {spider.target_count}, 关闭爬虫")
             spider.crawler.engine.close_spider(spider, 'target_reached')
         return item
 
+    @staticmethod
+    def _record(target_counter, quota, item):
+        target_counter.record(item['id'], item['has_cover'], item['has_trailer'])
+        if quota is not None:
+            # 已计入完成集合，租约不再需要
+            quota.release(item['id'], [t for t in quota.MEDIA_TYPES if item[f'has_{t}']])
+        return target_counter.target_reached()
+
 
 class DoubanCsvPipeline:
     CSV_HEADERS = [
@@ -100,33 +238,224 @@ class DoubanCsvPipeline:
         spider.logger.info(f"保存了 {self.count} 部电影信息到 {self.filename}\n"
                            f"下载封面数：{self.cover_count}，预告片数：{self.trailer_count}")
 
+    @timed_stage('csv')
     def process_item(self, item, spider):
         """写入CSV格式数据"""
-
-        def normalize_row(row: Dict) -> Dict:
-            """
-            规范化行数据：
-            - 布尔转 0/1
-            - 列表转 JSON 字符串
-            - 缺失字段补空串
-            """
-            normalized: Dict[str, Union[str, int]] = {}
-            for key in self.CSV_HEADERS:
-                val = row.get(key)
-                if isinstance(val, bool):
-                    normalized[key] = 1 if val else 0
-                elif isinstance(val, (list, dict)):
-                    normalized[key] = json.dumps(val, ensure_ascii=False)
-                elif val is None:
-                    normalized[key] = ''
-                else:
-                    normalized[key] = val
-            return normalized
-        # 格式化数据
-        row = normalize_row(item)
+        row = self.normalize_row(item)
 
         self.writer.writerow(row)
         self.count += 1
         self.cover_count += row['has_cover']
         self.trailer_count += row['has_trailer']
-        return item
\ No newline at end of file
+        return item
+
+    def normalize_row(self, row: Dict) -> Dict:
+        """
+        规范化行数据：
+        - 布尔转 0/1
+        - 列表转 JSON 字符串
+        - 缺失字段补空串
+        """
+        normalized: Dict[str, Union[str, int]] = {}
+        for key in self.CSV_HEADERS:
+            val = row.get(key)
+            if isinstance(val, bool):
+                normalized[key] = 1 if val else 0
+            elif isinstance(val, (list, dict)):
+                normalized[key] = json.dumps(val, ensure_ascii=False)
+            elif val is None:
+                normalized[key] = ''
+            else:
+                normalized[key] = val
+        return normalized
+
+
+class DoubanParquetPipeline:
+    """按批写入带类型的 Parquet 文件（列表字段为真正的 list 列）
+
+    - 内存中按列缓冲，满 PARQUET_BATCH_SIZE 行或定时写出一个 record batch
+    - 按行数/文件大小轮转，写入中的文件以 .inprogress 结尾，完成后重命名
+    - pyarrow 为可选依赖，只在启用本管道时导入（未安装时管道不启用）
+    """
+
+    @staticmethod
+    def build_schema():
+        import pyarrow as pa
+        return pa.schema([
+            ('id', pa.string()),
+            ('title', pa.string()),
+            ('score', pa.float64()),
+            ('url', pa.string()),
+            ('vote_count', pa.int64()),
+            ('actor_count', pa.int64()),
+            ('genres', pa.list_(pa.string())),
+            ('regions', pa.list_(pa.string())),
+            ('release_date', pa.string()),
+            ('has_cover', pa.bool_()),
+            ('has_trailer', pa.bool_()),
+            ('hot_comments', pa.list_(pa.string())),
+            ('summary', pa.string()),
+            ('cover_path', pa.string()),
+            ('trailer_path', pa.string()),
+        ])
+
+    def __init__(self, settings):
+        self.directory = settings.get('PARQUET_DIR', 'data/parquet')
+        self.batch_size = settings.getint('PARQUET_BATCH_SIZE', 500)
+        self.rows_per_file = settings.getint('PARQUET_ROWS_PER_FILE', 100000)
+        self.max_file_bytes = settings.getint('PARQUET_MAX_FILE_BYTES', 256 * 1024 * 1024)
+        self.flush_interval = settings.getfloat('PARQUET_FLUSH_INTERVAL', 60)
+        self.compression = settings.get('PARQUET_COMPRESSION', 'zstd')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise NotConfigured('DoubanParquetPipeline 需要安装 pyarrow')
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        self.node_id = get_node_id()
+        os.makedirs(self.directory, exist_ok=True)
+        self.schema = self.build_schema()
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        self.writer = None
+        self.path = None
+        self.file_rows = 0
+        self.file_seq = 0
+        self.count = 0
+        self.files = []
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush()
+        self._close_file()
+        spider.logger.info(f"保存了 {self.count} 部电影信息到 {len(self.files)} 个 Parquet 文件 ({self.directory})")
+
+    @timed_stage('parquet')
+    def process_item(self, item, spider):
+        columns = self.columns
+        columns['id'].append(self._to_str(item.get('id')))
+        columns['title'].append(self._to_str(item.get('title')))
+        columns['score'].append(self._to_number(item.get('score'), float))
+        columns['url'].append(self._to_str(item.get('url')))
+        columns['vote_count'].append(self._to_number(item.get('vote_count'), int))
+        columns['actor_count'].append(self._to_number(item.get('actor_count'), int))
+        columns['genres'].append(self._to_list(item.get('genres')))
+        columns['regions'].append(self._to_list(item.get('regions')))
+        columns['release_date'].append(self._to_str(item.get('release_date')))
+        columns['has_cover'].append(bool(item.get('has_cover')))
+        columns['has_trailer'].append(bool(item.get('has_trailer')))
+        columns['hot_comments'].append(self._to_list(item.get('hot_comments')))
+        columns['summary'].append(self._to_str(item.get('summary')))
+        columns['cover_path'].append(self._to_str(item.get('cover_path')))
+        columns['trailer_path'].append(self._to_str(item.get('trailer_path')))
+        self.buffered += 1
+        self.count += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        """把缓冲的行写成一个 record batch，必要时轮转文件"""
+        if not self.buffered:
+            return
+        import pyarrow as pa
+        batch = pa.RecordBatch.from_pydict(self.columns, schema=self.schema)
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+
+        if self.writer is None:
+            self._open_file()
+        self.writer.write_batch(batch)
+        self.file_rows += batch.num_rows
+        if self.file_rows >= self.rows_per_file or os.path.getsize(self.path) >= self.max_file_bytes:
+            self._close_file()
+
+    def _open_file(self):
+        import pyarrow.parquet as pq
+        self.file_seq += 1
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        self.path = os.path.join(
+            self.directory, f"douban_movies_{self.node_id}_{timestamp}_{self.file_seq:04d}.parquet.inprogress"
+        )
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.file_rows = 0
+
+    def _close_file(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        final_path = self.path[:-len('.inprogress')]
+        os.replace(self.path, final_path)
+        self.files.append(final_path)
+        self.writer = None
+        self.path = None
+
+    @staticmethod
+    def _to_str(value):
+        return None if value is None or value == '' else str(value)
+
+    @staticmethod
+    def _to_number(value, number_type):
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _to_list(value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return [str(v) for v in value]
+
+
+class DoubanSqlitePipeline:
+    """写入 SQLite 电影库（WAL），按电影id upsert，支持按评分/人数/日期的索引查询和全文检索
+
+    - 每个节点一个库（SQLITE_PATH 中的 {node_id}），用 scrapy sqlite_merge 合并
+    - 满 SQLITE_BATCH_SIZE 行或每 SQLITE_FLUSH_INTERVAL 秒一个事务写入
+    """
+
+    def __init__(self, settings):
+        self.path_template = settings.get('SQLITE_PATH', 'data/douban_movies_{node_id}.sqlite3')
+        self.batch_size = settings.getint('SQLITE_BATCH_SIZE', 500)
+        self.flush_interval = settings.getfloat('SQLITE_FLUSH_INTERVAL', 30)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        self.node_id = get_node_id()
+        self.database = MovieDatabase(self.path_template.format(node_id=self.node_id))
+        self.rows = []
+        self.count = 0
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush()
+        spider.logger.info(f"保存了 {self.count} 部电影信息到 {self.database.path}（库中共 {self.database.count()} 部）")
+        self.database.close()
+
+    @timed_stage('sqlite')
+    def process_item(self, item, spider):
+        self.rows.append(to_row(item, self.node_id))
+        self.count += 1
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self.database.upsert_many(rows)
@@ -0,0 +1,197 @@
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+
+DETAIL_BASE_PRIORITY = int(1e9)  # 详情页/预告片页总是先于 top_list 页
+PAGE_YIELD_SCALE = 100000  # top_list 页: 预期产出（千分之一精度）* 该值 + 原有的区间/页码排序
+
+
+def interval_priority(interval_id, start):
+    """原有排序：区间优先级 100:90 > 90:80 > ... > 10:0，同区间按页码"""
+    interval_value = int(interval_id.split(':')[0])
+    page = start // 100
+    score = (100 - interval_value) * 1000 + page
+    return -score
+
+
+class IntervalPriorityEngine:
+    """默认优先级：只按分数区间和页码排序，详情页统一为 DETAIL_BASE_PRIORITY
+
+    PRIORITY_ENGINE 指定的类需提供相同的接口。
+    """
+
+    def __init__(self, server=None, target_counter=None):
+        self.server = server
+        self.target_counter = target_counter
+
+    @classmethod
+    def from_settings(cls, server, target_counter, settings):
+        return cls(server, target_counter)
+
+    def page_priority(self, movie_type, interval_id, start) -> int:
+        return interval_priority(interval_id, start)
+
+    def detail_priority(self, movie_type, interval_id, movie_data) -> int:
+        return DETAIL_BASE_PRIORITY
+
+    def observe(self, movie_type, interval_id, vote_count, has_cover, has_trailer):
+        """一部电影的详情页解析完成（是否有封面/预告片）"""
+
+    def sync(self):
+        """与Redis同步统计（在Redis线程池中调用）"""
+
+
+class YieldPriorityEngine(IntervalPriorityEngine):
+    """按预期产出排序：学习每个 (类型, 区间) 和评分人数档位的封面/预告片命中率
+
+    - douban:yield  hash，"{类型}:{区间}:{movies|covers|trailers}" 与 "vc{档位}:{...}" 计数，集群共享
+    - 本地累积计数，sync() 时一次管道 HINCRBY 批量提交，并定期 HGETALL 刷新集群统计
+    - 命中率带先验平滑（样本少时接近全局命中率），评分人数档位的命中率作为修正系数
+    - 封面/预告片的权重为各自距目标的剩余比例，目标已达到的类型不再贡献产出
+    - 详情页: DETAIL_BASE_PRIORITY + 预期产出；top_list 页: 该 (类型, 区间) 的预期产出，同产出时按原有顺序
+    """
+
+    PRIOR_RATES = {'covers': 0.9, 'trailers': 0.3}  # 还没有任何统计时的命中率
+
+    def __init__(self, server, target_counter, key='douban:yield', prior_weight=20,
+                 flush_size=50, refresh_interval=30.0):
+        super().__init__(server, target_counter)
+        self.key = key
+        self.prior_weight = prior_weight
+        self.flush_size = flush_size
+        self.refresh_interval = refresh_interval
+        self.counts: Dict[str, int] = {}  # 集群统计快照（含本地未提交的部分）
+        self.pending = Counter()  # 本地未提交的计数
+        self.pending_movies = 0
+        self.last_refresh = 0.0
+        self._totals = None  # 全局/档位汇总，counts 变化时失效
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, server, target_counter, settings):
+        return cls(
+            server,
+            target_counter,
+            key=settings.get('PRIORITY_YIELD_KEY', 'douban:yield'),
+            prior_weight=settings.getfloat('PRIORITY_PRIOR_WEIGHT', 20),
+            flush_size=settings.getint('PRIORITY_FLUSH_SIZE', 50),
+            refresh_interval=settings.getfloat('PRIORITY_REFRESH_INTERVAL', 30),
+        )
+
+    def page_priority(self, movie_type, interval_id, start) -> int:
+        expected = self._expected_yield(self._group(movie_type, interval_id), None)
+        return round(expected * 1000) * PAGE_YIELD_SCALE + interval_priority(interval_id, start)
+
+    def detail_priority(self, movie_type, interval_id, movie_data) -> int:
+        expected = self._expected_yield(self._group(movie_type, interval_id), movie_data.get('vote_count'))
+        return DETAIL_BASE_PRIORITY + round(expected * 1e6)
+
+    def observe(self, movie_type, interval_id, vote_count, has_cover, has_trailer):
+        with self._lock:
+            for group in (self._group(movie_type, interval_id), self._bucket(vote_count)):
+                for name, hit in (('movies', True), ('covers', has_cover), ('trailers', has_trailer)):
+                    if hit:
+                        field = f'{group}:{name}'
+                        self.pending[field] += 1
+                        self.counts[field] = self.counts.get(field, 0) + 1
+            self.pending_movies += 1
+            self._totals = None
+
+    def sync(self):
+        """本地计数攒够一批时提交；快照过期时刷新"""
+        with self._lock:
+            if self.pending_movies >= self.flush_size or (self.pending and self._refresh_due()):
+                pending, self.pending, self.pending_movies = self.pending, Counter(), 0
+            else:
+                pending = None
+        refresh = self._refresh_due()
+        if not pending and not refresh:
+            return
+        pipe = self.server.pipeline(transaction=False)
+        for field, amount in (pending or {}).items():
+            pipe.hincrby(self.key, field, amount)
+        if refresh:
+            pipe.hgetall(self.key)
+        results = pipe.execute()
+        if refresh:
+            with self._lock:
+                # 快照之后新增的本地计数仍未提交，叠加回去
+                counts = {field: int(value) for field, value in results[-1].items()}
+                for field, amount in self.pending.items():
+                    counts[field] = counts.get(field, 0) + amount
+                self.counts = counts
+                self._totals = None
+                self.last_refresh = time.time()
+
+    def _refresh_due(self):
+        return time.time() - self.last_refresh >= self.refresh_interval
+
+    def _expected_yield(self, group, vote_count):
+        """每个请求的预期产出 = Σ 类型权重 × 命中率"""
+        expected = 0.0
+        for name, weight in self._weights().items():
+            if not weight:
+                continue
+            rate = self._rate(group, name)
+            if vote_count is not None:
+                rate = min(rate * self._lift(self._bucket(vote_count), name), 1.0)
+            expected += weight * rate
+        return expected
+
+    def _weights(self):
+        """距目标的剩余比例（目标已达到的类型权重为0）"""
+        counter = self.target_counter
+        if counter is None or not counter.target_count:
+            return {'covers': 1.0, 'trailers': 1.0}
+        return {
+            'covers': max(1 - counter.cover_total / counter.target_count, 0.0),
+            'trailers': max(1 - counter.trailer_total / counter.target_count, 0.0),
+        }
+
+    def _rate(self, group, name):
+        counts = self.counts
+        totals = self._get_totals()
+        prior = self.PRIOR_RATES[name]
+        if totals['movies']:
+            prior = (totals[name] + self.prior_weight * prior) / (totals['movies'] + self.prior_weight)
+        movies = counts.get(f'{group}:movies', 0)
+        hits = counts.get(f'{group}:{name}', 0)
+        return (hits + self.prior_weight * prior) / (movies + self.prior_weight)
+
+    def _lift(self, bucket, name):
+        """评分人数档位的命中率相对全局命中率的倍数"""
+        counts = self.counts
+        movies = counts.get(f'{bucket}:movies', 0)
+        totals = self._get_totals()
+        if not movies or not totals[name]:
+            return 1.0
+        global_rate = totals[name] / totals['movies']
+        rate = (counts.get(f'{bucket}:{name}', 0) + self.prior_weight * global_rate) / (movies + self.prior_weight)
+        return rate / global_rate
+
+    def _get_totals(self):
+        """全部 (类型, 区间) 的计数之和（档位计数与之相同，不必另算）"""
+        totals = self._totals
+        if totals is None:
+            totals = Counter()
+            for field, value in self.counts.items():
+                if not field.startswith('vc'):
+                    totals[field.rsplit(':', 1)[1]] += value
+            self._totals = totals
+        return totals
+
+    @staticmethod
+    def _group(movie_type, interval_id):
+        return f'{movie_type}:{interval_id}'
+
+    @staticmethod
+    def _bucket(vote_count):
+        """评分人数按数量级分档: vc0 (<10) ... vc6 (>=1000000)"""
+        try:
+            vote_count = int(vote_count)
+        except (TypeError, ValueError):
+            vote_count = 0
+        return f'vc{min(int(math.log10(vote_count)) if vote_count > 0 else 0, 6)}'
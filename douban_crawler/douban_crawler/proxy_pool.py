@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+
+class ProxyStats:
+    """单个代理的健康统计"""
+
+    __slots__ = ('address', 'successes', 'failures', 'consecutive_failures',
+                 'total_latency', 'in_flight', 'added_at')
+
+    def __init__(self, address):
+        self.address = address
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.in_flight = 0
+        self.added_at = time.time()
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.successes if self.successes else 0.0
+
+    @property
+    def success_rate(self) -> float:
+        # 拉普拉斯平滑，新代理从 0.5 开始
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    @property
+    def score(self) -> float:
+        """成功率越高、延迟越低，得分越高"""
+        return self.success_rate / (1.0 + (self.avg_latency or 1.0))
+
+    def to_dict(self) -> Dict:
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'success_rate': round(self.success_rate, 3),
+            'avg_latency': round(self.avg_latency, 3),
+            'score': round(self.score, 4),
+        }
+
+
+class ProxyPool:
+    """进程内代理池
+
+    - 后台批量预取代理，保持有界缓冲
+    - 按成功率和延迟打分，加权复用健康代理
+    - 连续失败或被封禁时淘汰代理
+    - 只有本地池为空时请求才需要等待代理服务
+    """
+
+    def __init__(self, fetch_url, batch_url=None, max_size=50, min_size=10,
+                 prefetch=10, max_failures=3, max_in_flight=4, timeout=10):
+        self.logger = logging.getLogger(__name__)
+        self.fetch_url = fetch_url
+        self.batch_url = batch_url
+        self.max_size = max_size
+        self.min_size = min_size
+        self.prefetch = prefetch
+        self.max_failures = max_failures
+        self.max_in_flight = max_in_flight
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.proxies: Dict[str, ProxyStats] = {}
+        self.evicted = 0
+        self.session = None
+        self._refill_needed = None
+        self._available = None
+        self._task = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            fetch_url=settings.get('PROXYPOOL_URL'),
+            batch_url=settings.get('PROXYPOOL_BATCH_URL'),
+            max_size=settings.getint('PROXYPOOL_MAX_SIZE', 50),
+            min_size=settings.getint('PROXYPOOL_MIN_SIZE', 10),
+            prefetch=settings.getint('PROXYPOOL_PREFETCH', 10),
+            max_failures=settings.getint('PROXYPOOL_MAX_FAILURES', 3),
+            max_in_flight=settings.getint('PROXYPOOL_MAX_IN_FLIGHT', 4),
+        )
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(timeout=self.timeout)
+        self._refill_needed = asyncio.Event()
+        self._available = asyncio.Event()
+        self._refill_needed.set()
+        self._task = asyncio.ensure_future(self._refill_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self.session:
+            await self.session.close()
+
+    async def get(self, wait=10.0) -> Optional[str]:
+        """取一个代理；本地池为空时才等待后台预取（请求结束后需调用 release()）"""
+        if not self.proxies:
+            self._available.clear()
+            self._refill_needed.set()
+            try:
+                await asyncio.wait_for(self._available.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                return None
+            if not self.proxies:
+                return None
+
+        proxy = self._choose()
+        proxy.in_flight += 1
+        if len(self.proxies) < self.min_size:
+            self._refill_needed.set()
+        return proxy.address
+
+    def release(self, address):
+        """请求离开下载器（无论成功、失败还是被丢弃），归还 get() 占用的并发"""
+        proxy = self.proxies.get(address)
+        if proxy is not None:
+            proxy.in_flight = max(proxy.in_flight - 1, 0)
+
+    def report_success(self, address, latency):
+        proxy = self.proxies.get(address)
+        if proxy is None:
+            return
+        proxy.successes += 1
+        proxy.consecutive_failures = 0
+        proxy.total_latency += latency
+
+    def report_failure(self, address, ban=False):
+        """报告失败；被封禁或连续失败过多时淘汰"""
+        proxy = self.proxies.get(address)
+        if proxy is None:
+            return
+        proxy.failures += 1
+        proxy.consecutive_failures += 1
+        if ban or proxy.consecutive_failures >= self.max_failures:
+            self.evict(address)
+
+    def evict(self, address):
+        if self.proxies.pop(address, None) is not None:
+            self.evicted += 1
+            self.logger.debug(f"淘汰代理: {address}")
+            if len(self.proxies) < self.min_size:
+                self._refill_needed.set()
+
+    def _choose(self) -> ProxyStats:
+        candidates = [p for p in self.proxies.values() if p.in_flight < self.max_in_flight]
+        if not candidates:
+            # 全部代理都已满载，仍然复用得分最高的代理而不是等待代理服务
+            return max(self.proxies.values(), key=lambda p: p.score)
+        return random.choices(candidates, weights=[p.score for p in candidates])[0]
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            if len(self.proxies) >= self.max_size:
+                continue
+            try:
+                addresses = await self._fetch_batch()
+            except Exception as e:
+                self.logger.error(f"批量获取代理失败: {str(e)}")
+                addresses = []
+            for address in addresses:
+                if len(self.proxies) >= self.max_size:
+                    break
+                self.proxies.setdefault(address, ProxyStats(address))
+            if self.proxies:
+                self._available.set()
+            if len(self.proxies) < self.min_size:
+                # 代理服务暂时不足，稍后重试
+                await asyncio.sleep(1 if addresses else 5)
+                self._refill_needed.set()
+
+    async def _fetch_batch(self) -> List[str]:
+        if self.batch_url:
+            async with self.session.get(self.batch_url) as response:
+                if response.status != 200:
+                    self.logger.warning(f"Proxy pool returned {response.status}")
+                    return []
+                data = await response.json()
+            return [info['proxy'] for info in data if info and 'proxy' in info]
+
+        results = await asyncio.gather(
+            *[self._fetch_one() for _ in range(self.prefetch)],
+            return_exceptions=True
+        )
+        return [address for address in results if isinstance(address, str)]
+
+    async def _fetch_one(self) -> Optional[str]:
+        async with self.session.get(self.fetch_url) as response:
+            if response.status != 200:
+                return None
+            proxy_info = await response.json()
+            if not proxy_info or 'proxy' not in proxy_info:
+                return None
+            return proxy_info['proxy']
@@ -0,0 +1,105 @@
+import time
+from typing import Dict, Iterable
+
+
+# 为一部电影申请封面/预告片名额：已完成数 + 未到期租约数 达到目标后不再发放
+# KEYS: [已完成set, 租约zset] * N   ARGV: 电影id, 目标数, 当前时间, 租约秒数, 是否申请 * N
+# 返回: [是否获得, 该类型名额是否已全部承诺] * N
+ACQUIRE_SCRIPT = """
+local result = {}
+for i = 1, #KEYS, 2 do
+    local want = ARGV[4 + (i + 1) / 2]
+    redis.call('ZREMRANGEBYSCORE', KEYS[i + 1], '-inf', ARGV[3])
+    local granted = 0
+    if want == '1' then
+        if redis.call('SISMEMBER', KEYS[i], ARGV[1]) == 1 then
+            granted = 1
+        elseif redis.call('ZSCORE', KEYS[i + 1], ARGV[1]) then
+            redis.call('ZADD', KEYS[i + 1], ARGV[3] + ARGV[4], ARGV[1])
+            granted = 1
+        elseif redis.call('SCARD', KEYS[i]) + redis.call('ZCARD', KEYS[i + 1]) < tonumber(ARGV[2]) then
+            redis.call('ZADD', KEYS[i + 1], ARGV[3] + ARGV[4], ARGV[1])
+            granted = 1
+        end
+    end
+    local committed = redis.call('SCARD', KEYS[i]) + redis.call('ZCARD', KEYS[i + 1])
+    result[#result + 1] = granted
+    result[#result + 1] = committed >= tonumber(ARGV[2]) and 1 or 0
+end
+return result
+"""
+
+
+class QuotaAllocator:
+    """集群封面/预告片名额分配（QUOTA_ENABLED）
+
+    - douban:quota:{type}  zset，电影id -> 租约到期时间
+    - 已承诺 = 已完成（TargetCounter 的 douban:cover_ids / douban:trailer_ids）+ 未到期租约
+    - 调度详情页/预告片页和媒体下载前先申请名额，未获得名额的媒体不再下载
+    - 下载失败（或被其他节点下载）时归还租约；节点崩溃时租约到期自动回收
+    - 两种名额都已全部承诺时 exhausted() 为真，爬虫不再生成新的媒体相关请求
+    """
+
+    MEDIA_TYPES = ('cover', 'trailer')
+
+    def __init__(self, server, target_count, lease_ttl=1800, key_prefix='douban:quota',
+                 done_keys=None, refresh_interval=5.0):
+        self.server = server
+        self.target_count = target_count
+        self.lease_ttl = lease_ttl
+        self.key_prefix = key_prefix
+        self.done_keys = done_keys or {'cover': 'douban:cover_ids', 'trailer': 'douban:trailer_ids'}
+        self.refresh_interval = refresh_interval
+        self.committed = {media_type: False for media_type in self.MEDIA_TYPES}  # 各类型名额是否已全部承诺
+        self.last_refresh = 0.0
+        self._acquire_script = server.register_script(ACQUIRE_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, target_counter, settings):
+        return cls(
+            server,
+            target_count=settings.getint('TARGET_MOVIE_COUNT', 10000),
+            lease_ttl=settings.getint('QUOTA_LEASE_TTL', 1800),
+            key_prefix=settings.get('QUOTA_KEY', 'douban:quota'),
+            done_keys={'cover': target_counter.cover_key, 'trailer': target_counter.trailer_key},
+            refresh_interval=settings.getfloat('TARGET_REFRESH_INTERVAL', 5.0),
+        )
+
+    def acquire(self, movie_id, media_types: Iterable[str]) -> Dict[str, bool]:
+        """一次往返申请多种媒体的名额，返回 {类型: 是否获得}"""
+        wanted = set(media_types)
+        result = self._call(movie_id, [media_type in wanted for media_type in self.MEDIA_TYPES])
+        return {media_type: granted for media_type, granted in result.items() if media_type in wanted}
+
+    def release(self, movie_id, media_types: Iterable[str]):
+        """归还名额（下载失败、文件由其他节点下载或已计入已完成集合）"""
+        pipe = self.server.pipeline(transaction=False)
+        count = 0
+        for media_type in media_types:
+            pipe.zrem(self._key(media_type), str(movie_id))
+            count += 1
+        if count:
+            pipe.execute()
+
+    def exhausted(self) -> bool:
+        """两种名额是否都已全部承诺（本地缓存，超过 refresh_interval 秒才重新查询）"""
+        if time.time() - self.last_refresh >= self.refresh_interval:
+            self._call('', [False] * len(self.MEDIA_TYPES))
+        return all(self.committed.values())
+
+    def _call(self, movie_id, wants):
+        keys = []
+        for media_type in self.MEDIA_TYPES:
+            keys.append(self.done_keys[media_type])
+            keys.append(self._key(media_type))
+        args = [movie_id, self.target_count, time.time(), self.lease_ttl] + [int(want) for want in wants]
+        values = self._acquire_script(keys=keys, args=args)
+        result = {}
+        for index, media_type in enumerate(self.MEDIA_TYPES):
+            result[media_type] = bool(int(values[2 * index]))
+            self.committed[media_type] = bool(int(values[2 * index + 1]))
+        self.last_refresh = time.time()
+        return result
+
+    def _key(self, media_type):
+        return f'{self.key_prefix}:{media_type}'
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Dict
+
+import redis
+from scrapy import signals
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy_redis import defaults
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+
+logger = logging.getLogger(__name__)
+
+# 进程内的连接池登记表：参数相同的客户端共用同一个连接池
+_pools: Dict[tuple, redis.ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+# crawler -> RedisClient
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_pool(**params) -> redis.ConnectionPool:
+    """按连接参数取共享连接池（不存在时创建）"""
+    key = tuple(sorted((name, repr(value)) for name, value in params.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = redis.ConnectionPool(**params)
+        return pool
+
+
+class PooledRedis(redis.Redis):
+    """使用共享连接池的 redis.Redis
+
+    供 scrapy_redis 使用: REDIS_PARAMS = {'redis_cls': 'douban_crawler.redis_client.PooledRedis'}，
+    连接参数相同的客户端共用一个连接池。进程内实际有两个池：scrapy_redis 的调度器、队列和去重过滤器
+    （队列中是序列化后的二进制请求，不能解码）共用一个；RedisClient（decode_responses=True）
+    供爬虫、管道和扩展共用另一个。
+    observer（提供 sampled() 和 observe_redis(命令, 秒数)）是类属性：scrapy_redis 自行创建的实例
+    也要计时，用 set_observer() 对进程内所有实例一起设置，设置后抽样记录每条命令的耗时。
+    """
+
+    observer = None
+
+    def __init__(self, **params):
+        super().__init__(connection_pool=get_pool(**params))
+
+    def execute_command(self, *args, **options):
+        observer = self.observer
+        if observer is None or not observer.sampled():
+            return super().execute_command(*args, **options)
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            observer.observe_redis(str(args[0]).upper(), time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        observer = self.observer
+        if observer is not None:
+            execute = pipe.execute
+
+            def timed_execute(*args, **kwargs):
+                if not observer.sampled():
+                    return execute(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return execute(*args, **kwargs)
+                finally:
+                    observer.observe_redis('PIPELINE', time.perf_counter() - start)
+            pipe.execute = timed_execute
+        return pipe
+
+    @classmethod
+    def from_url(cls, url, **params):
+        pool = redis.ConnectionPool.from_url(url, **params)
+        return cls(connection_class=pool.connection_class, **pool.connection_kwargs)
+
+
+def set_observer(observer):
+    """为进程内所有 PooledRedis（包括调度器和去重过滤器的实例）设置命令耗时的观察者，None 为取消"""
+    PooledRedis.observer = observer
+
+
+class RedisClient:
+    """crawler 级的共享 Redis 访问层
+
+    - server: 同步客户端（decode_responses=True），供各组件构造时使用；
+      与 scrapy_redis 的客户端解码方式不同，使用单独的连接池（见 PooledRedis）
+    - call() / run(): 把同步的 Redis 操作放到专用线程池执行，分别返回 Deferred / 可 await 的结果，
+      Redis 延迟抖动不再阻塞 reactor 线程上的下载
+    - fire_and_forget(): 不关心结果的写操作（状态上报等），失败只记日志
+    - REDIS_THREADPOOL_SIZE = 0 时在调用线程上同步执行（离线基准使用）
+    """
+
+    def __init__(self, server, pool_size=4):
+        self.server = server
+        self.pool_size = pool_size
+        self.threadpool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """同一个 crawler 的爬虫、管道、扩展共用一个实例"""
+        client = _clients.get(crawler)
+        if client is None:
+            settings = crawler.settings
+            params = dict(defaults.REDIS_PARAMS, **settings.getdict('REDIS_PARAMS'))
+            params.pop('redis_cls', None)
+            params.update(
+                host=settings.get('REDIS_HOST'),
+                port=settings.getint('REDIS_PORT', 6379),
+                decode_responses=True,  # 自动解码为字符串
+            )
+            client = cls(PooledRedis(**params), pool_size=settings.getint('REDIS_THREADPOOL_SIZE', 4))
+            crawler.signals.connect(client.close, signal=signals.engine_stopped)
+            _clients[crawler] = client
+        return client
+
+    def call(self, func, *args, **kwargs) -> defer.Deferred:
+        """在Redis线程池中执行 func(*args, **kwargs)"""
+        if not self.pool_size:
+            return defer.maybeDeferred(func, *args, **kwargs)
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(minthreads=1, maxthreads=self.pool_size, name='redis')
+            self.threadpool.start()
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.threadpool, func, *args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """call() 的协程版本，供 async def 回调和管道使用"""
+        if not self.pool_size:
+            return func(*args, **kwargs)
+        return await maybe_deferred_to_future(self.call(func, *args, **kwargs))
+
+    def fire_and_forget(self, func, *args, **kwargs) -> defer.Deferred:
+        d = self.call(func, *args, **kwargs)
+        d.addErrback(lambda failure: logger.warning(f"Redis操作失败: {failure.getErrorMessage()}"))
+        return d
+
+    def close(self):
+        if self.threadpool is not None:
+            self.threadpool.stop()
+            self.threadpool = None
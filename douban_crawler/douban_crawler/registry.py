@@ -0,0 +1,98 @@
+import json
+import time
+from typing import Dict, Iterable
+
+
+# 对每种媒体: 已有完成记录则返回记录；否则尝试加下载租约
+# KEYS: [记录hash, 租约key] * N   ARGV: 电影id, 节点id, 租约秒数
+CLAIM_SCRIPT = """
+local result = {}
+for i = 1, #KEYS, 2 do
+    local record = redis.call('HGET', KEYS[i], ARGV[1])
+    if record then
+        result[#result + 1] = record
+    elseif redis.call('SET', KEYS[i + 1], ARGV[2], 'NX', 'EX', ARGV[3]) then
+        result[#result + 1] = 'leased'
+    elseif redis.call('GET', KEYS[i + 1]) == ARGV[2] then
+        -- 本节点重启前留下的租约，直接续期
+        redis.call('EXPIRE', KEYS[i + 1], ARGV[3])
+        result[#result + 1] = 'leased'
+    else
+        result[#result + 1] = 'busy'
+    end
+end
+return result
+"""
+
+# 写入完成记录 / 释放租约（只释放本节点持有的租约）
+# KEYS: [记录hash, 租约key] * N   ARGV: 电影id, 节点id, 记录json或空串 * N
+FINISH_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    local record = ARGV[2 + (i + 1) / 2]
+    if record ~= '' then
+        redis.call('HSET', KEYS[i], ARGV[1], record)
+    end
+    if redis.call('GET', KEYS[i + 1]) == ARGV[2] then
+        redis.call('DEL', KEYS[i + 1])
+    end
+end
+return 1
+"""
+
+LEASED = 'leased'
+BUSY = 'busy'
+
+
+class MediaRegistry:
+    """集群媒体文件登记表（按电影id + 媒体类型）
+
+    - douban:media:{type}            hash，电影id -> 完成记录（路径、节点、md5、大小）
+    - douban:media:lease:{type}:{id} 下载中的租约，持有者为节点id
+    """
+
+    def __init__(self, server, node_id, lease_ttl=1800, key_prefix='douban:media'):
+        self.server = server
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.key_prefix = key_prefix
+        self._claim_script = server.register_script(CLAIM_SCRIPT)
+        self._finish_script = server.register_script(FINISH_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, node_id, settings):
+        return cls(server, node_id, lease_ttl=settings.getint('MEDIA_LEASE_TTL', 1800))
+
+    def claim(self, movie_id, media_types: Iterable[str]) -> Dict:
+        """一次往返查询多种媒体: 返回 {类型: 完成记录dict / 'leased' / 'busy'}"""
+        media_types = list(media_types)
+        if not media_types:
+            return {}
+        states = self._claim_script(
+            keys=self._keys(movie_id, media_types),
+            args=[movie_id, self.node_id, self.lease_ttl],
+        )
+        return {
+            media_type: state if state in (LEASED, BUSY) else json.loads(state)
+            for media_type, state in zip(media_types, states)
+        }
+
+    def finish(self, movie_id, records: Dict[str, Dict], failed: Iterable[str] = ()):
+        """登记下载完成的文件并释放租约；failed 中的类型只释放租约"""
+        media_types = list(records) + [t for t in failed if t not in records]
+        if not media_types:
+            return
+        args = [movie_id, self.node_id]
+        for media_type in media_types:
+            record = records.get(media_type)
+            if record is None:
+                args.append('')
+            else:
+                args.append(json.dumps(dict(record, node=self.node_id, time=int(time.time()))))
+        self._finish_script(keys=self._keys(movie_id, media_types), args=args)
+
+    def _keys(self, movie_id, media_types):
+        keys = []
+        for media_type in media_types:
+            keys.append(f'{self.key_prefix}:{media_type}')
+            keys.append(f'{self.key_prefix}:lease:{media_type}:{movie_id}')
+        return keys
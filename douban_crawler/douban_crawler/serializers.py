@@ -0,0 +1,72 @@
+"""scrapy_redis 请求队列的紧凑序列化（SCHEDULER_SERIALIZER = 'douban_crawler.serializers'）
+
+- 默认用 msgpack，按字段序号编码，省略与默认值相同的字段
+- 含 msgpack 无法表示的值（自定义对象、Request 子类等）时回退到 pickle
+- 首字节标记格式；升级前队列中遗留的 pickle 数据仍可读取
+"""
+import pickle
+
+import msgpack
+
+
+MSGPACK = b'\x01'
+PICKLE = b'\x00'
+_TUPLE = 1  # msgpack 扩展类型：元组（保持 meta 中元组的类型）
+
+# request.to_dict() 的字段（顺序即编码序号，只能在末尾追加）
+FIELDS = (
+    'url', 'callback', 'errback', 'method', 'headers', 'body', 'cookies',
+    'meta', 'encoding', 'priority', 'dont_filter', 'flags', 'cb_kwargs',
+)
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+DEFAULTS = {
+    'callback': None, 'errback': None, 'method': 'GET', 'headers': {}, 'body': b'',
+    'cookies': {}, 'meta': {}, 'encoding': 'utf-8', 'priority': 0, 'dont_filter': False,
+    'flags': [], 'cb_kwargs': {},
+}
+_MISSING = object()
+
+
+def _default(obj):
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(_TUPLE, _packb(list(obj)))
+    raise TypeError(f"msgpack 无法序列化 {type(obj).__name__}")
+
+
+def _ext_hook(code, data):
+    if code == _TUPLE:
+        return tuple(_unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+def _packb(obj):
+    # strict_types: 元组、子类不做隐式转换，交给 _default 处理或回退 pickle
+    return msgpack.packb(obj, use_bin_type=True, strict_types=True, default=_default)
+
+
+def _unpackb(data):
+    return msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=_ext_hook)
+
+
+def dumps(obj):
+    if all(key in FIELD_INDEX for key in obj):
+        compact = {
+            FIELD_INDEX[key]: value
+            for key, value in obj.items()
+            if DEFAULTS.get(key, _MISSING) != value
+        }
+        try:
+            return MSGPACK + _packb(compact)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return PICKLE + pickle.dumps(obj, protocol=-1)
+
+
+def loads(data):
+    marker = data[:1]
+    if marker == MSGPACK:
+        return {FIELDS[index]: value for index, value in _unpackb(data[1:]).items()}
+    if marker == PICKLE:
+        return pickle.loads(data[1:])
+    # 旧版本（scrapy_redis.picklecompat）写入的数据
+    return pickle.loads(data)
@@ -3,34 +3,95 @@ BOT_NAME = 'douban_crawler'
 # 分布式核心配置
 SCHEDULER = "scrapy_redis.scheduler.Scheduler"
 DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
-# SCHEDULER_QUEUE_CLASS = 'scrapy_redis.queue.PriorityQueue'
+# DUPEFILTER_CLASS = "douban_crawler.bloom.BloomDupeFilter"  # 布隆过滤器去重，内存有界
+SCHEDULER_QUEUE_CLASS = 'douban_crawler.leased_queue.LeasedPriorityQueue'  # 批量预取 + 租约，节点崩溃不丢请求
 
 SCHEDULER_PERSIST = True  # 暂停后保持队列
+SCHEDULER_SERIALIZER = 'douban_crawler.serializers'  # msgpack 紧凑编码（兼容队列中已有的 pickle 数据）
+
+# 详情页/预告片页请求的电影数据存放在 douban:movie_meta:{id}，请求只携带电影id
+MOVIE_META_KEY = 'douban:movie_meta'
+MOVIE_META_TTL = 7 * 24 * 3600  # 未被消费的数据过期时间（秒）
 
 # Redis连接配置
 REDIS_HOST = '10.109.253.xxx'  # Redis服务器IP (四卡)
 REDIS_PORT = 6379
+# scrapy_redis（调度器、去重过滤器）的客户端共用一个连接池；项目组件的 RedisClient 解码响应，使用另一个连接池
+REDIS_PARAMS = {'redis_cls': 'douban_crawler.redis_client.PooledRedis'}
+REDIS_THREADPOOL_SIZE = 4  # 回调/管道/扩展中Redis操作的线程数（0 表示在reactor线程上同步执行）
+
+# 详情页解析进程池（高并发时解析不再占用reactor线程）
+PARSE_POOL_ENABLED = False
+PARSE_POOL_WORKERS = 0  # 0 表示 CPU核数 - 1
+# PARSE_POOL_MAX_PENDING = 64  # 未完成任务上限，达到后暂停调度（默认 工作进程数 * 8）
 
 # 代理配置
 PROXYPOOL_URL = 'http://10.109.253.xxx:5010/get/'
+# PROXYPOOL_BATCH_URL = 'http://10.109.253.xxx:5010/all/'  # 批量接口（可选），未设置时并发调用 PROXYPOOL_URL
+PROXYPOOL_MAX_SIZE = 50  # 本地代理池容量
+PROXYPOOL_MIN_SIZE = 10  # 低于此数量时后台预取
+PROXYPOOL_PREFETCH = 10  # 每次预取的代理数
+PROXYPOOL_MAX_FAILURES = 3  # 连续失败多少次后淘汰代理
+PROXYPOOL_MAX_IN_FLIGHT = 4  # 单个代理同时承载的请求数
+PROXYPOOL_BAN_RETRY_TIMES = 2  # 代理被封禁后换代理重试的次数
 
 # 启用组件 数字表示组件优先级，越小优先级越高
 ITEM_PIPELINES = {
     "douban_crawler.pipelines.CustomFilesPipeline": 300,
     "douban_crawler.pipelines.FileCountPipeline": 301,
     'douban_crawler.pipelines.DoubanCsvPipeline': 302,
+    # 'douban_crawler.pipelines.DoubanParquetPipeline': 303,  # 带类型的 Parquet 输出（可与CSV并用或替换CSV）
+    # 'douban_crawler.pipelines.DoubanSqlitePipeline': 304,  # SQLite 电影库（按id更新、索引查询、全文检索）
 }
+# Parquet 输出
+PARQUET_DIR = 'data/parquet'
+PARQUET_BATCH_SIZE = 500  # 每个 record batch 的行数
+PARQUET_ROWS_PER_FILE = 100000  # 按行数轮转
+PARQUET_MAX_FILE_BYTES = 256 * 1024 * 1024  # 按文件大小轮转
+PARQUET_FLUSH_INTERVAL = 60  # 定时写出缓冲（秒）
+PARQUET_COMPRESSION = 'zstd'
+# SQLite 输出（合并各节点的库: scrapy sqlite_merge -o data/douban_movies.sqlite3 data/douban_movies_*.sqlite3）
+SQLITE_PATH = 'data/douban_movies_{node_id}.sqlite3'
+SQLITE_BATCH_SIZE = 500  # 每个事务的行数
+SQLITE_FLUSH_INTERVAL = 30  # 定时提交缓冲（秒）
 FILES_STORE = './data'
 IMAGES_STORE = './images'
 LOG_LEVEL = 'DEBUG'
 # 启用监控扩展
 EXTENSIONS = {
     'douban_crawler.extensions.StatusExtension': 500,
+    'douban_crawler.instrumentation.InstrumentationExtension': 510,
+}
+# 节点状态上报：crawler:nodes 保存最新状态，crawler:events stream 供 monitor.py 以 XREAD 订阅
+STATUS_REPORT_INTERVAL = 10  # 上报/心跳间隔（秒）
+STATUS_STREAM_KEY = 'crawler:events'
+STATUS_STREAM_MAXLEN = 10000  # stream 近似保留的事件数
+# 热路径耗时统计：回调、管道、各类下载、Redis命令的抽样直方图，定期写入 crawler:metrics
+# 运行中开启性能分析: redis-cli SET crawler:profile:{节点id} 60   （或 "60:pyinstrument"）
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_SAMPLE_RATE = 0.1  # 抽样比例
+INSTRUMENTATION_EXPORT_INTERVAL = 30  # 导出间隔（秒）
+INSTRUMENTATION_PROFILE_DIR = 'profiles'
+SPIDER_MIDDLEWARES = {
+    'douban_crawler.leased_queue.LeaseAckSpiderMiddleware': 10,  # 最外层：回调输出全部入队后才确认调度租约
+    'douban_crawler.instrumentation.CallbackTimingMiddleware': 950,  # 最靠近爬虫，只计回调本身
 }
 # 爬虫设置
 ROBOTSTXT_OBEY = False  # 忽略robots.txt
-CONCURRENT_REQUESTS = 2
-DOWNLOAD_DELAY = 2.5  # 避免被封
+CONCURRENT_REQUESTS = 32  # 全局上限，各类请求的实际并发由 AdaptiveConcurrencyMiddleware 控制
+DOWNLOAD_DELAY = 2.5  # 未分类主机的默认延迟，避免被封
+# 各下载槽位的初始并发/延迟（之后由自适应并发控制调整）
+DOWNLOAD_SLOTS = {
+    'douban-api': {'concurrency': 1, 'delay': 2.5},
+    'douban-page': {'concurrency': 1, 'delay': 2.5},
+    'douban-image': {'concurrency': 4, 'delay': 0},  # 封面走媒体通道时不使用
+    'douban-media': {'concurrency': 2, 'delay': 0},  # 预告片走媒体通道时不使用
+}
+# 自适应并发（AIMD）：健康时逐步加并发，403/429/验证码时减半并加倍延迟
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_BACKOFF_FACTOR = 0.5
+ADAPTIVE_BAN_COOLDOWN = 60  # 被限流后多少秒内不再增加并发
+# ADAPTIVE_CONCURRENCY_LIMITS = {'douban-api': {'max': 2}}  # 覆盖某个槽位的上下限
 # RANDOMIZE_DOWNLOAD_DELAY = True  # 在延迟范围内随机化
 # AUTOTHROTTLE_ENABLED = True
 # AUTOTHROTTLE_START_DELAY = 5.0
@@ -39,10 +100,100 @@ USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTM
 
 # 目标电影数量
 TARGET_MOVIE_COUNT = 2000
+TARGET_REFRESH_INTERVAL = 5  # 集群封面/预告片总数的本地缓存刷新间隔（秒）
+# 封面/预告片名额租约：已完成 + 下载中 达到目标后不再调度新的媒体工作
+QUOTA_ENABLED = True
+QUOTA_KEY = 'douban:quota'
+QUOTA_LEASE_TTL = 1800  # 租约过期时间（秒），节点崩溃后名额自动回收
+QUOTA_RECHECK_DELAY = 300  # 名额用完时 top_list 页延迟多少秒重新调度
+
+# 请求优先级：按各 (类型, 区间) 学到的封面/预告片命中率和评分人数排序
+PRIORITY_ENGINE = 'douban_crawler.priority.YieldPriorityEngine'  # 'douban_crawler.priority.IntervalPriorityEngine' 为原有排序
+PRIORITY_YIELD_KEY = 'douban:yield'
+PRIORITY_PRIOR_WEIGHT = 20  # 先验平滑的样本数
+PRIORITY_FLUSH_SIZE = 50  # 本地累积多少部电影的统计后提交
+PRIORITY_REFRESH_INTERVAL = 30  # 集群统计刷新间隔（秒）
+
+# 电影id去重
+MOVIE_ID_KEY = 'douban:movie_ids'
+MOVIE_ID_CACHE_SIZE = 200000  # 本地已见id缓存上限
+MOVIE_ID_DEDUP_BACKEND = 'set'  # 'set' 或 'bloom'
+
+# 布隆过滤器（请求指纹 / 电影id），迁移已有集合: scrapy bloom_migrate
+BLOOM_INITIAL_CAPACITY = 1000000  # 第一层容量，写满后按 BLOOM_GROWTH 倍扩容
+BLOOM_ERROR_RATE = 0.001  # 整体误判率上界
+BLOOM_GROWTH = 2
+BLOOM_TIGHTENING_RATIO = 0.5  # 每层误判率按该比例收紧，各层之和不超过 BLOOM_ERROR_RATE
+# 增量模式：记录未变化且未过期的电影不再抓取详情页/预告片页，直接输出保存的数据
+# 开启后电影id只在本次运行内去重（douban:movie_ids:run:{INCREMENTAL_RUN_ID}），不再使用跨运行保留的
+# MOVIE_ID_KEY 集合/布隆过滤器，否则上次运行见过的电影会全部被当作重复丢弃，既不输出也不重新抓取。
+# 同一次刷新的各节点须使用相同的运行id；请求指纹（douban:dupefilter）同样跨运行保留，刷新前需清空
+INCREMENTAL_MODE = False
+INCREMENTAL_RUN_ID = None  # 默认取当天日期（UTC），跨零点或同一天多次刷新时请显式指定
+INCREMENTAL_RUN_TTL = 2 * 24 * 3600  # 本次运行的去重集合过期时间（秒）
+INCREMENTAL_STATE_KEY = 'douban:movie_state'  # 电影状态hash（跨运行保留）
+INCREMENTAL_MAX_AGE = 30 * 24 * 3600  # 超过该时间（秒）的详情数据强制重新抓取
+INCREMENTAL_FINGERPRINT_FIELDS = ['title', 'score', 'vote_count', 'release_date', 'url']  # 去掉 vote_count 可进一步减少重新抓取
+
+# top_list 分页：每个 (类型, 区间) 同时在途的页数，1 为逐页串行
+PAGINATION_LOOKAHEAD = 3
+PAGINATION_COUNTS_KEY = 'douban:page_counts'  # 各区间页数的历史记录（跨运行保留）
+PAGINATION_ENDS_KEY = 'douban:page_ends'  # 本次运行已确定的区间页数
+
 SPIDER_MODULES = ['douban_crawler.spiders']
+COMMANDS_MODULE = 'douban_crawler.commands'
 
-SCHEDULER_BATCH_SIZE = 1  # 每次只取1个请求
+SCHEDULER_BATCH_SIZE = 16  # 每次从Redis批量取出的请求数
+SCHEDULER_LEASE_TIMEOUT = 600  # 租约时长（秒），超时未确认的请求放回队列
+SCHEDULER_REAP_INTERVAL = 5  # 检查到期租约的间隔（秒）
 
 DOWNLOADER_MIDDLEWARES = {
-   # "douban_crawler.middlewares.ProxyMiddleware": 543,
+   "douban_crawler.pagination.PaginationMiddleware": 530,  # 丢弃超出区间页数的预调度请求
+   # 限流/验证码识别与主机熔断：被拦截的请求由本中间件延迟重新入队；429 不在 RETRY_HTTP_CODES 中，
+   # RetryMiddleware(550) 不会原地重试。启用下面的 ProxyMiddleware(543) 后，响应按编号从大到小经过中间件，
+   # 先由它换代理重试、仍被拦截时才到这里，代理级熔断（proxy:{地址}）也只在启用代理时生效
+   "douban_crawler.bans.BanMiddleware": 535,
+   "douban_crawler.httpcache.ResponseCacheMiddleware": 540,  # 放在代理之前，命中缓存时不占用代理
+   # "douban_crawler.middlewares.ProxyMiddleware": 543,  # 代理池（默认关闭，需要 PROXYPOOL_URL 可用）
+   "douban_crawler.throttle.AdaptiveConcurrencyMiddleware": 560,
+   "douban_crawler.media.MediaStreamMiddleware": 590,
+   "douban_crawler.leased_queue.LeaseAckMiddleware": 950,  # 请求被丢弃或下载出错时确认调度队列租约
 }
+
+# 封禁识别与熔断：403/429/验证码/异常提示页/API返回HTML 时按主机（启用 ProxyMiddleware 时还按代理）熔断，请求延迟放回Redis队列
+BAN_DETECTION_ENABLED = True
+BAN_BREAKER_THRESHOLD = 3  # 连续被拦截多少次后熔断
+BAN_BREAKER_COOLDOWN = 30  # 首次熔断的冷却时间（秒），之后每次加倍
+BAN_BREAKER_MAX_COOLDOWN = 1800  # 冷却/退避时间上限（秒）
+BAN_RETRY_BACKOFF = 30  # 被拦截请求的首次重新入队延迟（秒），之后每次加倍
+BAN_MAX_RETRIES = 5  # 超过后交给爬虫处理
+# 默认重试码去掉 429：限流只走熔断 + 退避重新入队，不用同一出口立即重试
+RETRY_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408]
+
+# 本地响应缓存（重跑时 API 页和详情页大多直接从本地读取）
+RESPONSE_CACHE_ENABLED = True
+# 多进程（run.py --workers）默认共用一个库（写锁冲突等待 RESPONSE_CACHE_BUSY_TIMEOUT 秒，大小上限整体生效）；
+# 路径中可用 {node_id} 为每个进程单独建库
+RESPONSE_CACHE_PATH = 'data/httpcache.sqlite3'
+RESPONSE_CACHE_BUSY_TIMEOUT = 2  # 秒；在 reactor 线程中等待，不宜过长
+RESPONSE_CACHE_TTLS = {'api': 24 * 3600, 'detail': 7 * 24 * 3600, 'video': 3600}  # 各类页面的有效期（秒）
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 压缩后总大小上限，超出时淘汰最久未访问的条目
+RESPONSE_CACHE_COMPRESS_LEVEL = 6
+
+# 预告片流式下载（分块写盘 + Range 续传）
+MEDIA_STREAM_TYPES = ['cover', 'trailer']  # 走流式下载的文件类型（启用媒体通道时即走通道的类型）
+# 独立媒体通道：封面/预告片不经过 Scrapy 下载器，不占用 API/详情页的并发
+# 启用后这些类型的并发只由 MEDIA_LANE_CONCURRENCY 控制，自适应并发不再为其保留窗口（douban-image/douban-media）
+MEDIA_LANE_ENABLED = True
+MEDIA_LANE_CONCURRENCY = 4  # 同时下载的文件数
+MEDIA_LANE_QUEUE_SIZE = 32  # 排队 + 下载中的文件数上限，满时管道暂停提交新的媒体下载
+MEDIA_LANE_BYTES_PER_SEC = 20 * 1024 * 1024  # 节点媒体下载总带宽上限（0 不限速）
+MEDIA_LANE_SAMPLE_INTERVAL = 5  # 利用率采样间隔（秒）
+MEDIA_STREAM_CHUNK_SIZE = 256 * 1024
+MEDIA_MAX_FILE_BYTES = 1024 * 1024 * 1024  # 单文件上限 1GB
+MEDIA_MAX_INFLIGHT_BYTES = 2 * 1024 * 1024 * 1024  # 同时下载中的文件总字节上限
+MEDIA_STREAM_RETRIES = 3  # 中断后续传次数
+
+# 集群媒体登记表：本地已有或其他节点已下载的文件不再重复下载
+MEDIA_REGISTRY_ENABLED = True
+MEDIA_LEASE_TTL = 1800  # 下载租约有效期（秒），节点崩溃后到期自动释放
@@ -1,10 +1,21 @@
 import scrapy
 import scrapy_redis.queue
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.misc import load_object
 from scrapy_redis.spiders import RedisSpider
 from urllib.parse import urlparse, parse_qs
+from douban_crawler.dedup import MovieIdDeduper
+from douban_crawler.extractors import DetailPage, extract_detail
+from douban_crawler.movie_state import MovieStateStore
 from douban_crawler.items import DoubanMovieItem
+from douban_crawler.metastore import MovieMetaStore
+from douban_crawler.pagination import PaginationPlanner
+from douban_crawler.parsepool import ParsePool
+from douban_crawler.leased_queue import get_queue
+from douban_crawler.quota import QuotaAllocator
+from douban_crawler.redis_client import RedisClient
+from douban_crawler.target import TargetCounter
 import json
-import redis
 
 
 class DoubanSpider(RedisSpider):
@@ -37,12 +48,31 @@ class DoubanSpider(RedisSpider):
         spider.redis_port = crawler.settings.get('REDIS_PORT')
         spider.target_count = crawler.settings.getint('TARGET_MOVIE_COUNT', 10000)
 
-        # 初始化Redis连接
-        spider.redis_conn = redis.Redis(
-            host=spider.redis_host,
-            port=spider.redis_port,
-            decode_responses=True  # 自动解码为字符串
-        )
+        # 共享的Redis访问层（连接池 + 线程池），回调中的Redis操作不阻塞reactor
+        spider.redis = RedisClient.from_crawler(crawler)
+        spider.redis_conn = spider.redis.server
+        # 电影id批量去重（每页一次Redis往返 + 本地缓存）
+        spider.movie_deduper = MovieIdDeduper.from_settings(spider.redis_conn, crawler.settings)
+        # 封面/预告片目标计数（爬虫与管道共用）
+        spider.target_counter = TargetCounter.from_settings(spider.redis_conn, crawler.settings)
+        # 集群封面/预告片名额：调度媒体相关请求前先申请，名额全部承诺后不再生成新的媒体工作
+        spider.quota = None
+        if crawler.settings.getbool('QUOTA_ENABLED', True):
+            spider.quota = QuotaAllocator.from_settings(spider.redis_conn, spider.target_counter, crawler.settings)
+        spider.quota_recheck_delay = crawler.settings.getfloat('QUOTA_RECHECK_DELAY', 300)
+        # 请求优先级（PRIORITY_ENGINE，默认按预期封面/预告片产出排序）
+        engine_cls = load_object(crawler.settings.get('PRIORITY_ENGINE', 'douban_crawler.priority.YieldPriorityEngine'))
+        spider.priority = engine_cls.from_settings(spider.redis_conn, spider.target_counter, crawler.settings)
+        # 详情页/预告片页请求只携带电影id，电影数据放在Redis旁路存储中
+        spider.movie_meta = MovieMetaStore.from_settings(spider.redis_conn, crawler.settings)
+        # top_list 分页计划（预调度多页，记录各区间页数）
+        spider.pagination = PaginationPlanner.from_settings(spider.redis_conn, cls.INTERVALS, crawler.settings)
+        # 增量模式：未变化的电影不再抓取详情页/预告片页，直接用保存的数据生成item
+        spider.movie_state = None
+        if crawler.settings.getbool('INCREMENTAL_MODE', False):
+            spider.movie_state = MovieStateStore.from_settings(spider.redis_conn, crawler.settings)
+        # 可选：详情页解析交给进程池（PARSE_POOL_ENABLED），未启用时为 None
+        spider.parse_pool = ParsePool.from_crawler(crawler)
 
         spider.logger.info(f"目标电影数量: {spider.target_count}")
         return spider
@@ -50,12 +80,12 @@ class DoubanSpider(RedisSpider):
 
     def start_requests(self):
         """生成初始请求（使用优先级队列）"""
-        # 获取最高优先级的URL
+        # 最高分区间的前几页（有历史记录时按历史页数展开）
         for movie_type in range(1, 32):  # 类型1-31
-            url = f"https://movie.douban.com/j/chart/top_list?type={movie_type}&interval_id=100:90&action=&start=0&limit=100"
-            yield scrapy.Request(url, callback=self.parse)
+            for interval_id, start in self.pagination.start(movie_type):
+                yield self.build_request(movie_type, interval_id, start)
 
-    def parse(self, response):
+    async def parse(self, response):
         """解析豆瓣电影API响应"""
         # 解析当前URL参数
         parsed = urlparse(response.url)
@@ -71,14 +101,29 @@ class DoubanSpider(RedisSpider):
             return
 
         # 检查爬取目标是否达到，若达到则关闭爬虫
-        self.check_target_reached()
+        await self.check_target_reached()
+
+        # 名额已全部承诺：本页稍后再处理（租约归还后名额可能重新空出），不认领其中的电影
+        if self.quota is not None and await self.redis.run(self.quota.exhausted):
+            await self.defer_request(response.request, self.quota_recheck_delay)
+            return
+
+        # 提交本地的产出统计、刷新集群统计（按需，多数页面不访问Redis）
+        await self.redis.run(self.priority.sync)
+
+        # 批量去重：整页只访问一次Redis，返回集群内首次出现的id（增量模式下为本次运行内首次出现）
+        new_ids = set(await self.redis.run(self.movie_deduper.claim, [movie_data['id'] for movie_data in movies]))
+        new_movies = [movie_data for movie_data in movies if str(movie_data['id']) in new_ids]
+
+        # 增量模式：整页一次查询，找出记录未变化且未过期的电影
+        unchanged = {}
+        if self.movie_state is not None:
+            unchanged = await self.redis.run(self.movie_state.unchanged, new_movies)
 
         # 处理电影数据
-        for movie_data in movies:
+        pending = []
+        for movie_data in new_movies:
             movie_id = movie_data['id']
-            # 去重检查
-            if self.redis_conn.sadd('douban:movie_ids', movie_id) == 0:
-                continue  # 已存在，跳过
 
             meta = {
                 'id': movie_id,
@@ -98,49 +143,132 @@ class DoubanSpider(RedisSpider):
                 'summary': None,
                 'cover_path': None,
                 'trailer_path': None,
+                'source_type': movie_type,
+                'source_interval': interval_id,
             }
 
-            # 生成新请求，详情页
+            stored = unchanged.get(str(movie_id))
+            if stored is not None:
+                # 详情字段取自保存的数据，API字段用本次的最新值
+                meta.update(stored)
+                self.crawler.stats.inc_value('incremental/unchanged')
+                granted = await self.acquire_quota(movie_id, cover=meta['cover'], trailer=meta['trailer'])
+                meta['cover'] = meta['cover'] if granted['cover'] else None
+                meta['trailer'] = meta['trailer'] if granted['trailer'] else None
+                yield self.create_item_from_dict(DoubanMovieItem, meta)
+                continue
+            if self.movie_state is not None:
+                meta['fingerprint'] = self.movie_state.fingerprint(movie_data)
+                self.crawler.stats.inc_value('incremental/refetch')
+
             if movie_data.get('url', ''):
-                yield scrapy.Request(movie_data['url'], callback=self.parse_detail, meta=meta, priority=int(1e9))
+                pending.append(meta)
+
+        # 整页的电影数据一次写入旁路存储，再生成详情页请求
+        await self.redis.run(self.movie_meta.put_many, pending)
+        for meta in pending:
+            yield scrapy.Request(meta['url'], callback=self.parse_detail, meta={'movie_id': meta['id']},
+                                 priority=self.priority.detail_priority(movie_type, interval_id, meta))
 
         # 生成新请求，下一top list页
-        yield from self.generate_next_requests(movie_type, interval_id, start, len(movies))
-
-    def parse_detail(self, response):
-        meta = response.meta
-        # 封面
-        meta['cover'] = response.css('meta[property="og:image"]::attr(content)').get()
-        # 热门评论
-        meta['hot_comments'] = response.css('div#hot-comments span.short::text').getall()
-        # 简介
-        intro_text = ' '.join(
-            response.css('#link-report-intra .all.hidden *::text').getall() or
-            response.css('#link-report-intra [property="v:summary"] *::text').getall() or
-            response.css('#link-report-intra .short [property="v:summary"] *::text').getall() or
-            response.css('#link-report-intra .indent *::text').getall()
-        )
+        for request in await self.generate_next_requests(movie_type, interval_id, start, len(movies)):
+            yield request
 
-        # 深度清理文本
-        if intro_text:
-            # 合并多余空白（但保留换行）
-            intro_text = '\n'.join(
-                line.strip()
-                for line in intro_text.split('\n')
-                if line.strip()
-            )
-        meta['summary'] = intro_text
-        trailer_href = response.css('a.related-pic-video::attr(href)').get()
-        if trailer_href:
-            yield scrapy.Request(trailer_href, callback=self.parse_video, meta=meta, priority=int(1e9))
+    async def parse_detail(self, response):
+        meta = await self.load_meta(response)
+        if meta is None:
+            return
+        # 一次遍历提取封面、热门评论、简介（已清理空白）和预告片链接
+        if self.parse_pool is not None:
+            page = DetailPage(**await self.parse_pool.extract_detail(response.body, response.encoding))
         else:
-            yield self.create_item_from_dict(DoubanMovieItem, meta)
+            page = extract_detail(response.selector.root)
+        # 记录该 (类型, 区间) 的封面/预告片命中情况（旁路数据缺少来源时跳过）
+        if meta.get('source_type') is not None:
+            self.priority.observe(meta['source_type'], meta['source_interval'], meta.get('vote_count'),
+                                  bool(page.cover), bool(page.trailer_url))
+        # 下载封面、抓取预告片页之前先申请名额
+        granted = await self.acquire_quota(meta['id'], cover=page.cover, trailer=page.trailer_url)
+        meta['cover'] = page.cover if granted['cover'] else None
+        meta['hot_comments'] = page.hot_comments
+        meta['summary'] = page.summary
+        if page.trailer_url and granted['trailer']:
+            await self.redis.run(self.movie_meta.put, meta)
+            yield scrapy.Request(page.trailer_url, callback=self.parse_video, errback=self.video_failed,
+                                 meta={'movie_id': meta['id']}, priority=response.request.priority)
+        else:
+            yield await self.build_item(meta)
 
 
-    def parse_video(self, response):
-        meta = response.meta
+    async def parse_video(self, response):
+        meta = await self.load_meta(response)
+        if meta is None:
+            return
         meta['trailer'] = response.css('video source::attr(src)').get()
-        yield self.create_item_from_dict(DoubanMovieItem, meta)
+        if not meta['trailer']:
+            # 没有视频地址（页面改版或被拦截后交给爬虫），不会再下载预告片
+            await self.release_quota(meta['id'], 'trailer')
+        yield await self.build_item(meta)
+
+    async def video_failed(self, failure):
+        """预告片页下载失败：归还预告片名额，item 照常生成（不含预告片）"""
+        if failure.check(IgnoreRequest):
+            return  # 被 BanMiddleware 等延迟重新入队，稍后还会再处理
+        request = failure.request
+        self.logger.warning(f"预告片页下载失败: {request.url} ({failure.getErrorMessage()})")
+        meta = await self.redis.run(self.movie_meta.get, request.meta['movie_id'])
+        if meta is None:
+            self.crawler.stats.inc_value('movie_meta/missing')
+            return
+        await self.release_quota(meta['id'], 'trailer')
+        meta['trailer'] = None
+        yield await self.build_item(meta)
+
+    async def load_meta(self, response):
+        """从旁路存储取出请求对应的电影数据"""
+        meta = await self.redis.run(self.movie_meta.get, response.meta['movie_id'])
+        if meta is None:
+            self.logger.warning(f"电影数据已过期或丢失，跳过: {response.url}")
+            self.crawler.stats.inc_value('movie_meta/missing')
+        return meta
+
+    async def build_item(self, meta):
+        """详情抓取完成，生成item（增量模式下同时保存电影状态）"""
+        await self.redis.run(self.finish_movie, meta)
+        return self.create_item_from_dict(DoubanMovieItem, meta)
+
+    async def acquire_quota(self, movie_id, **urls):
+        """为有链接的媒体申请名额，返回 {类型: 是否获得}（未启用名额分配时全部获得）"""
+        granted = {media_type: bool(url) for media_type, url in urls.items()}
+        wanted = [media_type for media_type, has_url in granted.items() if has_url]
+        if self.quota is None or not wanted:
+            return granted
+        granted.update(await self.redis.run(self.quota.acquire, movie_id, wanted))
+        for media_type in wanted:
+            self.crawler.stats.inc_value(f"quota/{'granted' if granted[media_type] else 'denied'}/{media_type}")
+        return granted
+
+    async def release_quota(self, movie_id, *media_types):
+        if self.quota is None:
+            return
+        await self.redis.run(self.quota.release, movie_id, media_types)
+        for media_type in media_types:
+            self.crawler.stats.inc_value(f'quota/released/{media_type}')
+
+    async def defer_request(self, request, delay):
+        """delay 秒后重新调度该请求（需要 LeasedPriorityQueue）"""
+        queue = get_queue(self.crawler)
+        if queue is None:
+            self.logger.warning(f"调度队列不支持延迟请求，丢弃: {request.url}")
+            return
+        await self.redis.run(queue.push_delayed, request, delay)
+        self.crawler.stats.inc_value('quota/deferred_pages')
+
+    def finish_movie(self, meta):
+        """保存增量状态并删除旁路数据（在Redis线程池中执行）"""
+        if self.movie_state is not None:
+            self.movie_state.save(meta['id'], meta.get('fingerprint'), meta)
+        self.movie_meta.delete(meta['id'])
 
     def create_item_from_dict(self, item_class, data_dict):
         """
@@ -165,43 +293,26 @@ class DoubanSpider(RedisSpider):
                 item[field_name] = value
         return item
 
-    def check_target_reached(self):
-        cover_count = self.redis_conn.scard('douban:cover_ids')
-        trailer_count = self.redis_conn.scard('douban:trailer_ids')
-        if cover_count >= self.target_count and trailer_count >= self.target_count:
+    async def check_target_reached(self):
+        if await self.redis.run(self.target_counter.target_reached):
             self.logger.info(f"已达到目标电影数量 {self.target_count}, 关闭爬虫")
             self.crawler.engine.close_spider(self, 'target_reached')
 
-    def generate_next_requests(self, movie_type, interval_id, start, movie_count):
-        """生成下一个请求"""
-        # 当前区间索引
-        interval_idx = self.INTERVALS.index(interval_id)
-
-        # 如果当前页返回的电影数量不足100，说明当前区间结束
-        if movie_count < 100:
-            # 尝试下一个区间
-            if interval_idx + 1 < len(self.INTERVALS):
-                next_interval = self.INTERVALS[interval_idx + 1]
-                next_start = 0
-                next_url = self.build_url(movie_type, next_interval, next_start)
-                priority = self.calculate_priority(next_interval, next_start)
-                yield scrapy.Request(next_url, callback=self.parse, priority=priority)
-        else:
-            # 当前区间还有下一页
-            next_start = start + 100
-            next_url = self.build_url(movie_type, interval_id, next_start)
-            priority = self.calculate_priority(interval_id, next_start)
-            yield scrapy.Request(next_url, callback=self.parse, priority=priority)
+    async def generate_next_requests(self, movie_type, interval_id, start, movie_count):
+        """生成后续请求：同一区间预先调度多页，区间首页返回后即开始下一区间"""
+        pages = await self.redis.run(self.pagination.plan, movie_type, interval_id, start, movie_count)
+        return [self.build_request(movie_type, next_interval, next_start) for next_interval, next_start in pages]
+
+    def build_request(self, movie_type, interval_id, start):
+        """构建 top_list 请求（meta['page'] 供 PaginationMiddleware 丢弃超出页数的请求）"""
+        return scrapy.Request(
+            self.build_url(movie_type, interval_id, start),
+            callback=self.parse,
+            priority=self.priority.page_priority(movie_type, interval_id, start),
+            meta={'page': (movie_type, interval_id, start)},
+        )
 
     def build_url(self, movie_type, interval_id, start):
         """构建API URL"""
         return f"https://movie.douban.com/j/chart/top_list?type={movie_type}&interval_id={interval_id}&action=&start={start}&limit=100"
 
-    def calculate_priority(self, interval_id, start):
-        """计算请求优先级"""
-        # 区间优先级：100:90 > 90:80 > ... > 10:0
-        interval_value = int(interval_id.split(':')[0])
-        page = start // 100
-        score = (100 - interval_value) * 1000 + page
-        return -score
-
@@ -0,0 +1,74 @@
+import time
+from typing import Tuple
+
+
+# 记录一部电影的封面/预告片下载结果，并返回最新的集群总数（一次往返）
+RECORD_SCRIPT = """
+if ARGV[2] == '1' then
+    redis.call('SADD', KEYS[1], ARGV[1])
+end
+if ARGV[3] == '1' then
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+return {redis.call('SCARD', KEYS[1]), redis.call('SCARD', KEYS[2])}
+"""
+
+
+class TargetCounter:
+    """封面/预告片目标计数
+
+    - 每个item最多一次脚本调用（无封面和预告片的item不访问Redis）
+    - 集群总数在本地缓存，超过 refresh_interval 秒才重新读取
+    - 爬虫和管道共用同一个 target_reached() 判断
+    """
+
+    def __init__(self, server, target_count, cover_key='douban:cover_ids',
+                 trailer_key='douban:trailer_ids', refresh_interval=5.0):
+        self.server = server
+        self.target_count = target_count
+        self.cover_key = cover_key
+        self.trailer_key = trailer_key
+        self.refresh_interval = refresh_interval
+        self.cover_total = 0
+        self.trailer_total = 0
+        self.last_refresh = 0.0
+        self._record_script = server.register_script(RECORD_SCRIPT)
+
+    @classmethod
+    def from_settings(cls, server, settings):
+        return cls(
+            server,
+            target_count=settings.getint('TARGET_MOVIE_COUNT', 10000),
+            refresh_interval=settings.getfloat('TARGET_REFRESH_INTERVAL', 5.0),
+        )
+
+    def record(self, movie_id, has_cover, has_trailer):
+        """记录下载结果，同时刷新本地缓存的集群总数"""
+        if not has_cover and not has_trailer:
+            return
+        totals = self._record_script(
+            keys=[self.cover_key, self.trailer_key],
+            args=[movie_id, int(bool(has_cover)), int(bool(has_trailer))],
+        )
+        self._update(*totals)
+
+    def totals(self) -> Tuple[int, int]:
+        """(封面数, 预告片数)，缓存过期时才访问Redis"""
+        if time.time() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+        return self.cover_total, self.trailer_total
+
+    def refresh(self):
+        pipe = self.server.pipeline(transaction=False)
+        pipe.scard(self.cover_key)
+        pipe.scard(self.trailer_key)
+        self._update(*pipe.execute())
+
+    def target_reached(self) -> bool:
+        cover_total, trailer_total = self.totals()
+        return cover_total >= self.target_count and trailer_total >= self.target_count
+
+    def _update(self, cover_total, trailer_total):
+        self.cover_total = int(cover_total)
+        self.trailer_total = int(trailer_total)
+        self.last_refresh = time.time()
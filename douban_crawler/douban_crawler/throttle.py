@@ -0,0 +1,168 @@
+import logging
+import time
+from typing import Dict
+
+from scrapy.exceptions import NotConfigured
+
+from douban_crawler.bans import BAN_CLASSES, classify_response
+from douban_crawler.utils import get_host_class
+
+
+# 请求类型 -> 下载槽位（同一槽位共享一个并发窗口）
+SLOT_FOR_CLASS = {
+    'api': 'douban-api',
+    'detail': 'douban-page',
+    'video': 'douban-page',
+    'image': 'douban-image',
+    'media': 'douban-media',
+}
+
+# 媒体通道下载的文件类型 -> 请求类型（启用 MEDIA_LANE_ENABLED 时这些请求不经过下载槽位）
+LANE_HOST_CLASSES = {
+    'cover': 'image',
+    'trailer': 'media',
+}
+
+# 各槽位的默认窗口: 初始/最小/最大并发，初始/最小/最大延迟，目标延迟（秒）
+DEFAULT_LIMITS = {
+    'douban-api': {'start': 1, 'min': 1, 'max': 4, 'delay': 2.5, 'min_delay': 0.5, 'max_delay': 30, 'target_latency': 2.0},
+    'douban-page': {'start': 1, 'min': 1, 'max': 4, 'delay': 2.5, 'min_delay': 0.5, 'max_delay': 30, 'target_latency': 3.0},
+    'douban-image': {'start': 4, 'min': 1, 'max': 32, 'delay': 0, 'min_delay': 0, 'max_delay': 5, 'target_latency': 3.0},
+    'douban-media': {'start': 2, 'min': 1, 'max': 16, 'delay': 0, 'min_delay': 0, 'max_delay': 5, 'target_latency': 30.0},
+}
+
+
+def is_ban_response(response, host_class):
+    """是否被限流/封禁: 429、403、跳转验证码/登录页、异常请求提示页、API 返回 HTML（见 bans.classify_response）"""
+    return classify_response(response, host_class) in BAN_CLASSES
+
+
+class HostWindow:
+    """一个下载槽位的 AIMD 并发窗口"""
+
+    def __init__(self, name, start, min, max, delay, min_delay, max_delay, target_latency):
+        self.name = name
+        self.concurrency = start
+        self.min_concurrency = min
+        self.max_concurrency = max
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.healthy_streak = 0
+        self.frozen_until = 0.0  # 被封禁后的冷却期内不再增加并发
+        self.bans = 0
+
+    def on_healthy(self, latency):
+        if latency > self.target_latency * 2:
+            # 延迟升高：保持窗口不变
+            self.healthy_streak = 0
+            return False
+        if time.time() < self.frozen_until:
+            return False
+        self.healthy_streak += 1
+        if self.healthy_streak < self.concurrency:
+            return False
+        # 整个窗口的请求都健康：并发加一，延迟缩短
+        self.healthy_streak = 0
+        self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+        self.delay = max(self.delay * 0.8, self.min_delay)
+        return True
+
+    def on_ban(self, backoff_factor, cooldown):
+        """乘性减小并发、加倍延迟"""
+        self.bans += 1
+        self.healthy_streak = 0
+        self.frozen_until = time.time() + cooldown
+        self.concurrency = max(int(self.concurrency * backoff_factor), self.min_concurrency)
+        self.delay = min(max(self.delay * 2, 1.0), self.max_delay)
+
+    def on_error(self):
+        self.healthy_streak = 0
+        self.concurrency = max(self.concurrency - 1, self.min_concurrency)
+
+    def to_dict(self) -> Dict:
+        return {
+            'concurrency': self.concurrency,
+            'delay': round(self.delay, 2),
+            'bans': self.bans,
+        }
+
+
+class AdaptiveConcurrencyMiddleware:
+    """按请求类型（API / 页面 / 图片CDN / 视频CDN）自适应调整并发和延迟
+
+    健康时加性增加并发，遇到 403/429/验证码时乘性回退，
+    当前窗口写入 stats 的 throttle/windows 供状态上报使用。
+    启用媒体通道时，走通道的类型（MEDIA_STREAM_TYPES）不设窗口，其并发只由 MEDIA_LANE_CONCURRENCY 控制。
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED', True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.logger = logging.getLogger(__name__)
+        self.backoff_factor = settings.getfloat('ADAPTIVE_BACKOFF_FACTOR', 0.5)
+        self.ban_cooldown = settings.getfloat('ADAPTIVE_BAN_COOLDOWN', 60)
+
+        limits = {name: dict(values) for name, values in DEFAULT_LIMITS.items()}
+        for name, values in settings.getdict('ADAPTIVE_CONCURRENCY_LIMITS').items():
+            limits.setdefault(name, dict(DEFAULT_LIMITS['douban-page'])).update(values)
+        if settings.getbool('MEDIA_LANE_ENABLED', True):
+            for media_type in settings.getlist('MEDIA_STREAM_TYPES', ['trailer']):
+                limits.pop(SLOT_FOR_CLASS[LANE_HOST_CLASSES[media_type]], None)
+        self.windows = {name: HostWindow(name, **values) for name, values in limits.items()}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        slot_name = SLOT_FOR_CLASS.get(get_host_class(request.url))
+        window = self.windows.get(slot_name)
+        if window is None or 'download_slot' in request.meta:
+            return
+        request.meta['download_slot'] = slot_name
+        # 槽位可能刚被 Scrapy 回收重建，重新写入当前窗口
+        self._apply_slot(window)
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response  # 缓存命中没有真实的下载延迟，不参与并发调整
+        window = self.windows.get(request.meta.get('download_slot'))
+        if window is None:
+            return response
+
+        host_class = get_host_class(request.url)
+        if is_ban_response(response, host_class):
+            window.on_ban(self.backoff_factor, self.ban_cooldown)
+            self.stats.inc_value(f'throttle/{window.name}/bans')
+            self.logger.info(f"{window.name} 疑似被限流 ({response.status} {response.url})，"
+                             f"并发降为 {window.concurrency}，延迟 {window.delay:.1f}s")
+        elif response.status >= 500:
+            window.on_error()
+        else:
+            window.on_healthy(request.meta.get('download_latency', 0))
+        self._apply(window)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        window = self.windows.get(request.meta.get('download_slot'))
+        if window is not None:
+            window.on_error()
+            self._apply(window)
+
+    def _apply(self, window):
+        """把窗口写入 Scrapy 下载槽位并发布到 stats"""
+        self._apply_slot(window)
+        self.stats.set_value(f'throttle/{window.name}/concurrency', window.concurrency)
+        self.stats.set_value(f'throttle/{window.name}/delay', window.delay)
+        self.stats.set_value('throttle/windows', {name: w.to_dict() for name, w in self.windows.items()})
+
+    def _apply_slot(self, window):
+        slot = self.crawler.engine.downloader.slots.get(window.name)
+        if slot is not None:
+            slot.concurrency = window.concurrency
+            slot.delay = window.delay
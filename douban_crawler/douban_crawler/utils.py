@@ -1,6 +1,7 @@
 import hashlib
 import os
 import socket
+from urllib.parse import urlparse
 
 
 def generate_fingerprint(url):
@@ -10,4 +11,24 @@ def generate_fingerprint(url):
 
 def get_node_id():
     """获取节点ID（可通过环境变量覆盖）"""
-    return os.getenv('NODE_ID', f"node_{socket.gethostname()}")
\ No newline at end of file
+    return os.getenv('NODE_ID', f"node_{socket.gethostname()}")
+
+
+def get_worker_node_id(index):
+    """多进程模式下第 index 个工作进程的节点ID（重启后保持不变，可续用自己的租约）"""
+    return f"{get_node_id()}_w{index}"
+
+
+def get_host_class(url):
+    """按请求类型给URL分类：api / detail / video / image / media / other"""
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    if host == 'movie.douban.com':
+        if parsed.path.startswith('/j/'):
+            return 'api'  # top_list 等 JSON 接口
+        if parsed.path.startswith('/trailer/'):
+            return 'video'  # 预告片播放页
+        return 'detail'
+    if host.endswith('doubanio.com'):
+        return 'image' if host.startswith('img') else 'media'  # 封面图 / 视频 CDN
+    return 'other'
@@ -1,8 +1,16 @@
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
+from tabulate import tabulate
+import argparse
 import logging
+import multiprocessing
 import os
+import queue
+import signal
+import time
 import redis
+from douban_crawler.bloom import ScalableBloomFilter
+from douban_crawler.utils import get_worker_node_id
 
 # 启用日志记录
 # logging.basicConfig(
@@ -10,6 +18,15 @@ import redis
 #     level=logging.INFO
 # )
 
+# 汇总表中展示的统计项
+SUMMARY_STATS = (
+    ('items', 'item_scraped_count'),
+    ('requests', 'downloader/request_count'),
+    ('responses', 'downloader/response_count'),
+    ('dropped', 'item_dropped_count'),
+    ('errors', 'log_count/ERROR'),
+)
+
 
 def initialize_redis(settings):
     """初始化Redis状态"""
@@ -19,11 +36,16 @@ def initialize_redis(settings):
     )
 
     # 清空旧状态
-    r.delete('douban:requests')
+    # 队列及其租约（否则上次运行留下的租约到期后会被放回刚清空的队列）
+    r.delete('douban:requests', 'douban:requests:leases', 'douban:requests:leased', 'douban:requests:lease_seq')
     r.delete('douban:dupefilter')
     r.delete('douban:movie_ids')
+    ScalableBloomFilter(r, 'douban:dupefilter:bloom').clear()
+    ScalableBloomFilter(r, 'douban:movie_ids:bloom').clear()
     r.delete('douban:cover_ids')
     r.delete('douban:trailer_ids')
+    r.delete('douban:quota:cover', 'douban:quota:trailer')
+    r.delete('douban:page_ends')  # 历史页数 douban:page_counts 保留
 
     # 添加初始URL
     # for movie_type in range(1, 32):  # 类型1-31
@@ -47,5 +69,144 @@ def run_spider():
     process.start()
 
 
+def run_worker(index, results):
+    """工作进程入口：独立的 CrawlerProcess，共享Redis中的请求队列"""
+    if hasattr(os, 'setpgrp'):
+        # 脱离终端的进程组，Ctrl+C 只发给启动器，由启动器统一转发（否则会被当作第二次信号强制退出）
+        os.setpgrp()
+    os.environ['NODE_ID'] = get_worker_node_id(index)
+
+    settings = get_project_settings()
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler('douban')
+    process.crawl(crawler)
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    summary = {name: stats.get(key, 0) for name, key in SUMMARY_STATS}
+    summary['finish_reason'] = stats.get('finish_reason', '')
+    results.put((index, summary))
+
+
+class Launcher:
+    """多进程启动器：每个工作进程一个 CrawlerProcess
+
+    - 节点ID为 {NODE_ID}_w{序号}，重启后不变
+    - 异常退出的工作进程按指数退避重启，超过 max_restarts 次后放弃
+    - SIGINT/SIGTERM 转发给所有工作进程（第一次优雅关闭，第二次强制退出）
+    - 全部退出后打印汇总表
+    """
+
+    def __init__(self, workers, max_restarts=5, restart_delay=5.0):
+        self.workers = workers
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context('spawn')  # 不继承父进程的reactor状态
+        self.results = self.context.Queue()
+        self.processes = {}  # 序号 -> Process
+        self.restarts = {index: 0 for index in range(workers)}
+        self.restart_at = {}  # 序号 -> 计划重启时间
+        self.exit_codes = {}
+        self.summaries = {}
+        self.started = {}
+        self.stopping = 0  # 收到的关闭信号次数
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        for index in range(self.workers):
+            self.start_worker(index)
+
+        while self.processes or self.restart_at:
+            self.collect_results()
+            self.check_workers()
+            time.sleep(1)
+        self.collect_results()
+        self.print_summary()
+        return 0 if all(code == 0 for code in self.exit_codes.values()) else 1
+
+    def start_worker(self, index):
+        process = self.context.Process(target=run_worker, args=(index, self.results),
+                                       name=get_worker_node_id(index))
+        process.start()
+        self.processes[index] = process
+        self.started.setdefault(index, time.time())
+        logging.info(f"工作进程 {process.name} 已启动 (pid={process.pid})")
+
+    def check_workers(self):
+        now = time.time()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            del self.processes[index]
+            self.exit_codes[index] = process.exitcode
+            if process.exitcode == 0 or self.stopping:
+                logging.info(f"工作进程 {process.name} 已退出 (exitcode={process.exitcode})")
+            elif self.restarts[index] >= self.max_restarts:
+                logging.error(f"工作进程 {process.name} 重启 {self.restarts[index]} 次后仍异常退出，放弃")
+            else:
+                delay = self.restart_delay * 2 ** self.restarts[index]
+                self.restarts[index] += 1
+                self.restart_at[index] = now + delay
+                logging.warning(f"工作进程 {process.name} 异常退出 (exitcode={process.exitcode})，{delay:.0f} 秒后重启")
+
+        for index, restart_at in list(self.restart_at.items()):
+            if self.stopping:
+                del self.restart_at[index]
+            elif now >= restart_at:
+                del self.restart_at[index]
+                self.start_worker(index)
+
+    def collect_results(self):
+        while True:
+            try:
+                index, summary = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.summaries[index] = summary
+
+    def handle_signal(self, signum, frame):
+        self.stopping += 1
+        logging.info(f"收到信号 {signal.Signals(signum).name}，转发给 {len(self.processes)} 个工作进程")
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def print_summary(self):
+        rows = []
+        elapsed = time.time() - min(self.started.values(), default=time.time())
+        for index in range(self.workers):
+            summary = self.summaries.get(index, {})
+            rows.append([
+                get_worker_node_id(index),
+                self.exit_codes.get(index, ''),
+                self.restarts[index],
+                summary.get('finish_reason', ''),
+                *(summary.get(name, 0) for name, _ in SUMMARY_STATS),
+            ])
+        total = ['合计', '', sum(self.restarts.values()), '']
+        total += [sum(row[4 + i] for row in rows) for i in range(len(SUMMARY_STATS))]
+        headers = ['节点', '退出码', '重启', '结束原因'] + [name for name, _ in SUMMARY_STATS]
+        print(tabulate(rows + [total], headers=headers, tablefmt='grid'))
+        items = total[4]
+        print(f"耗时 {elapsed:.0f} 秒，{items / max(elapsed, 1e-9) * 60:.1f} items/分钟")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动豆瓣电影爬虫')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='工作进程数（共享Redis请求队列），0 表示CPU核数，1 为单进程直接运行')
+    parser.add_argument('--max-restarts', type=int, default=5, help='单个工作进程异常退出后的最大重启次数')
+    parser.add_argument('--restart-delay', type=float, default=5.0, help='首次重启的等待秒数（之后指数增长）')
+    args = parser.parse_args()
+
+    workers = args.workers or os.cpu_count() or 1
+    if workers == 1:
+        run_spider()
+        return 0
+    logging.basicConfig(format='%(asctime)s [launcher] %(levelname)s: %(message)s', level=logging.INFO)
+    return Launcher(workers, max_restarts=args.max_restarts, restart_delay=args.restart_delay).run()
+
+
 if __name__ == "__main__":
-    run_spider()
\ No newline at end of file
+    raise SystemExit(main())
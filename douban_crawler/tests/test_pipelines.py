@@ -0,0 +1,96 @@
+import os
+import time
+from types import SimpleNamespace
+
+import fakeredis
+from scrapy import Spider
+from scrapy.core.downloader.middleware import DownloaderMiddlewareManager
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from douban_crawler import redis_client
+from douban_crawler.items import DoubanMovieItem
+from douban_crawler.pipelines import CustomFilesPipeline
+from douban_crawler.redis_client import RedisClient
+
+
+def run(coro, timeout=5.0):
+    """手动推进 reactor 直到协程完成（MediaPipeline 内部用 callLater 调度回调）"""
+    result = []
+    defer.ensureDeferred(coro).addBoth(result.append)
+    deadline = time.time() + timeout
+    while not result and time.time() < deadline:
+        reactor.iterate(0.01)
+    assert result, '协程超时未完成'
+    if isinstance(result[0], Failure):
+        result[0].raiseException()
+    return result[0]
+
+
+def make_crawler(tmp_path, **settings):
+    crawler = get_crawler(Spider, dict({'FILES_STORE': str(tmp_path), 'MEDIA_STREAM_TYPES': []}, **settings))
+    spider = crawler._create_spider('douban')
+    redis_client._clients[crawler] = RedisClient(fakeredis.FakeRedis(decode_responses=True), pool_size=0)
+    return crawler, spider
+
+
+def make_pipeline(tmp_path):
+    crawler, spider = make_crawler(tmp_path)
+    pipeline = CustomFilesPipeline.from_crawler(crawler)
+    pipeline.open_spider(spider)
+    downloaded = []
+
+    def download(request, spider):
+        downloaded.append(request.url)
+        return defer.succeed(Response(request.url, body=b'jpeg', request=request))
+
+    pipeline.download_func = download
+    return pipeline, spider, downloaded
+
+
+def test_item_with_cover_is_downloaded(tmp_path):
+    pipeline, spider, downloaded = make_pipeline(tmp_path)
+    item = DoubanMovieItem(id='1291546', title='霸王别姬', cover='https://img1.doubanio.com/view/p1.jpg',
+                           trailer=None)
+
+    result = run(pipeline.process_item(item, spider))
+
+    assert downloaded == ['https://img1.doubanio.com/view/p1.jpg']
+    assert result['has_cover'] is True
+    assert result['cover_path'] == 'cover/霸王别姬_1291546.jpg'
+    assert (tmp_path / 'cover' / '霸王别姬_1291546.jpg').read_bytes() == b'jpeg'
+
+
+def test_media_lane_requests_pass_downloader_middlewares(tmp_path):
+    crawler, spider = make_crawler(tmp_path, MEDIA_STREAM_TYPES=['trailer'], USER_AGENT='test-agent')
+    middleware = DownloaderMiddlewareManager.from_crawler(crawler)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(middleware=middleware))
+    pipeline = CustomFilesPipeline.from_crawler(crawler)
+    pipeline.open_spider(spider)
+    fetched = []
+
+    async def fetch(request, path):
+        # 替换实际的网络下载，只记录经过中间件后的请求
+        fetched.append(request)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'mp4')
+        request.meta['download_latency'] = 0.0
+        request.meta['stream_checksum'] = 'checksum'
+        request.meta['stream_size'] = 3
+        return Response(request.url, request=request, flags=['streamed'])
+
+    pipeline.lane.streamer.fetch = fetch
+    item = DoubanMovieItem(id='1291546', title='霸王别姬', url='https://movie.douban.com/subject/1291546/',
+                           cover=None, trailer='https://vt1.doubanio.com/view/movie/M/1.mp4')
+
+    result = run(pipeline.process_item(item, spider))
+
+    assert result['has_trailer'] is True
+    assert result['trailer_path'] == 'trailer/霸王别姬_1291546.mp4'
+    headers = fetched[0].headers
+    assert headers[b'User-Agent'] == b'test-agent'
+    assert headers[b'Referer'] == b'https://movie.douban.com/subject/1291546/'
+    assert b'Accept-Language' in headers  # DEFAULT_REQUEST_HEADERS
@@ -1,79 +1,296 @@
+import argparse
 import json
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
 
 import redis
-import time
 from tabulate import tabulate
-from datetime import datetime
 
+# 集群计数（每次刷新一次管道读取）
+COUNTER_KEYS = (
+    ('queue', 'zcard', 'douban:requests'),
+    ('leased', 'zcard', 'douban:requests:leases'),
+    ('movies', 'scard', 'douban:movie_ids'),
+    ('covers', 'scard', 'douban:cover_ids'),
+    ('trailers', 'scard', 'douban:trailer_ids'),
+    ('cover_leases', 'zcard', 'douban:quota:cover'),
+    ('trailer_leases', 'zcard', 'douban:quota:trailer'),
+)
+# 只会增长的集群计数（变小说明被重置）；queue/leased 等是瞬时量，会正常上下波动
+MONOTONIC_COUNTERS = ('movies', 'covers', 'trailers')
+NODE_COUNTERS = ('requests', 'items', 'cover', 'trailer')
 
-def monitor_cluster(redis_host='localhost', redis_port=6379):
-    r = redis.StrictRedis(host=redis_host, port=redis_port, decode_responses=True)
 
-    while True:
-        # 清屏
-        print("\033c", end="")
+def load_target_count(default=10000):
+    """从项目 settings 读取 TARGET_MOVIE_COUNT（监控脚本在项目目录之外运行）"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'douban_crawler'))
+    try:
+        from douban_crawler import settings
+    except ImportError:
+        return default
+    return getattr(settings, 'TARGET_MOVIE_COUNT', default)
 
-        # 获取队列状态
-        queue_size = r.zcard('douban:requests')
-        movie_count = r.scard('douban:movie_ids')
-        dupefilter_size = r.scard('douban:dupefilter')
-        cover_count = r.scard('douban:cover_ids')
-        trailer_count = r.scard('douban:trailer_ids')
 
-        # 获取节点状态
-        nodes = r.hgetall('crawler:nodes')
-        stats = []
-        active_nodes = 0
+class RateWindow:
+    """滚动窗口：保存 (时间, 计数) 样本，速率 = 窗口内首尾差 / 时间差
+
+    monotonic 中的计数变小时清空窗口（节点重启或键被清空），其余值视为瞬时量，不参与判断。
+    """
+
+    def __init__(self, seconds, monotonic=()):
+        self.seconds = seconds
+        self.monotonic = monotonic
+        self.samples = deque()
+
+    def add(self, timestamp, values):
+        if self.samples and any(values[name] < self.samples[-1][1][name] for name in self.monotonic):
+            self.samples.clear()
+        self.samples.append((timestamp, values))
+        while len(self.samples) > 2 and timestamp - self.samples[1][0] >= self.seconds:
+            self.samples.popleft()
+
+    def rate(self, name, seconds=None):
+        """每秒增量；seconds 指定时只看最近这段时间"""
+        if len(self.samples) < 2:
+            return 0.0
+        end_time, end = self.samples[-1]
+        start_time, start = self.samples[0]
+        if seconds is not None:
+            for start_time, start in self.samples:
+                if end_time - start_time <= seconds:
+                    break
+        if end_time <= start_time:
+            return 0.0
+        return (end[name] - start[name]) / (end_time - start_time)
+
+    def latest(self, name, default=0):
+        return self.samples[-1][1][name] if self.samples else default
+
+
+class NodeState:
+    def __init__(self, node_id, window):
+        self.node_id = node_id
+        self.status = 'unknown'
+        self.reason = ''
+        self.last_update = 0
+        self.last_progress = 0  # 最近一次 requests/items 增长的时间
+        self.window = RateWindow(window, monotonic=NODE_COUNTERS)
+
+    def apply(self, event):
+        timestamp = int(event.get('last_update') or 0)
+        values = {name: int(event.get(name) or 0) for name in NODE_COUNTERS}
+        latest = self.window.samples[-1][1] if self.window.samples else None
+        if latest is None or values['requests'] != latest['requests'] or values['items'] != latest['items']:
+            self.last_progress = timestamp
+        self.window.add(timestamp, values)
+        self.status = event.get('status', self.status)
+        self.reason = event.get('reason', '')
+        self.last_update = timestamp
+
+
+class ClusterMonitor:
+    """事件驱动的集群监控
+
+    - 订阅 StatusExtension 写入的 crawler:events stream（XREAD 阻塞读取），启动时先回放窗口内的事件
+    - 集群计数每次刷新只用一次管道往返读取
+    - 滚动窗口计算各节点和集群的 requests/s、items/s，以及封面/预告片速率和达到目标的ETA
+    - 有心跳但长时间无进展的节点报告为停滞，超时无心跳的报告为离线
+    """
+
+    def __init__(self, server, target, stream_key='crawler:events', window=300.0, short_window=60.0,
+                 refresh=2.0, stall_after=120.0, offline_after=30.0):
+        self.server = server
+        self.target = target
+        self.stream_key = stream_key
+        self.window = window
+        self.short_window = short_window
+        self.refresh = refresh
+        self.stall_after = stall_after
+        self.offline_after = offline_after
+        self.nodes = {}
+        self.counters = RateWindow(window, monotonic=MONOTONIC_COUNTERS)
+        self.last_id = f'{int((time.time() - window) * 1000)}-0'
 
-        for node_id, status_str in nodes.items():
+    def run(self, redis_host, redis_port):
+        self.bootstrap()
+        next_refresh = 0.0
+        while True:
+            now = time.time()
+            if now >= next_refresh:
+                self.poll_counters()
+                self.render(redis_host, redis_port)
+                next_refresh = now + self.refresh
+            self.read_events(block_ms=max(int((next_refresh - time.time()) * 1000), 1))
+
+    def bootstrap(self):
+        """回放窗口内的事件；窗口内没有事件的节点以 crawler:nodes 中的最新状态为初始状态"""
+        while self.read_events(block_ms=None) == 1000:
+            pass
+        for node_id, status_str in self.server.hgetall('crawler:nodes').items():
+            if node_id in self.nodes:
+                continue
             try:
-                status_data = json.loads(status_str)
-                last_update = status_data.get('last_update', 0)
-
-                # 检查是否活跃（最近30秒内有更新）
-                is_active = time.time() - last_update < 30
-                if is_active:
-                    active_nodes += 1
-
-                # 格式化最后更新时间
-                last_time = datetime.fromtimestamp(last_update).strftime('%H:%M:%S') if last_update else 'N/A'
-
-                stats.append([
-                    node_id,
-                    status_data.get('requests', 'N/A'),
-                    status_data.get('items', 'N/A'),
-                    status_data.get('cover', 'N/A'),
-                    status_data.get('trailer', 'N/A'),
-                    last_time,
-                    '✓' if is_active else '✗'
-                ])
-            except Exception as e:
-                stats.append([node_id, 'ERROR', 'ERROR', 'ERROR', 'ERROR', 'ERROR', 'ERROR'])
-
-        # 打印监控信息
-        print(f"==== Douban Movie Crawler Monitor ====")
-        print(f"Redis Server: {redis_host}:{redis_port}")
-        print(f"URL Queue: {queue_size} | Unique Movies: {movie_count} "
-              f"| Covers: {cover_count} | Trailers: {trailer_count}")
-        print(f"Active Nodes: {active_nodes}/{len(nodes)}\n")
-
-        # 打印节点状态表格
-        print(tabulate(stats,
-                       headers=['Node ID', 'Requests', 'Items', 'Covers', 'Trailers', 'Last Update', 'Active'],
+                self.node(node_id).apply(json.loads(status_str))
+            except (TypeError, ValueError):
+                continue
+
+    def node(self, node_id):
+        state = self.nodes.get(node_id)
+        if state is None:
+            state = self.nodes[node_id] = NodeState(node_id, self.window)
+        return state
+
+    def read_events(self, block_ms):
+        """返回读取的事件数（block_ms 为 None 时不阻塞）"""
+        response = self.server.xread({self.stream_key: self.last_id}, count=1000, block=block_ms)
+        count = 0
+        for _, entries in response or ():
+            for entry_id, event in entries:
+                self.last_id = entry_id
+                count += 1
+                if 'node' in event:
+                    self.node(event['node']).apply(event)
+        return count
+
+    def poll_counters(self):
+        pipe = self.server.pipeline(transaction=False)
+        for _, command, key in COUNTER_KEYS:
+            getattr(pipe, command)(key)
+        values = dict(zip((name for name, _, _ in COUNTER_KEYS), map(int, pipe.execute())))
+        self.counters.add(time.time(), values)
+
+    def node_health(self, state, now):
+        if state.status == 'closed':
+            return 'closed'
+        if now - state.last_update >= self.offline_after:
+            return 'OFFLINE'
+        if state.status == 'running' and now - state.last_progress >= self.stall_after:
+            return 'STALLED'
+        return 'ok'
+
+    def eta(self, done_name):
+        """(剩余数, 速率/秒, 预计秒数)"""
+        remaining = self.target - self.counters.latest(done_name)
+        rate = self.counters.rate(done_name)
+        if remaining <= 0:
+            return 0, rate, 0.0
+        return remaining, rate, remaining / rate if rate > 0 else None
+
+    def render(self, redis_host, redis_port):
+        now = time.time()
+        rows = []
+        alerts = []
+        cluster_requests = cluster_items = cluster_items_short = 0.0
+        active_nodes = 0
+        for node_id in sorted(self.nodes):
+            state = self.nodes[node_id]
+            health = self.node_health(state, now)
+            if health == 'closed' and now - state.last_update > self.window:
+                del self.nodes[node_id]
+                continue
+            if health == 'ok':
+                active_nodes += 1
+            elif health != 'closed':
+                idle = now - (state.last_update if health == 'OFFLINE' else state.last_progress)
+                alerts.append(f"{health}: {node_id} 已 {idle:.0f} 秒"
+                              f"{'无心跳' if health == 'OFFLINE' else '无进展'}")
+            window = state.window
+            requests_rate, items_rate = window.rate('requests'), window.rate('items')
+            if health != 'closed':
+                cluster_requests += requests_rate
+                cluster_items += items_rate
+                cluster_items_short += window.rate('items', self.short_window)
+            last_time = datetime.fromtimestamp(state.last_update).strftime('%H:%M:%S') if state.last_update else 'N/A'
+            rows.append([
+                node_id,
+                state.status + (f' ({state.reason})' if state.reason else ''),
+                window.latest('requests'),
+                window.latest('items'),
+                f'{requests_rate:.2f}',
+                f'{items_rate:.2f}',
+                f"{window.rate('cover') * 60:.1f}",
+                f"{window.rate('trailer') * 60:.1f}",
+                last_time,
+                health,
+            ])
+
+        counters = self.counters
+        print("\033[H\033[J", end="")
+        print("==== Douban Movie Crawler Monitor ====")
+        print(f"Redis Server: {redis_host}:{redis_port} | Stream: {self.stream_key} | Window: {self.window:.0f}s")
+        print(f"URL Queue: {counters.latest('queue')} (leased {counters.latest('leased')}) "
+              f"| Unique Movies: {counters.latest('movies')} "
+              f"| Covers: {counters.latest('covers')} (+{counters.latest('cover_leases')} leased) "
+              f"| Trailers: {counters.latest('trailers')} (+{counters.latest('trailer_leases')} leased)")
+        trend = '↑' if cluster_items_short > cluster_items * 1.1 else '↓' if cluster_items_short < cluster_items * 0.9 else '→'
+        print(f"Cluster: {cluster_requests:.2f} req/s | {cluster_items:.2f} items/s "
+              f"({cluster_items_short:.2f} last {self.short_window:.0f}s {trend}) "
+              f"| Active Nodes: {active_nodes}/{len(self.nodes)}")
+        etas = []
+        for label, name in (('covers', 'covers'), ('trailers', 'trailers')):
+            remaining, rate, seconds = self.eta(name)
+            if seconds == 0:
+                etas.append(f"{label}: reached")
+            elif seconds is None:
+                etas.append(f"{label}: {remaining} left, no progress")
+            else:
+                etas.append(f"{label}: {remaining} left @ {rate * 60:.1f}/min, ETA {format_duration(seconds)}")
+        print(f"Target {self.target}: " + ' | '.join(etas) + "\n")
+
+        print(tabulate(rows,
+                       headers=['Node ID', 'Status', 'Requests', 'Items', 'req/s', 'items/s',
+                                'covers/min', 'trailers/min', 'Last Update', 'Health'],
                        tablefmt='grid'))
+        if alerts:
+            print("\nAlerts:")
+            for alert in alerts:
+                print(f"  ! {alert}")
 
-        # 打印当前时间
         print(f"\n{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print("Press Ctrl+C to exit...")
 
-        time.sleep(2)  # 每2秒刷新一次
 
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours}h{minutes:02d}m' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def monitor_cluster(redis_host='localhost', redis_port=6379, **kwargs):
+    r = redis.StrictRedis(host=redis_host, port=redis_port, decode_responses=True)
+    ClusterMonitor(r, **kwargs).run(redis_host, redis_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='豆瓣电影爬虫集群监控')
+    parser.add_argument('--host', default='10.109.253.108', help='Redis地址')
+    parser.add_argument('--port', type=int, default=6379, help='Redis端口')
+    parser.add_argument('--target', type=int, default=None, help='封面/预告片目标数（默认读取 TARGET_MOVIE_COUNT）')
+    parser.add_argument('--window', type=float, default=300, help='速率计算的滚动窗口（秒）')
+    parser.add_argument('--refresh', type=float, default=2, help='刷新间隔（秒）')
+    parser.add_argument('--stall-after', type=float, default=120, help='有心跳但无进展多少秒后报告停滞')
+    parser.add_argument('--offline-after', type=float, default=30, help='多少秒无心跳报告离线')
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    redis_host = "10.109.253.108"
     try:
-        monitor_cluster(redis_host=redis_host)
+        monitor_cluster(
+            redis_host=args.host,
+            redis_port=args.port,
+            target=args.target or load_target_count(),
+            window=args.window,
+            refresh=args.refresh,
+            stall_after=args.stall_after,
+            offline_after=args.offline_after,
+        )
     except KeyboardInterrupt:
         print("\nMonitoring stopped")
     except redis.ConnectionError:
         print("Error: Could not connect to Redis server")
+
+
+if __name__ == "__main__":
+    main()